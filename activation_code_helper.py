@@ -0,0 +1,117 @@
+"""
+أكواد تفعيل الأجهزة المعلقة في الذاكرة
+
+المشكلة:
+- activate_code_api يبحث في device_activation_codes لكل كود يُدخل (حتى الأكواد العشوائية الخاطئة)
+- الأكواد المنتهية غير المستخدمة تتراكم في الجدول للأبد
+- الكود 6 أرقام فقط، وقد يتكرر مع كود آخر ما زال معلقاً
+
+الحل:
+- مجموعة (dict) في الذاكرة بكل الأكواد غير المستخدمة: الكود الغير موجود فيها يرفض بدون أي Query
+- عند عدم العثور: إعادة تحميل من القاعدة بحد أقصى مرة كل ACTIVATION_CODE_RELOAD_INTERVAL
+  (لأكواد أنشأتها عملية أخرى) - محاولات التخمين المتتالية لا تصل للقاعدة
+- مهمة دورية تحذف الأكواد المنتهية (DELETE واحد) وتزيلها من الذاكرة
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+from models import db, DeviceActivationCode
+from config import ACTIVATION_CODE_PURGE_INTERVAL, ACTIVATION_CODE_PURGE_GRACE, ACTIVATION_CODE_RELOAD_INTERVAL
+import background_tasks
+
+
+class OutstandingCodes:
+    """الأكواد غير المستخدمة: code -> expires_at"""
+
+    def __init__(self, reload_interval=ACTIVATION_CODE_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._codes = {}
+        self._loaded = False
+        self._last_reload = 0
+        self._lock = threading.Lock()
+        self._rejected = 0
+        self._reloads = 0
+
+    def load(self):
+        """تحميل كل الأكواد غير المستخدمة من القاعدة"""
+        rows = db.session.query(
+            DeviceActivationCode.activation_code,
+            DeviceActivationCode.expires_at
+        ).filter(DeviceActivationCode.is_used == False).all()
+
+        with self._lock:
+            self._codes = {code: expires_at for code, expires_at in rows}
+            self._loaded = True
+            self._last_reload = time.monotonic()
+            self._reloads += 1
+
+    def add(self, code, expires_at):
+        with self._lock:
+            self._codes[code] = expires_at
+
+    def discard(self, code):
+        with self._lock:
+            self._codes.pop(code, None)
+
+    def contains(self, code):
+        """هل الكود معلق حالياً (بدون إعادة تحميل) - لتجنب توليد كود مكرر"""
+        if not self._loaded:
+            self.load()
+        return code in self._codes
+
+    def might_exist(self, code):
+        """
+        False يعني أن الكود غير موجود بالتأكيد (لا داعي للبحث في القاعدة)
+        True يعني أنه قد يكون موجوداً (يجب التحقق من القاعدة)
+
+        الأكواد المنتهية تبقى هنا حتى حذفها حتى تظهر رسالة "انتهت الصلاحية" بدل "غير موجود"
+        """
+        if not self._loaded:
+            self.load()
+        if code in self._codes:
+            return True
+
+        if time.monotonic() - self._last_reload >= self.reload_interval:
+            self.load()
+            if code in self._codes:
+                return True
+
+        with self._lock:
+            self._rejected += 1
+        return False
+
+    def purge_expired(self, grace_seconds=ACTIVATION_CODE_PURGE_GRACE):
+        """حذف الأكواد المنتهية غير المستخدمة من القاعدة والذاكرة"""
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                DeviceActivationCode.__table__.delete().where(
+                    DeviceActivationCode.__table__.c.is_used == False,
+                    DeviceActivationCode.__table__.c.expires_at < cutoff
+                )
+            )
+
+        with self._lock:
+            self._codes = {
+                code: expires_at for code, expires_at in self._codes.items()
+                if expires_at is None or expires_at >= cutoff
+            }
+
+        if result.rowcount:
+            print(f"🧹 تم حذف {result.rowcount} كود تفعيل منتهي")
+        return result.rowcount
+
+    def stats(self):
+        with self._lock:
+            return {
+                'outstanding_codes': len(self._codes),
+                'rejected_without_query': self._rejected,
+                'reloads': self._reloads
+            }
+
+
+outstanding_codes = OutstandingCodes()
+
+background_tasks.register_periodic('activation_codes_purge', ACTIVATION_CODE_PURGE_INTERVAL, outstanding_codes.purge_expired)
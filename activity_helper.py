@@ -0,0 +1,120 @@
+"""
+تجميع تحديثات نشاط الأجهزة (Write-Behind)
+
+المشكلة:
+- كل تشغيل قناة / تسجيل دخول كان يعمل:
+  device.last_login_at = now; device.last_ip = ...; db.session.commit()
+- أي أن كل zap = Write Transaction، وهذا يتسلسل بشكل سيء على SQLite
+
+الحل:
+- الاحتفاظ بآخر وقت و IP لكل جهاز في الذاكرة
+- تفريغها كل بضع ثوانٍ بـ UPDATE واحد (executemany)
+- تفريغ أخير عند إغلاق التطبيق
+"""
+
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam
+from models import db, Device
+from config import ACTIVITY_FLUSH_INTERVAL
+import background_tasks
+
+
+class DeviceActivityBuffer:
+    """Buffer لآخر نشاط لكل جهاز"""
+
+    def __init__(self):
+        self._pending = {}  # device_id -> (last_login_at, last_ip)
+        self._lock = threading.Lock()
+        self._recorded = 0
+        self._flushed_rows = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+
+    def record(self, device_id, ip_address, when=None):
+        """تسجيل نشاط جهاز (بدون أي كتابة في قاعدة البيانات)"""
+        when = when or datetime.utcnow()
+        with self._lock:
+            self._pending[device_id] = (when, ip_address)
+            self._recorded += 1
+
+    def get(self, device_id):
+        """آخر نشاط غير مكتوب بعد للجهاز أو None"""
+        with self._lock:
+            return self._pending.get(device_id)
+
+    def flush(self):
+        """كتابة كل النشاط المعلق بـ UPDATE واحد"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+
+        rows = [{
+            'b_id': device_id,
+            'b_last_login_at': when,
+            'b_last_ip': ip_address
+        } for device_id, (when, ip_address) in pending.items()]
+
+        stmt = Device.__table__.update().where(
+            Device.__table__.c.id == bindparam('b_id')
+        ).values(
+            last_login_at=bindparam('b_last_login_at'),
+            last_ip=bindparam('b_last_ip')
+        )
+
+        try:
+            # اتصال مستقل حتى لا نتداخل مع session الطلب الحالي
+            with db.engine.begin() as connection:
+                connection.execute(stmt, rows)
+        except Exception as e:
+            # إعادة النشاط للـ buffer (مع الإبقاء على الأحدث إن سُجل نشاط جديد)
+            with self._lock:
+                for device_id, value in pending.items():
+                    self._pending.setdefault(device_id, value)
+                self._failed_flushes += 1
+            print(f"❌ خطأ في تفريغ نشاط الأجهزة: {str(e)}")
+            return 0
+
+        with self._lock:
+            self._flushed_rows += len(rows)
+            self._flushes += 1
+        return len(rows)
+
+    def stats(self):
+        """مقاييس تقليل الكتابة: عدد الأحداث مقابل عدد الصفوف والـ transactions الفعلية"""
+        with self._lock:
+            recorded = self._recorded
+            return {
+                'recorded_events': recorded,
+                'flushed_rows': self._flushed_rows,
+                'flush_transactions': self._flushes,
+                'failed_flushes': self._failed_flushes,
+                'pending_devices': len(self._pending),
+                'write_reduction_percent': round(
+                    (1 - self._flushes / recorded) * 100, 1
+                ) if recorded else 0
+            }
+
+
+device_activity = DeviceActivityBuffer()
+
+background_tasks.register_periodic('device_activity_flush', ACTIVITY_FLUSH_INTERVAL, device_activity.flush)
+background_tasks.register_shutdown(device_activity.flush)
+
+
+def record_device_activity(device, ip_address, when=None):
+    """بديل device.last_login_at = now; device.last_ip = ip; db.session.commit()"""
+    device_activity.record(device.id, ip_address, when)
+
+
+def get_device_last_seen(device):
+    """
+    آخر نشاط للجهاز مع مراعاة الـ buffer (لصفحات تفاصيل الأجهزة)
+
+    يعيد: (last_login_at, last_ip)
+    """
+    buffered = device_activity.get(device.id)
+    if buffered:
+        return buffered
+    return device.last_login_at, device.last_ip
@@ -0,0 +1,187 @@
+"""
+تحليلات الموزع لأي فترة ودقة (NumPy)
+
+المشكلة:
+- صفحة التحليلات تدعم 4 فترات ثابتة فقط (يومي، أسبوعي، شهري، سنوي)
+- أي فترة أخرى (مثلاً آخر 90 يوماً بالأسبوع) أو توقع الاشتراكات التي ستنتهي
+  يحتاج Query لكل فترة جزئية
+
+الحل:
+- تحميل أوقات التفعيل والانتهاء للموزع مرة واحدة كمصفوفات datetime64 مرتبة
+  (كاش لكل موزع، يحذف عند أي تفعيل أو تغيير حالة)
+- التقسيم لفترات = searchsorted على حدود الفترات (بدون أي Query وبدون حلقة على الصفوف)
+- توقع الانتهاء: نفس التقسيم على تواريخ انتهاء الاشتراكات السنوية غير الموقوفة
+"""
+
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select
+from models import db, ActivationCode
+from performance_helper import TTLCache
+from subscription_helper import STATUS_SUSPENDED
+from config import ANALYTICS_CACHE_TTL, ANALYTICS_CACHE_MAX_RESELLERS, ANALYTICS_MAX_BUCKETS
+
+# الدقة -> (وحدة datetime64 للتقريب، الخطوة بوحدة التقريب، وحدة النص في labels)
+GRANULARITIES = {
+    'hour': ('h', 1, 'h'),
+    'day': ('D', 1, 'D'),
+    'week': ('D', 7, 'D'),
+    'month': ('M', 1, 'M'),
+    'year': ('Y', 1, 'Y')
+}
+
+_LOAD_BATCH_SIZE = 50000
+
+
+def _to_datetime64(values):
+    """تحويل قيم DateTime من القاعدة (UTC بدون timezone) إلى datetime64[s] - None تصبح NaT"""
+    return np.array(
+        [value.replace(tzinfo=None) if value is not None and value.tzinfo else value for value in values],
+        dtype='datetime64[s]'
+    )
+
+
+class ResellerTimeline:
+    """أوقات اشتراكات موزع واحد كمصفوفات مرتبة"""
+
+    def __init__(self, created_yearly, created_lifetime, expiring):
+        self.created_yearly = np.sort(created_yearly)
+        self.created_lifetime = np.sort(created_lifetime)
+        # الاشتراكات السنوية غير الموقوفة فقط (مدى الحياة لا ينتهي فعلياً)
+        self.expiring = np.sort(expiring)
+
+    @classmethod
+    def load(cls, reseller_id):
+        """تحميل اشتراكات الموزع من القاعدة (دفعات لتقليل الذاكرة المؤقتة)"""
+        created_yearly, created_lifetime, expiring = [], [], []
+
+        result = db.session.execute(
+            select(
+                ActivationCode.created_at,
+                ActivationCode.expiration_date,
+                ActivationCode.is_lifetime,
+                ActivationCode.status
+            ).where(
+                ActivationCode.reseller_id == reseller_id
+            ).execution_options(yield_per=_LOAD_BATCH_SIZE)
+        )
+
+        for rows in result.partitions():
+            created = _to_datetime64([row.created_at for row in rows])
+            expires = _to_datetime64([row.expiration_date for row in rows])
+            lifetime = np.array([bool(row.is_lifetime) for row in rows], dtype=bool)
+            suspended = np.array([row.status == STATUS_SUSPENDED for row in rows], dtype=bool)
+
+            created_yearly.append(created[~lifetime & ~np.isnat(created)])
+            created_lifetime.append(created[lifetime & ~np.isnat(created)])
+            expiring.append(expires[~lifetime & ~suspended & ~np.isnat(expires)])
+
+        def concat(parts):
+            return np.concatenate(parts) if parts else np.array([], dtype='datetime64[s]')
+
+        return cls(concat(created_yearly), concat(created_lifetime), concat(expiring))
+
+    def __len__(self):
+        return len(self.created_yearly) + len(self.created_lifetime)
+
+
+def bucket_edges(start, end, granularity):
+    """
+    حدود الفترات من بداية الفترة (مقربة للدقة) حتى تغطية end
+
+    يعيد (edges بدقة الثانية، labels) - عدد الحدود = عدد الفترات + 1
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Invalid granularity: {granularity}')
+    unit, step, label_unit = GRANULARITIES[granularity]
+
+    first = np.datetime64(start, 's').astype(f'datetime64[{unit}]')
+    end64 = np.datetime64(end, 's')
+    if end64 <= first:
+        raise ValueError('End must be after start')
+
+    span = (end64.astype(f'datetime64[{unit}]') - first).astype(np.int64)
+    if (first + np.timedelta64(int(span), unit)).astype('datetime64[s]') < end64:
+        span += 1  # end ليس على حد فترة
+    buckets = int(-(-span // step))
+
+    if buckets > ANALYTICS_MAX_BUCKETS:
+        raise ValueError(f'Too many buckets ({buckets}). Maximum: {ANALYTICS_MAX_BUCKETS}')
+
+    edges = first + np.arange(buckets + 1) * np.timedelta64(step, unit)
+    labels = np.datetime_as_string(edges[:-1], unit=label_unit).tolist()
+    return edges.astype('datetime64[s]'), labels
+
+
+def histogram(sorted_values, edges):
+    """عدد القيم في كل فترة [edges[i], edges[i+1]) - القيم يجب أن تكون مرتبة"""
+    return np.diff(np.searchsorted(sorted_values, edges, side='left'))
+
+
+# ============================================================================
+# الكاش
+# ============================================================================
+
+timeline_cache = TTLCache(ANALYTICS_CACHE_TTL, max_entries=ANALYTICS_CACHE_MAX_RESELLERS)
+
+
+def get_timeline(reseller_id):
+    return timeline_cache.get_or_set(reseller_id, lambda: ResellerTimeline.load(reseller_id))
+
+
+def invalidate_timeline(reseller_id):
+    timeline_cache.delete(reseller_id)
+
+
+# ============================================================================
+# التحليلات
+# ============================================================================
+
+def activations_by_range(reseller_id, start, end, granularity='day'):
+    """عدد التفعيلات لكل فترة بين start و end (مع التقسيم سنوي / مدى الحياة)"""
+    timeline = get_timeline(reseller_id)
+    edges, labels = bucket_edges(start, end, granularity)
+
+    yearly = histogram(timeline.created_yearly, edges)
+    lifetime = histogram(timeline.created_lifetime, edges)
+
+    return {
+        'labels': labels,
+        'granularity': granularity,
+        'activations': (yearly + lifetime).tolist(),
+        'yearly': yearly.tolist(),
+        'lifetime': lifetime.tolist(),
+        'total': int(yearly.sum() + lifetime.sum())
+    }
+
+
+def expirations_by_range(reseller_id, start, end, granularity='week'):
+    """عدد الاشتراكات (السنوية غير الموقوفة) التي تنتهي في كل فترة"""
+    timeline = get_timeline(reseller_id)
+    edges, labels = bucket_edges(start, end, granularity)
+    expiring = histogram(timeline.expiring, edges)
+
+    return {
+        'labels': labels,
+        'granularity': granularity,
+        'expirations': expiring.tolist(),
+        'total': int(expiring.sum())
+    }
+
+
+def expiry_forecast(reseller_id, horizon_days=365, granularity='week', now=None):
+    """توقع الاشتراكات التي ستنتهي (فرص التجديد) من الآن حتى horizon_days"""
+    now = now or datetime.utcnow()
+    end = np.datetime64(now, 's') + np.timedelta64(int(horizon_days), 'D')
+    data = expirations_by_range(reseller_id, now, end, granularity)
+
+    # المنتهية فعلاً لكن ما زالت قابلة للتجديد (انتهت قبل بداية أول فترة)
+    timeline = get_timeline(reseller_id)
+    first_edge = np.datetime64(data['labels'][0]) if data['labels'] else np.datetime64(now, 's')
+    data['already_expired'] = int(np.searchsorted(timeline.expiring, first_edge.astype('datetime64[s]'), side='left'))
+    data['horizon_days'] = int(horizon_days)
+    return data
+
+
+def stats():
+    return timeline_cache.stats()
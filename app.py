@@ -1,4 +1,5 @@
 import os
+import threading
 from flask import Flask, render_template, request, jsonify, current_app, session, send_file
 from dotenv import load_dotenv
 from flask_wtf.csrf import CSRFProtect
@@ -6,6 +7,22 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 from sqlalchemy import text
 from config import DEBUG, TESTING, SQLALCHEMY_TRACK_MODIFICATIONS
 from models import db, User, Reseller, Admin, Device, ActivationCode, DeviceActivationCode, AuditLog, SupportTicket, TicketMessage
+from hashing_helper import hashing_pool
+from activity_helper import device_activity
+from audit_helper import audit_pipeline
+from activation_code_helper import outstanding_codes
+import device_notify_helper
+import analytics_helper
+import audit_store
+import export_jobs
+import invoice_helper
+import system_counters
+from performance_helper import ensure_indexes
+from reseller_stats_helper import ensure_daily_stats
+from system_counters import ensure_system_counters
+from revenue_helper import ensure_revenue_rollup
+from subscription_helper import ensure_subscription_status
+import background_tasks
 from datetime import datetime
 from io import BytesIO
 
@@ -36,12 +53,58 @@ app.config['WTF_CSRF_CHECK_DEFAULT'] = False
 # تهيئة قاعدة البيانات مع التطبيق
 db.init_app(app)
 
+# تشغيل المهام الدورية (تفريغ نشاط الأجهزة، ...)
+background_tasks.init_app(app)
+
 # تهيئة CSRF Protection
 csrf = CSRFProtect(app)
 
 # تهيئة Socket.IO
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
+# ============================================================================
+# تحديث مخطط قاعدة البيانات (مرة واحدة لكل عملية)
+# ============================================================================
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def ensure_schema():
+    """
+    الجداول والأعمدة والفهارس الجديدة + بناء التجميعات عند أول تشغيل
+
+    كل الخطوات آمنة للتكرار، وتعمل مع أول طلب في كل عملية حتى تشمل
+    gunicorn wsgi:app وليس python app.py فقط. عند الفشل تعاد مع الطلب التالي
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        try:
+            db.create_all()
+            # الأعمدة والفهارس الجديدة على الجداول الموجودة مسبقاً
+            # (عمود status يملأ للصفوف القديمة قبل أول طلب يقرأه)
+            ensure_subscription_status()
+            ensure_indexes(DeviceActivationCode, ActivationCode, User, Device)
+            ensure_daily_stats()
+            ensure_system_counters()
+            ensure_revenue_rollup()
+            # سجلات audit_log القديمة إلى الجداول الشهرية (صفحة السجلات الأمنية تقرأ منها فقط)
+            audit_store.migrate_legacy_rows()
+            _schema_ready = True
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ تعذر تحديث مخطط قاعدة البيانات: {str(e)}")
+
+
+@app.before_request
+def ensure_schema_before_request():
+    ensure_schema()
+
+
 # مسار الصفحة الرئيسية
 @app.route('/')
 def index():
@@ -88,7 +151,15 @@ def health():
         db.session.commit()
         return jsonify({
             'status': 'healthy',
-            'message': 'التطبيق يعمل بشكل طبيعي'
+            'message': 'التطبيق يعمل بشكل طبيعي',
+            'hashing_pool': hashing_pool.stats(),
+            'device_activity': device_activity.stats(),
+            'audit_pipeline': audit_pipeline.stats(),
+            'activation_codes': outstanding_codes.stats(),
+            'activation_notices': device_notify_helper.stats(),
+            'analytics_timelines': analytics_helper.stats(),
+            'export_jobs': export_jobs.stats(),
+            'invoices': invoice_helper.stats()
         }), 200
     except Exception as e:
         print(f"❌ Health check error: {str(e)}")
@@ -153,6 +224,52 @@ def on_join_ticket(data):
     }, room=room)
 
 
+@socketio.on('join_device')
+def on_join_device(data):
+    """انضمام شاشة التفعيل إلى غرفة الجهاز لاستقبال device_activated"""
+    device_id = (data or {}).get('device_id')
+    if not device_id:
+        emit('error', {'msg': 'Device ID is required'})
+        return
+    join_room(device_notify_helper.device_room(device_id))
+    
+    # التفعيل تم قبل الانضمام للغرفة
+    notice = device_notify_helper.get_notice(device_id)
+    if notice is not None:
+        emit('device_activated', notice)
+
+
+@socketio.on('join_admin_dashboard')
+def on_join_admin_dashboard(data=None):
+    """صفحة لوحة المسؤول تستقبل system_counters عند تغير العدادات"""
+    if not session.get('admin_id'):
+        emit('error', {'msg': 'Unauthorized'})
+        return
+    join_room(system_counters.DASHBOARD_ROOM)
+
+
+@socketio.on('join_export')
+def on_join_export(data):
+    """متابعة تقدم مهمة تصدير (export_progress / export_finished) - لمالك المهمة فقط"""
+    job_key = (data or {}).get('job_key')
+    if session.get('admin_id'):
+        owner_type, owner_id = 'admin', session['admin_id']
+    elif session.get('reseller_id'):
+        owner_type, owner_id = 'reseller', session['reseller_id']
+    else:
+        emit('error', {'msg': 'Unauthorized'})
+        return
+    
+    job = export_jobs.get_job(owner_type, owner_id, job_key) if job_key else None
+    if job is None:
+        emit('error', {'msg': 'Export not found'})
+        return
+    join_room(export_jobs.export_room(job_key))
+    
+    # الحالة الحالية (المهمة قد تكون انتهت قبل الانضمام)
+    emit('export_progress', export_jobs.job_to_dict(job))
+
+
 @socketio.on('send_message')
 def handle_message(data):
     """بث الرسالة المحفوظة بالفعل عبر API إلى جميع الأطراف في الغرفة"""
@@ -191,8 +308,8 @@ def handle_message(data):
 
 if __name__ == '__main__':
     with app.app_context():
-        # إنشاء جداول قاعدة البيانات
-        db.create_all()
+        # إنشاء جداول قاعدة البيانات والأعمدة والفهارس الجديدة
+        ensure_schema()
         
         # محاولة إضافة بيانات تجريبية
         from init_db import init_db_with_sample_data
@@ -1,9 +1,273 @@
 """
 مساعد لتسجيل العمليات في جدول audit_log
+
+التسجيل يتم عبر طابور محدود في الذاكرة:
+- log_action يضيف السجل للطابور ويعود فوراً (بدون commit على session الطلب)
+- مهمة في الخلفية تكتب السجلات دفعات (bulk insert) باتصال مستقل
+- العمليات الأمنية الحساسة (تسجيل الدخول، الشحن، ...) تكتب فوراً بشكل متزامن
+- عند امتلاء الطابور: أحداث المشاهدة منخفضة الأهمية تؤخذ منها عينة فقط،
+  وباقي الأحداث تكتب مباشرة من الطلب (backpressure)
+- فشل كتابة دفعة (انقطاع القاعدة): الدفعة تبقى في الذاكرة وتعاد أولاً في التفريغ التالي،
+  وبعد AUDIT_MAX_RETRIES محاولة تكتب سجلاً سجلاً فلا يفقد إلا السجل الذي يرفض نفسه
+- قائمة الإعادة محدودة بـ AUDIT_RETRY_MAX_ROWS سجل: الطابور يستمر بالتفريغ إليها أثناء
+  الانقطاع، وبعد الحد تحذف أحداث المشاهدة أولاً ثم أحدث السجلات (مع عدها في dropped)
 """
-from models import AuditLog, db
-from flask import request, session
+import queue
+import threading
+import audit_store
+from flask import request, session, has_request_context
 from datetime import datetime
+from config import (
+    AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_SAMPLE_RATE, AUDIT_MAX_RETRIES,
+    AUDIT_RETRY_MAX_ROWS
+)
+import background_tasks
+
+# عمليات تكتب فوراً ولا يجوز فقدانها
+SYNC_ACTIONS = {
+    'login', 'logout', 'FAILED_LOGIN', 'topup', 'change_password',
+    'update_settings', 'activate', 'deactivate', 'create', 'delete'
+}
+
+# أحداث مشاهدة متكررة يمكن أخذ عينة منها تحت الضغط
+LOW_PRIORITY_ACTIONS = {
+    'STREAM_PLAY', 'view_stream', 'PLAYER_OPENED'
+}
+
+
+def is_low_priority(action):
+    return action in LOW_PRIORITY_ACTIONS or action.endswith('_VIEWED')
+
+
+class AuditPipeline:
+    """طابور محدود + كاتب دفعات لسجلات التدقيق"""
+
+    def __init__(self, maxsize=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE, sample_rate=AUDIT_SAMPLE_RATE,
+                 max_retries=AUDIT_MAX_RETRIES, max_retry_rows=AUDIT_RETRY_MAX_ROWS):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._retry = []  # [(batch, attempts)] دفعات فشلت كتابتها (تعاد قبل الطابور)
+        self._retry_rows = 0
+        self._retry_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.max_retries = max(max_retries, 1)
+        self.max_retry_rows = max(max_retry_rows, batch_size)
+        self.sample_rate = max(sample_rate, 1)
+        # يبدأ أخذ العينات عند امتلاء 80% من الطابور
+        self.high_water = int(maxsize * 0.8)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._sample_counter = 0
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'sync_writes': 0,
+            'sampled_out': 0,
+            'retried': 0,
+            'deferred': 0,
+            'dropped': 0,
+            'failed': 0
+        }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _insert(self, rows):
+        """Bulk insert في الجداول الشهرية باتصال مستقل عن session الطلب"""
+        audit_store.insert_rows(rows)
+
+    def _trim_retry(self):
+        """
+        قص قائمة الإعادة إلى max_retry_rows (تستدعى مع _retry_lock) - يعيد عدد السجلات المحذوفة
+
+        أحداث المشاهدة منخفضة الأهمية تحذف أولاً (من الأحدث)، ثم أحدث السجلات
+        """
+        excess = self._retry_rows - self.max_retry_rows
+        if excess <= 0:
+            return 0
+
+        dropped = 0
+        for index in range(len(self._retry) - 1, -1, -1):
+            if dropped >= excess:
+                break
+            batch, attempts = self._retry[index]
+            kept = [row for row in batch if not is_low_priority(row['action'])]
+            dropped += len(batch) - len(kept)
+            self._retry[index] = (kept, attempts)
+
+        while dropped < excess and self._retry:
+            batch, attempts = self._retry[-1]
+            take = min(len(batch), excess - dropped)
+            dropped += take
+            if take == len(batch):
+                self._retry.pop()
+            else:
+                self._retry[-1] = (batch[:-take], attempts)
+
+        self._retry = [(batch, attempts) for batch, attempts in self._retry if batch]
+        self._retry_rows -= dropped
+        return dropped
+
+    def _add_retry(self, entries, front=False):
+        """إضافة دفعات [(batch, attempts)] لقائمة الإعادة المحدودة (front: قبل الموجودة)"""
+        with self._retry_lock:
+            self._retry = entries + self._retry if front else self._retry + entries
+            self._retry_rows += sum(len(batch) for batch, _ in entries)
+            dropped = self._trim_retry()
+        if dropped:
+            self._count('dropped', dropped)
+            print(f"❌ قائمة إعادة سجلات التدقيق ممتلئة ({self.max_retry_rows})، تم حذف {dropped} سجل")
+
+    def _write_sync(self, rows):
+        """كتابة متزامنة - عند الفشل تنتقل السجلات لقائمة الإعادة بدل فقدانها"""
+        try:
+            self._insert(rows)
+        except Exception as e:
+            self._count('retried', len(rows))
+            self._add_retry([(rows, 1)])
+            print(f"⚠️ فشلت الكتابة المتزامنة لسجلات التدقيق ({len(rows)})، ستعاد لاحقاً: {str(e)}")
+            return
+        self._count('sync_writes')
+        self._count('written', len(rows))
+
+    def write_now(self, row):
+        """كتابة متزامنة لسجل واحد"""
+        self._write_sync([row])
+
+    def submit_many(self, rows):
+        """إضافة مجموعة سجلات: العمليات الحساسة تكتب معاً في insert واحد"""
+        sync_rows = [row for row in rows if row['action'] in SYNC_ACTIONS]
+        if sync_rows:
+            self._write_sync(sync_rows)
+        for row in rows:
+            if row['action'] not in SYNC_ACTIONS:
+                self.submit(row)
+        return True
+
+    def _should_sample_out(self):
+        with self._lock:
+            self._sample_counter += 1
+            return self._sample_counter % self.sample_rate != 0
+
+    def submit(self, row):
+        """إضافة سجل للطابور مع تطبيق سياسة الضغط"""
+        action = row['action']
+
+        if action in SYNC_ACTIONS:
+            self.write_now(row)
+            return True
+
+        low_priority = is_low_priority(action)
+        if low_priority and self._queue.qsize() >= self.high_water and self._should_sample_out():
+            self._count('sampled_out')
+            return False
+
+        try:
+            self._queue.put_nowait(row)
+            self._count('enqueued')
+            return True
+        except queue.Full:
+            if low_priority:
+                self._count('sampled_out')
+                return False
+            # backpressure: الطلب نفسه يدفع تكلفة الكتابة
+            self.write_now(row)
+            return True
+
+    def _insert_one_by_one(self, batch):
+        """آخر محاولة: كل سجل في insert مستقل (سجل معطوب لا يسقط الدفعة كلها)"""
+        written = 0
+        for row in batch:
+            try:
+                self._insert([row])
+                written += 1
+            except Exception as e:
+                self._count('failed')
+                print(f"❌ تعذر حفظ سجل تدقيق ({row['action']}): {str(e)}")
+        self._count('written', written)
+        return written
+
+    def _write_batch(self, batch, attempts=0):
+        """كتابة دفعة - يعيد عدد السجلات المكتوبة، أو None إذا فشلت وما زالت لها محاولات"""
+        try:
+            self._insert(batch)
+        except Exception as e:
+            attempts += 1
+            if attempts < self.max_retries:
+                self._count('retried', len(batch))
+                print(f"⚠️ فشلت كتابة دفعة سجلات التدقيق ({len(batch)}، المحاولة {attempts}): {str(e)}")
+                return None
+            return self._insert_one_by_one(batch)
+
+        self._count('written', len(batch))
+        self._count('batches')
+        return len(batch)
+
+    def flush(self):
+        """
+        تفريغ الطابور دفعات (تستدعى من مهمة الخلفية وعند الإغلاق)
+
+        الدفعات الفاشلة سابقاً أولاً (بنفس الترتيب). بعد أول فشل (القاعدة ما زالت معطلة)
+        لا تجرب باقي الدفعات، لكن الطابور يستمر بالتفريغ إلى قائمة الإعادة المحدودة
+        حتى لا يمتلئ وتتحول كل الأحداث للكتابة المتزامنة
+        """
+        written = 0
+        with self._flush_lock:
+            with self._retry_lock:
+                retry, self._retry = self._retry, []
+                self._retry_rows = 0
+
+            pending = []  # دفعات تعاد لقائمة الإعادة (قبل ما أضافته الطلبات أثناء التفريغ)
+            failed = False
+            for batch, attempts in retry:
+                if failed:
+                    pending.append((batch, attempts))
+                    continue
+                result = self._write_batch(batch, attempts)
+                if result is None:
+                    failed = True
+                    pending.append((batch, attempts + 1))
+                else:
+                    written += result
+
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    break
+                if failed:
+                    self._count('deferred', len(batch))
+                    pending.append((batch, 0))
+                    continue
+                result = self._write_batch(batch)
+                if result is None:
+                    failed = True
+                    pending.append((batch, 1))
+                else:
+                    written += result
+
+            if pending:
+                self._add_retry(pending, front=True)
+        return written
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data['queued'] = self._queue.qsize()
+        data['pending_retry'] = self._retry_rows
+        return data
+
+
+audit_pipeline = AuditPipeline()
+
+background_tasks.register_periodic('audit_log_flush', AUDIT_FLUSH_INTERVAL, audit_pipeline.flush)
+background_tasks.register_shutdown(audit_pipeline.flush)
+
 
 def log_action(actor_type, actor_id, action, description=None, resource_type=None, resource_id=None):
     """
@@ -19,31 +283,57 @@ def log_action(actor_type, actor_id, action, description=None, resource_type=Non
     """
     try:
         # الحصول على عنوان IP
-        ip_address = request.remote_addr if request else None
+        ip_address = request.remote_addr if has_request_context() else None
+        now = datetime.utcnow()
         
-        # إنشاء سجل جديد
-        audit_log = AuditLog(
-            actor_type=actor_type,
-            actor_id=actor_id,
-            action=action,
-            description=description,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            ip_address=ip_address
-        )
+        row = {
+            'actor_type': actor_type,
+            'actor_id': actor_id,
+            'action': action,
+            'description': description,
+            'resource_type': resource_type,
+            'resource_id': resource_id,
+            'ip_address': ip_address,
+            'created_at': now,
+            'updated_at': now
+        }
         
-        db.session.add(audit_log)
-        db.session.commit()
-        
-        print(f"✅ تم تسجيل العملية: {action} من قبل {actor_type} #{actor_id}")
-        return True
+        return audit_pipeline.submit(row)
         
     except Exception as e:
-        db.session.rollback()
         print(f"❌ خطأ في تسجيل العملية: {str(e)}")
         return False
 
 
+def log_actions(actor_type, actor_id, entries):
+    """
+    تسجيل مجموعة عمليات لنفس المستخدم دفعة واحدة (مثل التفعيل الجماعي)
+    
+    entries: قائمة dict فيها action و description و resource_type و resource_id
+    """
+    try:
+        ip_address = request.remote_addr if has_request_context() else None
+        now = datetime.utcnow()
+        
+        rows = [{
+            'actor_type': actor_type,
+            'actor_id': actor_id,
+            'action': entry['action'],
+            'description': entry.get('description'),
+            'resource_type': entry.get('resource_type'),
+            'resource_id': entry.get('resource_id'),
+            'ip_address': ip_address,
+            'created_at': now,
+            'updated_at': now
+        } for entry in entries]
+        
+        return audit_pipeline.submit_many(rows)
+        
+    except Exception as e:
+        print(f"❌ خطأ في تسجيل العمليات: {str(e)}")
+        return False
+
+
 def log_admin_action(action, description=None, resource_type=None, resource_id=None):
     """
     مساعد لتسجيل عمليات الأدمن (يستخدم معرف الأدمن من الجلسة)
@@ -99,25 +389,8 @@ def get_recent_activities(limit=4):
     جلب آخر العمليات
     """
     try:
-        activities = AuditLog.query.order_by(
-            AuditLog.created_at.desc()
-        ).limit(limit).all()
-        
-        result = []
-        for activity in activities:
-            result.append({
-                'id': activity.id,
-                'actor_type': activity.actor_type,
-                'actor_id': activity.actor_id,
-                'action': activity.action,
-                'description': activity.description,
-                'resource_type': activity.resource_type,
-                'resource_id': activity.resource_id,
-                'ip_address': activity.ip_address,
-                'created_at': activity.created_at.isoformat() if activity.created_at else None
-            })
-        
-        return result
+        activities = audit_store.query_logs(limit=limit)
+        return [activity.to_dict() for activity in activities]
     except Exception as e:
         print(f"❌ خطأ في جلب العمليات: {str(e)}")
         return []
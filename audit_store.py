@@ -0,0 +1,614 @@
+"""
+تخزين سجلات التدقيق في جداول شهرية مضغوطة
+
+المشكلة:
+- جدول audit_log ينمو بلا حدود
+- كل صف يخزن action / resource_type كنص كامل
+- لا يوجد فهرس على created_at
+
+الحل:
+- جدول لكل شهر: audit_log_YYYYMM (يعمل على SQLite و PostgreSQL بدون partitioning أصلي)
+- action و resource_type و actor_type تخزن كأرقام صغيرة (قاموس audit_dictionary)
+- الأشهر الأقدم من AUDIT_RETENTION_MONTHS تؤرشف إلى ملفات NDJSON مضغوطة ثم يحذف جدولها
+- طبقة استعلام تقرأ فقط الجداول التي تغطي الفترة المطلوبة
+"""
+
+import os
+import re
+import gzip
+import json
+import threading
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Index, Integer, SmallInteger, String, Text, DateTime, select, func, and_, or_, union_all
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from models import db, AuditLog, AuditDictionary, AuditPartition
+from performance_helper import encode_cursor as encode_payload, decode_cursor as decode_payload
+from config import AUDIT_RETENTION_MONTHS, AUDIT_ARCHIVE_DIR
+import background_tasks
+import security_stats
+
+ACTOR_TYPES = {'user': 1, 'reseller': 2, 'admin': 3}
+ACTOR_TYPE_NAMES = {code: name for name, code in ACTOR_TYPES.items()}
+
+# action مفتاح ثابت (suspend_user, PLAYER_OPENED...) وليس نصاً حراً
+# النص الحر يحفظ كـ 'other' مع النص في description حتى لا يكبر القاموس بلا حدود
+ACTION_KEY_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_.:-]{0,63}$')
+FALLBACK_ACTION = 'other'
+
+_partition_metadata = MetaData()
+_partition_tables = {}
+_ensured_partitions = set()
+_dictionary = {}  # (kind, value) -> id
+_dictionary_values = {}  # (kind, id) -> value
+_dictionary_loaded = False
+_lock = threading.RLock()
+
+
+# ============================================================================
+# 1️⃣ الأشهر والجداول
+# ============================================================================
+
+def month_key(dt):
+    """مفتاح الشهر YYYYMM"""
+    return f'{dt.year:04d}{dt.month:02d}'
+
+
+def month_bounds(dt):
+    """بداية الشهر وبداية الشهر التالي"""
+    start = datetime(dt.year, dt.month, 1)
+    if dt.month == 12:
+        end = datetime(dt.year + 1, 1, 1)
+    else:
+        end = datetime(dt.year, dt.month + 1, 1)
+    return start, end
+
+
+def partition_table(key):
+    """تعريف جدول الشهر (بدون إنشائه)"""
+    name = f'audit_log_{key}'
+    with _lock:
+        table = _partition_tables.get(name)
+        if table is None:
+            table = Table(
+                name, _partition_metadata,
+                Column('id', Integer, primary_key=True, autoincrement=True),
+                Column('created_at', DateTime, nullable=False),
+                Column('actor_type', SmallInteger, nullable=False),
+                Column('actor_id', Integer, nullable=False),
+                Column('action_id', Integer, nullable=False),
+                Column('resource_type_id', SmallInteger, nullable=True),
+                Column('resource_id', Integer, nullable=True),
+                Column('ip_address', String(45), nullable=True),
+                Column('description', Text, nullable=True),
+                Index(f'ix_{name}_created_at', 'created_at', 'id'),
+                Index(f'ix_{name}_action', 'action_id', 'created_at'),
+                Index(f'ix_{name}_actor', 'actor_type', 'actor_id', 'created_at'),
+                Index(f'ix_{name}_resource', 'resource_type_id', 'resource_id', 'created_at'),
+                Index(f'ix_{name}_ip', 'ip_address', 'created_at'),
+            )
+            _partition_tables[name] = table
+        return table
+
+
+def ensure_partition(dt):
+    """إنشاء جدول الشهر وتسجيله إن لم يكن موجوداً"""
+    key = month_key(dt)
+    if key in _ensured_partitions:
+        return partition_table(key)
+
+    # الطلبات المتزامنة في نفس العملية تنشئ الجدول مرة واحدة
+    with _lock:
+        if key in _ensured_partitions:
+            return partition_table(key)
+
+        table = partition_table(key)
+        period_start, period_end = month_bounds(dt)
+
+        try:
+            exists = _create_partition(table, key)
+        except (OperationalError, ProgrammingError):
+            # عملية أخرى أنشأت الجدول بين الفحص والإنشاء
+            exists = _create_partition(table, key)
+
+        if not exists:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(AuditPartition.__table__.insert().values(
+                        month_key=key,
+                        table_name=table.name,
+                        period_start=period_start,
+                        period_end=period_end,
+                        status='active'
+                    ))
+            except IntegrityError:
+                pass  # عملية أخرى سجلته في نفس اللحظة
+
+        _ensured_partitions.add(key)
+        return table
+
+
+def _create_partition(table, key):
+    """إنشاء الجدول وفهارسه إن لم تكن موجودة - يعيد هل الشهر مسجل في audit_partitions"""
+    with db.engine.begin() as connection:
+        table.create(connection, checkfirst=True)
+        # الجداول الأقدم قد تكون أنشئت قبل إضافة بعض الفهارس
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+        return connection.execute(
+            select(AuditPartition.id).where(AuditPartition.month_key == key)
+        ).first()
+
+
+def partitions_for_range(start=None, end=None):
+    """الجداول النشطة التي تتقاطع مع الفترة [start, end) من الأحدث للأقدم"""
+    query = AuditPartition.query.filter(AuditPartition.status == 'active')
+    if start is not None:
+        query = query.filter(AuditPartition.period_end > start)
+    if end is not None:
+        query = query.filter(AuditPartition.period_start < end)
+    return query.order_by(AuditPartition.period_start.desc()).all()
+
+
+# ============================================================================
+# 2️⃣ القاموس (ترميز النصوص كأرقام)
+# ============================================================================
+
+def _load_dictionary():
+    global _dictionary_loaded
+    with _lock:
+        for entry in AuditDictionary.query.all():
+            _dictionary[(entry.kind, entry.value)] = entry.id
+            _dictionary_values[(entry.kind, entry.id)] = entry.value
+        _dictionary_loaded = True
+
+
+def encode(kind, value):
+    """رقم القيمة في القاموس (يضيفها إن لم تكن موجودة)"""
+    if value is None:
+        return None
+    value = str(value)[:100]
+    if not _dictionary_loaded:
+        _load_dictionary()
+
+    code = _dictionary.get((kind, value))
+    if code is not None:
+        return code
+
+    with _lock:
+        code = _dictionary.get((kind, value))
+        if code is not None:
+            return code
+        try:
+            with db.engine.begin() as connection:
+                code = connection.execute(
+                    AuditDictionary.__table__.insert().values(kind=kind, value=value)
+                ).inserted_primary_key[0]
+        except IntegrityError:
+            with db.engine.connect() as connection:
+                code = connection.execute(
+                    select(AuditDictionary.id).where(
+                        AuditDictionary.kind == kind, AuditDictionary.value == value
+                    )
+                ).scalar()
+        _dictionary[(kind, value)] = code
+        _dictionary_values[(kind, code)] = value
+        return code
+
+
+def decode(kind, code):
+    """القيمة النصية لرقم في القاموس"""
+    if code is None:
+        return None
+    value = _dictionary_values.get((kind, code))
+    if value is None:
+        _load_dictionary()
+        value = _dictionary_values.get((kind, code))
+    return value
+
+
+def normalize_action(action, description=None):
+    """(action, description) بعد رفض القيم غير المحدودة كمفتاح في القاموس"""
+    action = str(action or '')
+    if ACTION_KEY_PATTERN.match(action):
+        return action, description
+    text = f"{action} - {description}" if description else action
+    return FALLBACK_ACTION, text or None
+
+
+def lookup(kind, value):
+    """رقم قيمة موجودة بدون إضافتها (للفلترة)، أو None"""
+    if not _dictionary_loaded:
+        _load_dictionary()
+    code = _dictionary.get((kind, value))
+    if code is None:
+        _load_dictionary()
+        code = _dictionary.get((kind, value))
+    return code
+
+
+# ============================================================================
+# 3️⃣ الكتابة
+# ============================================================================
+
+def insert_rows(rows):
+    """
+    كتابة سجلات (بنفس صيغة log_action) في جداولها الشهرية
+
+    الترميز وإنشاء الجداول يتم قبل transaction الكتابة حتى لا تتداخل
+    الأقفال على SQLite، وعدادات security_stats تحدث في نفس الـ transaction
+    """
+    prepared = _prepare_rows(rows)
+    with db.engine.begin() as connection:
+        _write_prepared(connection, prepared)
+    return len(rows)
+
+
+def _prepare_rows(rows):
+    """ترميز السجلات وإنشاء جداولها الشهرية (خارج transaction الكتابة)"""
+    by_partition = {}
+    counted_rows = []
+    for row in rows:
+        created_at = row.get('created_at') or datetime.utcnow()
+        action, description = normalize_action(row['action'], row.get('description'))
+        counted_rows.append({
+            'created_at': created_at,
+            'action': action,
+            'ip_address': row.get('ip_address')
+        })
+        table = ensure_partition(created_at)
+        by_partition.setdefault(table, []).append({
+            'created_at': created_at,
+            'actor_type': ACTOR_TYPES.get(row['actor_type'], 0),
+            'actor_id': row['actor_id'] or 0,
+            'action_id': encode('action', action),
+            'resource_type_id': encode('resource_type', row.get('resource_type')),
+            'resource_id': row.get('resource_id'),
+            'ip_address': row.get('ip_address'),
+            'description': description
+        })
+    return by_partition, counted_rows
+
+
+def _write_prepared(connection, prepared):
+    by_partition, counted_rows = prepared
+    for table, table_rows in by_partition.items():
+        connection.execute(table.insert(), table_rows)
+    # عدادات الصفحة الأمنية تتحدث مع نفس الـ transaction
+    security_stats.record_rows(connection, counted_rows)
+
+
+# ============================================================================
+# 4️⃣ القراءة
+# ============================================================================
+
+class AuditRecord:
+    """سجل تدقيق مفكوك الترميز (نفس حقول AuditLog)"""
+
+    __slots__ = ('id', 'partition', 'created_at', 'actor_type', 'actor_id', 'action',
+                 'description', 'resource_type', 'resource_id', 'ip_address')
+
+    def __init__(self, partition, row):
+        self.id = row.id
+        self.partition = partition
+        self.created_at = row.created_at
+        self.actor_type = ACTOR_TYPE_NAMES.get(row.actor_type, 'unknown')
+        self.actor_id = row.actor_id
+        self.action = decode('action', row.action_id)
+        self.description = row.description
+        self.resource_type = decode('resource_type', row.resource_type_id)
+        self.resource_id = row.resource_id
+        self.ip_address = row.ip_address
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'partition': self.partition,
+            'actor_type': self.actor_type,
+            'actor_id': self.actor_id,
+            'action': self.action,
+            'description': self.description,
+            'resource_type': self.resource_type,
+            'resource_id': self.resource_id,
+            'ip_address': self.ip_address,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+def _build_conditions(table, start=None, end=None, filters=None):
+    """
+    تحويل الفلاتر إلى شروط SQL على جدول شهري
+
+    يعيد None إذا كان الفلتر لا يمكن أن يطابق أي سجل (قيمة غير موجودة في القاموس)
+    """
+    filters = filters or {}
+    conditions = []
+
+    if start is not None:
+        conditions.append(table.c.created_at >= start)
+    if end is not None:
+        conditions.append(table.c.created_at < end)
+
+    if filters.get('actor_type'):
+        actor_code = ACTOR_TYPES.get(filters['actor_type'])
+        if actor_code is None:
+            return None
+        conditions.append(table.c.actor_type == actor_code)
+    if filters.get('actor_id') is not None:
+        conditions.append(table.c.actor_id == filters['actor_id'])
+    if filters.get('action'):
+        action_id = lookup('action', filters['action'])
+        if action_id is None:
+            return None
+        conditions.append(table.c.action_id == action_id)
+    if filters.get('resource_type'):
+        resource_type_id = lookup('resource_type', filters['resource_type'])
+        if resource_type_id is None:
+            return None
+        conditions.append(table.c.resource_type_id == resource_type_id)
+    if filters.get('resource_id') is not None:
+        conditions.append(table.c.resource_id == filters['resource_id'])
+    if filters.get('ip_address'):
+        conditions.append(table.c.ip_address == filters['ip_address'])
+
+    return conditions
+
+
+def query_logs(start=None, end=None, filters=None, limit=None):
+    """
+    جلب السجلات من الأحدث للأقدم مع قراءة الجداول المطلوبة فقط
+
+    filters: actor_type, actor_id, action, resource_type, resource_id, ip_address
+    """
+    records = []
+    for partition in partitions_for_range(start, end):
+        if limit is not None and len(records) >= limit:
+            break
+
+        table = partition_table(partition.month_key)
+        conditions = _build_conditions(table, start, end, filters)
+        if conditions is None:
+            return []
+
+        query = select(table).where(*conditions).order_by(
+            table.c.created_at.desc(), table.c.id.desc()
+        )
+        if limit is not None:
+            query = query.limit(limit - len(records))
+
+        for row in db.session.execute(query):
+            records.append(AuditRecord(partition.month_key, row))
+
+    return records
+
+
+def iter_logs(start=None, end=None, filters=None, batch_size=2000):
+    """نفس query_logs لكن على دفعات (yield_per) بدون تحميل كل السجلات في الذاكرة - للتصدير"""
+    for partition in partitions_for_range(start, end):
+        table = partition_table(partition.month_key)
+        conditions = _build_conditions(table, start, end, filters)
+        if conditions is None:
+            return
+
+        result = db.session.execute(
+            select(table).where(*conditions).order_by(
+                table.c.created_at.desc(), table.c.id.desc()
+            ).execution_options(yield_per=batch_size)
+        )
+        for row in result:
+            yield AuditRecord(partition.month_key, row)
+
+
+def count_logs(start=None, end=None, filters=None):
+    """عدد السجلات في الفترة (COUNT على الجداول المطلوبة فقط)"""
+    total = 0
+    for partition in partitions_for_range(start, end):
+        table = partition_table(partition.month_key)
+        conditions = _build_conditions(table, start, end, filters)
+        if conditions is None:
+            return 0
+        total += db.session.execute(
+            select(func.count()).select_from(table).where(*conditions)
+        ).scalar() or 0
+    return total
+
+
+def encode_cursor(record):
+    """مؤشر الصفحة التالية (نص مبهم) من آخر سجل في الصفحة"""
+    return encode_payload([record.created_at.isoformat(), record.partition, record.id])
+
+
+def decode_cursor(cursor):
+    """(created_at, partition, id) من المؤشر أو ValueError إذا كان غير صالح"""
+    try:
+        created_at, partition, record_id = decode_payload(cursor)
+        return datetime.fromisoformat(created_at), str(partition), int(record_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def search_logs(start=None, end=None, filters=None, cursor=None, limit=50):
+    """
+    بحث بنظام keyset: الصفحة التالية تبدأ بعد (created_at, partition, id) لآخر سجل
+
+    لا يوجد OFFSET: كل صفحة تستخدم الفهرس مباشرة مهما كان عمق التصفح
+
+    يعيد: (records, next_cursor) و next_cursor = None عند انتهاء النتائج
+    """
+    after = decode_cursor(cursor) if cursor else None
+
+    records = []
+    for partition in partitions_for_range(start, end):
+        if len(records) > limit:
+            break
+        if after and partition.month_key > after[1]:
+            continue  # أشهر أحدث من آخر سجل تم عرضه
+
+        table = partition_table(partition.month_key)
+        conditions = _build_conditions(table, start, end, filters)
+        if conditions is None:
+            return [], None
+        if after and partition.month_key == after[1]:
+            conditions.append(or_(
+                table.c.created_at < after[0],
+                and_(table.c.created_at == after[0], table.c.id < after[2])
+            ))
+
+        # سجل إضافي واحد لمعرفة وجود صفحة تالية
+        query = select(table).where(*conditions).order_by(
+            table.c.created_at.desc(), table.c.id.desc()
+        ).limit(limit + 1 - len(records))
+
+        for row in db.session.execute(query):
+            records.append(AuditRecord(partition.month_key, row))
+
+    if len(records) > limit:
+        records = records[:limit]
+        return records, encode_cursor(records[-1])
+    return records, None
+
+
+def top_ips(start=None, end=None, filters=None, limit=3):
+    """أكثر عناوين IP تكراراً (GROUP BY واحد على الجداول المطلوبة)"""
+    selects = []
+    for partition in partitions_for_range(start, end):
+        table = partition_table(partition.month_key)
+        conditions = _build_conditions(table, start, end, filters)
+        if conditions is None:
+            return []
+        selects.append(
+            select(table.c.ip_address.label('ip_address'), func.count().label('hits'))
+            .where(table.c.ip_address.isnot(None), *conditions)
+            .group_by(table.c.ip_address)
+        )
+
+    if not selects:
+        return []
+
+    combined = union_all(*selects).subquery() if len(selects) > 1 else selects[0].subquery()
+    total_hits = func.sum(combined.c.hits)
+    query = select(combined.c.ip_address, total_hits.label('hits')).group_by(
+        combined.c.ip_address
+    ).order_by(total_hits.desc()).limit(limit)
+
+    return [(row.ip_address, int(row.hits)) for row in db.session.execute(query)]
+
+
+# ============================================================================
+# 5️⃣ الأرشفة والاحتفاظ
+# ============================================================================
+
+def archive_old_partitions(retain_months=AUDIT_RETENTION_MONTHS, archive_dir=AUDIT_ARCHIVE_DIR):
+    """
+    أرشفة الأشهر الأقدم من retain_months إلى ملفات NDJSON مضغوطة ثم حذف جداولها
+    """
+    now = datetime.utcnow()
+    cutoff_index = now.year * 12 + (now.month - 1) - retain_months
+    cutoff = datetime(cutoff_index // 12, cutoff_index % 12 + 1, 1)
+
+    old_partitions = AuditPartition.query.filter(
+        AuditPartition.status == 'active',
+        AuditPartition.period_end <= cutoff
+    ).order_by(AuditPartition.period_start).all()
+
+    archived = 0
+    for partition in old_partitions:
+        table = partition_table(partition.month_key)
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_path = os.path.join(archive_dir, f'{table.name}.ndjson.gz')
+        temp_path = archive_path + '.tmp'
+
+        rows_written = 0
+        with db.engine.connect() as connection:
+            result = connection.execution_options(yield_per=5000).execute(
+                select(table).order_by(table.c.created_at, table.c.id)
+            )
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as archive_file:
+                for row in result:
+                    record = AuditRecord(partition.month_key, row).to_dict()
+                    archive_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    rows_written += 1
+        os.replace(temp_path, archive_path)
+
+        with db.engine.begin() as connection:
+            table.drop(connection, checkfirst=True)
+            connection.execute(
+                AuditPartition.__table__.update().where(
+                    AuditPartition.id == partition.id
+                ).values(
+                    status='archived',
+                    archive_path=archive_path,
+                    archived_rows=rows_written,
+                    archived_at=datetime.utcnow()
+                )
+            )
+
+        _ensured_partitions.discard(partition.month_key)
+        archived += 1
+        print(f"📦 تمت أرشفة {table.name}: {rows_written} سجل → {archive_path}")
+
+    return archived
+
+
+def migrate_legacy_rows(batch_size=5000):
+    """
+    نقل السجلات القديمة من جدول audit_log إلى الجداول الشهرية (يستدعى من ensure_schema)
+
+    كل دفعة في transaction واحد (حذف من audit_log + إضافة للجداول الشهرية):
+    التوقف في المنتصف لا يكرر السجلات، وإذا نقلت عملية أخرى نفس الدفعة في نفس
+    اللحظة يلغى الـ transaction (عدد المحذوف أقل من الدفعة)
+    """
+    legacy = AuditLog.__table__
+    moved = 0
+    while True:
+        with db.engine.connect() as connection:
+            legacy_rows = connection.execute(
+                select(legacy).order_by(legacy.c.id).limit(batch_size)
+            ).all()
+        if not legacy_rows:
+            break
+
+        prepared = _prepare_rows([{
+            'actor_type': row.actor_type,
+            'actor_id': row.actor_id,
+            'action': row.action,
+            'description': row.description,
+            'resource_type': row.resource_type,
+            'resource_id': row.resource_id,
+            'ip_address': row.ip_address,
+            'created_at': row.created_at
+        } for row in legacy_rows])
+
+        with db.engine.connect() as connection:
+            with connection.begin() as transaction:
+                deleted = connection.execute(legacy.delete().where(
+                    legacy.c.id.between(legacy_rows[0].id, legacy_rows[-1].id)
+                )).rowcount
+                if deleted != len(legacy_rows):
+                    transaction.rollback()
+                    print("⚠️ سجلات audit_log تنقل من عملية أخرى")
+                    break
+                _write_prepared(connection, prepared)
+
+        moved += len(legacy_rows)
+        print(f"🔄 تم نقل {moved} سجل")
+
+    return moved
+
+
+background_tasks.register_periodic('audit_log_retention', 24 * 3600, archive_old_partitions)
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'archive'
+
+    with app.app_context():
+        db.create_all()
+        if command == 'migrate':
+            print(f"✅ تم نقل {migrate_legacy_rows()} سجل إلى الجداول الشهرية")
+        elif command == 'archive':
+            print(f"✅ تمت أرشفة {archive_old_partitions()} جدول")
+        else:
+            print("الاستخدام: python audit_store.py [migrate|archive]")
@@ -0,0 +1,107 @@
+"""
+تشغيل المهام الدورية في الخلفية (تفريغ الـ buffers، التنظيف، ...)
+
+- Thread واحد يمر على المهام المسجلة وينفذ المستحق منها داخل app_context
+- مهام الإغلاق (shutdown hooks) تنفذ مرة واحدة عند خروج العملية لتفريغ البيانات المعلقة
+- لا يعمل داخل عمليات الـ Process Pool (spawn يعيد استيراد app.py كـ __mp_main__)
+"""
+
+import atexit
+import threading
+import multiprocessing
+import time
+from config import BACKGROUND_TASKS_ENABLED
+
+_tasks = []
+_shutdown_hooks = []
+_app = None
+_thread = None
+_stop_event = threading.Event()
+_shutdown_done = False
+
+
+class PeriodicTask:
+    """مهمة دورية بسيطة"""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = time.monotonic() + interval
+        self.runs = 0
+        self.errors = 0
+
+
+def register_periodic(name, interval, func):
+    """تسجيل دالة تنفذ كل interval ثانية"""
+    task = PeriodicTask(name, interval, func)
+    _tasks.append(task)
+    return task
+
+
+def register_shutdown(func):
+    """تسجيل دالة تنفذ عند إغلاق التطبيق (مثل تفريغ الـ buffers)"""
+    _shutdown_hooks.append(func)
+
+
+def _run_task(task):
+    try:
+        with _app.app_context():
+            task.func()
+        task.runs += 1
+    except Exception as e:
+        task.errors += 1
+        print(f"❌ خطأ في المهمة الدورية {task.name}: {str(e)}")
+    finally:
+        task.next_run = time.monotonic() + task.interval
+
+
+def _loop():
+    while not _stop_event.wait(0.5):
+        now = time.monotonic()
+        for task in list(_tasks):
+            if task.next_run <= now:
+                _run_task(task)
+
+
+def init_app(app):
+    """ربط المهام بالتطبيق وتشغيل الـ thread (في العملية الرئيسية فقط)"""
+    global _app, _thread
+    if multiprocessing.parent_process() is not None:
+        # عملية worker في pool (التشفير، الفواتير): لا مهام دورية ولا تفريغ عند الخروج
+        return
+
+    _app = app
+    atexit.register(shutdown)
+
+    if not BACKGROUND_TASKS_ENABLED or _thread is not None:
+        return
+
+    _thread = threading.Thread(target=_loop, name='background-tasks', daemon=True)
+    _thread.start()
+
+
+def shutdown():
+    """إيقاف المهام وتنفيذ مهام الإغلاق"""
+    global _shutdown_done
+    if _shutdown_done or _app is None:
+        return
+    _shutdown_done = True
+    _stop_event.set()
+
+    for func in _shutdown_hooks:
+        try:
+            with _app.app_context():
+                func()
+        except Exception as e:
+            print(f"❌ خطأ أثناء الإغلاق: {str(e)}")
+
+
+def get_tasks_status():
+    """حالة المهام المسجلة (للمراقبة)"""
+    return [{
+        'name': task.name,
+        'interval': task.interval,
+        'runs': task.runs,
+        'errors': task.errors
+    } for task in _tasks]
@@ -0,0 +1,131 @@
+"""
+قياس زمن إحصائيات لوحة تحكم الموزع (get_dashboard_stats) حتى مليون كود
+
+- قاعدة SQLite في ملف مؤقت بنفس جداول وفهارس models.py
+- لكل حجم: موزع واحد بكل الأكواد + موزع آخر بنفس العدد (حتى لا يكون الموزع وحده في الجدول)
+- cold: بعد invalidate_dashboard_stats (Query واحد)، cached: من TTLCache
+
+ملاحظة: الـ cold تكلفته O(عدد أكواد الموزع) - الـ Query يمر على كل صفوف الموزع عبر
+فهرس (reseller_id, status) لأن الأرقام تعتمد على created_at و activated_at أيضاً.
+الثابت هو عدد الـ Queries (1) وزمن الـ cached فقط، والكاش (DASHBOARD_STATS_TTL)
+يجعل الـ cold مرة واحدة لكل موزع كل TTL أو بعد كل تغيير
+
+الاستخدام:
+    python benchmarks/dashboard_stats_latency.py [--sizes 100,10000,100000,1000000] [--repeat 5]
+
+النتيجة: زمن الإدخال، cold p50/max و cached p50 بالـ ms، وتكلفة الـ cold لكل 1000 كود
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH_SIZE = 10000
+
+
+def _create_app(database_uri):
+    from flask import Flask
+    from models import db
+
+    app = Flask('servo_bench', root_path=ROOT)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False
+    )
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def _insert_codes(reseller_id, count):
+    """ثلث الأكواد اليوم، ثلث منتهية، والباقي قبل شهر"""
+    from sqlalchemy import insert
+    from models import db, ActivationCode
+    from subscription_helper import STATUS_ACTIVE, STATUS_EXPIRED
+
+    now = datetime.utcnow()
+    ages = [timedelta(0), timedelta(days=1), timedelta(days=30)]
+    rows = []
+    for index in range(count):
+        created_at = now - ages[index % 3]
+        rows.append({
+            'code': f'{reseller_id}-{index}',
+            'reseller_id': reseller_id,
+            'duration_months': 12,
+            'max_devices': 1,
+            'activated_at': created_at,
+            'expiration_date': created_at + timedelta(days=365),
+            'status': STATUS_EXPIRED if index % 3 == 1 else STATUS_ACTIVE,
+            'created_at': created_at
+        })
+        if len(rows) == BATCH_SIZE:
+            db.session.execute(insert(ActivationCode), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(ActivationCode), rows)
+    db.session.commit()
+
+
+def _median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def run(sizes, repeat):
+    from models import db, Reseller
+    from routes.reseller import get_dashboard_stats, invalidate_dashboard_stats
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            app = _create_app(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            with app.app_context():
+                reseller_ids = []
+                for name in ('bench', 'other'):
+                    reseller = Reseller(name=f'{name}{size}', email=f'{name}{size}@example.com',
+                                        password_hash='x', points_balance=0)
+                    db.session.add(reseller)
+                    db.session.commit()
+                    reseller_ids.append(reseller.id)
+
+                started = time.perf_counter()
+                for reseller_id in reseller_ids:
+                    _insert_codes(reseller_id, size)
+                insert_seconds = time.perf_counter() - started
+                reseller_id = reseller_ids[0]
+
+                cold, cached = [], []
+                for _ in range(repeat):
+                    invalidate_dashboard_stats(reseller_id)
+                    started = time.perf_counter()
+                    stats = get_dashboard_stats(reseller_id)
+                    cold.append((time.perf_counter() - started) * 1000)
+
+                    started = time.perf_counter()
+                    get_dashboard_stats(reseller_id)
+                    cached.append((time.perf_counter() - started) * 1000)
+
+                assert stats['total_activations'] == size
+                print(
+                    f"{size:>9} codes: insert {insert_seconds:.1f}s | cold p50={_median(cold):.1f}ms "
+                    f"max={max(cold):.1f}ms ({_median(cold) / size * 1000:.3f}ms per 1k codes) | "
+                    f"cached p50={_median(cached):.3f}ms",
+                    flush=True
+                )
+                db.session.remove()
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('BACKGROUND_TASKS_ENABLED', 'False')
+    sys.path.insert(0, ROOT)
+    run([int(size) for size in args.sizes.split(',')], args.repeat)
@@ -0,0 +1,140 @@
+"""
+قياس تأخر رسائل Socket.IO أثناء موجة تسجيل دخول (hashing_helper)
+
+- الخادم: التطبيق الحقيقي (async_mode='eventlet') على منفذ محلي + حدث bench_ping يرد فوراً
+- العميل: عملية منفصلة ترسل bench_ping كل 20ms عبر websocket وتقيس زمن الرد
+- أثناء القياس: LOGINS عملية تحقق من كلمة مرور بتوازي CONCURRENCY
+  - inline: check_password_hash في الـ hub (السلوك القديم)
+  - pool: verify_password (Process Pool)
+
+الاستخدام:
+    python benchmarks/login_storm_latency.py [--logins 40] [--concurrency 8] [--port 5099]
+
+النتيجة: p50 / p95 / p99 / max لزمن الرد بالـ ms (الرسائل المرسلة أثناء الموجة) + مدة الموجة
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PING_INTERVAL = 0.02
+
+
+# ============================================================================
+# العميل (عملية منفصلة بدون eventlet)
+# ============================================================================
+
+def run_client(url, duration):
+    """websocket مباشر (بروتوكول Engine.IO 4 / Socket.IO 5) - يطبع [وقت الإرسال، زمن الرد بالـ ms] كـ JSON"""
+    import simple_websocket
+
+    ws = simple_websocket.Client.connect(f'{url}/socket.io/?EIO=4&transport=websocket')
+    ws.receive()  # 0{...} open
+    ws.send('40')
+    while not ws.receive().startswith('40'):
+        pass
+
+    latencies = []
+    ack_id = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        ack_id += 1
+        sent_at = time.time()
+        sent = time.perf_counter()
+        ws.send(f'42{ack_id}["bench_ping"]')
+        while True:
+            message = ws.receive()
+            if message == '2':  # ping من الخادم
+                ws.send('3')
+            elif message.startswith(f'43{ack_id}'):
+                break
+        latencies.append((sent_at, (time.perf_counter() - sent) * 1000))
+        time.sleep(PING_INTERVAL)
+
+    ws.close()
+    print(json.dumps(latencies))
+
+
+# ============================================================================
+# الخادم
+# ============================================================================
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def run_server(args):
+    import eventlet
+    eventlet.monkey_patch()
+
+    os.environ.setdefault('BACKGROUND_TASKS_ENABLED', 'False')
+    sys.path.insert(0, ROOT)
+    from werkzeug.security import check_password_hash, generate_password_hash
+    from app import app, socketio
+    from hashing_helper import verify_password
+
+    @socketio.on('bench_ping')
+    def bench_ping():
+        return 'pong'
+
+    eventlet.spawn(socketio.run, app, host='127.0.0.1', port=args.port, log_output=False)
+    eventlet.sleep(1)
+
+    password_hash = generate_password_hash('benchmark-password')
+    verify_password(password_hash, 'warm-up')  # تشغيل عمليات الـ pool قبل القياس
+
+    modes = {
+        'inline': lambda: check_password_hash(password_hash, 'benchmark-password'),
+        'pool': lambda: verify_password(password_hash, 'benchmark-password')
+    }
+    url = f'http://127.0.0.1:{args.port}'
+
+    for name, login in modes.items():
+        client = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--client', url, str(args.duration)],
+            stdout=subprocess.PIPE, text=True
+        )
+        eventlet.sleep(1)  # قياس بدون حمل أولاً
+
+        started = time.time()
+        pool = eventlet.GreenPool(args.concurrency)
+        for _ in range(args.logins):
+            pool.spawn(login)
+        pool.waitall()
+        finished = time.time()
+        storm = finished - started
+
+        # subprocess.communicate يعمل كـ greenlet بعد monkey_patch
+        output, _ = client.communicate()
+        # الرسائل المرسلة أثناء الموجة فقط
+        latencies = [latency for sent_at, latency in json.loads(output) if started <= sent_at <= finished]
+        if not latencies:
+            print(f"{name:>6}: client finished before the storm, increase --duration")
+            continue
+        print(
+            f"{name:>6}: {args.logins} logins in {storm:.2f}s | Socket.IO ack ms "
+            f"p50={_percentile(latencies, 50):.1f} p95={_percentile(latencies, 95):.1f} "
+            f"p99={_percentile(latencies, 99):.1f} max={max(latencies):.1f} (n={len(latencies)})"
+        )
+
+    os._exit(0)  # الـ pool والخادم يعملان في greenlets، لا داعي لانتظار إغلاقها
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--client':
+        run_client(sys.argv[2], float(sys.argv[3]))
+    else:
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--logins', type=int, default=40)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--port', type=int, default=5099)
+        parser.add_argument('--duration', type=float, default=0)
+        args = parser.parse_args()
+        # مدة العميل: تكفي للموجة الأبطأ (inline تسلسلية بالكامل)
+        args.duration = args.duration or max(8.0, args.logins * 0.9)
+        run_server(args)
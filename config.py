@@ -28,3 +28,103 @@ JSON_SORT_KEYS = False
 # إعدادات التسجيل
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+
+# إعدادات تشفير كلمات المرور و PIN (تعمل في Process Pool خارج الـ eventlet hub)
+HASHING_POOL_WORKERS = int(os.getenv('HASHING_POOL_WORKERS', '2'))
+HASHING_MAX_PENDING = int(os.getenv('HASHING_MAX_PENDING', '32'))
+HASHING_TIMEOUT = float(os.getenv('HASHING_TIMEOUT', '10'))
+
+# المهام الدورية في الخلفية
+BACKGROUND_TASKS_ENABLED = os.getenv('BACKGROUND_TASKS_ENABLED', 'True') == 'True'
+
+# تجميع تحديثات نشاط الأجهزة (last_login_at / last_ip) - كل كم ثانية يتم التفريغ
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '5'))
+
+# خط تسجيل العمليات (audit log) غير المتزامن
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1'))
+AUDIT_SAMPLE_RATE = int(os.getenv('AUDIT_SAMPLE_RATE', '10'))  # عند الضغط: حفظ حدث واحد من كل N أحداث منخفضة الأهمية
+AUDIT_MAX_RETRIES = int(os.getenv('AUDIT_MAX_RETRIES', '5'))  # محاولات الدفعة الفاشلة قبل الكتابة سجلاً سجلاً
+AUDIT_RETRY_MAX_ROWS = int(os.getenv('AUDIT_RETRY_MAX_ROWS', '20000'))  # حد السجلات المنتظرة للإعادة في الذاكرة (انقطاع القاعدة)
+
+# تخزين سجلات التدقيق: جداول شهرية + أرشفة القديم منها
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', '12'))
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'instance', 'audit_archive'))
+
+# عدد السجلات في كل صفحة من صفحة السجلات الأمنية (keyset pagination)
+AUDIT_PAGE_SIZE = int(os.getenv('AUDIT_PAGE_SIZE', '50'))
+AUDIT_PAGE_MAX_SIZE = int(os.getenv('AUDIT_PAGE_MAX_SIZE', '200'))
+
+# أكواد تفعيل الأجهزة: حذف الأكواد المنتهية غير المستخدمة + إعادة تحميل الأكواد من القاعدة عند عدم العثور
+ACTIVATION_CODE_PURGE_INTERVAL = float(os.getenv('ACTIVATION_CODE_PURGE_INTERVAL', '300'))
+ACTIVATION_CODE_PURGE_GRACE = int(os.getenv('ACTIVATION_CODE_PURGE_GRACE', '3600'))  # ثواني بعد انتهاء الصلاحية
+ACTIVATION_CODE_RELOAD_INTERVAL = float(os.getenv('ACTIVATION_CODE_RELOAD_INTERVAL', '5'))
+
+# انتظار تفعيل الجهاز (long-poll) بدل الاستعلام المتكرر
+ACTIVATION_WAIT_TIMEOUT = int(os.getenv('ACTIVATION_WAIT_TIMEOUT', '25'))
+ACTIVATION_WAIT_MAX_TIMEOUT = int(os.getenv('ACTIVATION_WAIT_MAX_TIMEOUT', '60'))
+ACTIVATION_NOTICE_TTL = int(os.getenv('ACTIVATION_NOTICE_TTL', '600'))  # مدة الاحتفاظ بإشعار التفعيل في الذاكرة
+
+# التفعيل الجماعي للأكواد (الحد الأقصى للأكواد في طلب واحد)
+BULK_ACTIVATION_MAX_CODES = int(os.getenv('BULK_ACTIVATION_MAX_CODES', '500'))
+
+# مهمة تحويل الاشتراكات المنتهية إلى expired (كل كم ثانية)
+SUBSCRIPTION_SWEEP_INTERVAL = float(os.getenv('SUBSCRIPTION_SWEEP_INTERVAL', '60'))
+
+# كاش إحصائيات لوحة تحكم الموزع (ثواني)
+DASHBOARD_STATS_TTL = int(os.getenv('DASHBOARD_STATS_TTL', '30'))
+
+# تحليلات الموزع لأي فترة (مصفوفات NumPy في الذاكرة لكل موزع)
+ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', '300'))
+ANALYTICS_CACHE_MAX_RESELLERS = int(os.getenv('ANALYTICS_CACHE_MAX_RESELLERS', '200'))
+ANALYTICS_MAX_BUCKETS = int(os.getenv('ANALYTICS_MAX_BUCKETS', '1000'))
+
+# ردود التحليلات: مدة الكاش في المتصفح (Cache-Control) ومدة حفظ الرد في الذاكرة لكل نسخة بيانات
+ANALYTICS_HTTP_MAX_AGE = int(os.getenv('ANALYTICS_HTTP_MAX_AGE', '60'))
+ANALYTICS_MEMO_TTL = int(os.getenv('ANALYTICS_MEMO_TTL', '600'))
+
+# صفحات المستخدمين والأجهزة للموزع (عدد الصفوف في كل صفحة)
+RESELLER_PAGE_SIZE = int(os.getenv('RESELLER_PAGE_SIZE', '50'))
+RESELLER_PAGE_MAX_SIZE = int(os.getenv('RESELLER_PAGE_MAX_SIZE', '200'))
+
+# قوائم الـ API (keyset pagination): عدد الصفوف الافتراضي والحد الأقصى لكل صفحة
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '50'))
+API_PAGE_MAX_SIZE = int(os.getenv('API_PAGE_MAX_SIZE', '200'))
+
+# تصدير الأكواد: عدد الصفوف في كل دفعة من القاعدة (yield_per)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))
+
+# مهام التصدير في الخلفية
+# - EXPORT_DIR: مجلد الملفات الجاهزة للتحميل
+# - EXPORT_WORKERS: عدد مهام التصدير المتزامنة في العملية
+# - EXPORT_MAX_RUNNING_PER_OWNER: مهام التشغيل المتزامنة لكل موزع / مدير (الباقي ينتظر في الطابور)
+# - EXPORT_MAX_PENDING_PER_OWNER: الحد الأقصى للمهام المنتظرة + الجارية لكل موزع / مدير (429 بعده)
+# - EXPORT_JOB_TTL_HOURS: بعدها يحذف الملف ولا يمكن تحميله
+# - EXPORT_JOB_TIMEOUT: مهمة جارية أقدم من هذه المدة (ثوانٍ) تعتبر فاشلة (توقف العملية مثلاً)
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(os.path.dirname(__file__), 'instance', 'exports'))
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+EXPORT_MAX_RUNNING_PER_OWNER = int(os.getenv('EXPORT_MAX_RUNNING_PER_OWNER', '1'))
+EXPORT_MAX_PENDING_PER_OWNER = int(os.getenv('EXPORT_MAX_PENDING_PER_OWNER', '3'))
+EXPORT_JOB_TTL_HOURS = int(os.getenv('EXPORT_JOB_TTL_HOURS', '24'))
+EXPORT_JOB_TIMEOUT = int(os.getenv('EXPORT_JOB_TIMEOUT', '3600'))
+
+# عدادات لوحة المسؤول: مطابقتها مع الجداول (ثوانٍ) وأقل مدة بين تحديثين عبر Socket.IO
+SYSTEM_COUNTERS_RECONCILE_INTERVAL = int(os.getenv('SYSTEM_COUNTERS_RECONCILE_INTERVAL', '3600'))
+SYSTEM_COUNTERS_PUSH_INTERVAL = int(os.getenv('SYSTEM_COUNTERS_PUSH_INTERVAL', '2'))
+
+# فواتير الشحن: تولد في Process Pool خارج الطلب
+# - INVOICE_POOL_WORKERS: عدد العمليات (كل عملية تحتفظ بالقالب والخطوط محملة)
+# - INVOICE_MAX_PENDING: الحد الأقصى للفواتير المنتظرة (الزائد يولد عند أول طلب تحميل)
+# - INVOICE_RETRY_AFTER: الثواني التي ينتظرها العميل قبل إعادة طلب فاتورة قيد التوليد
+INVOICE_POOL_WORKERS = int(os.getenv('INVOICE_POOL_WORKERS', '1'))
+INVOICE_MAX_PENDING = int(os.getenv('INVOICE_MAX_PENDING', '100'))
+INVOICE_RETRY_AFTER = int(os.getenv('INVOICE_RETRY_AFTER', '2'))
+
+# إرسال الفواتير عبر Nginx بدل Python (فارغ = send_file من التطبيق)
+# مثال: INVOICE_ACCEL_REDIRECT_PREFIX=/_protected/invoices/ مع
+#   location /_protected/invoices/ { internal; alias /path/to/static/invoices/; }
+INVOICE_ACCEL_REDIRECT_PREFIX = os.getenv('INVOICE_ACCEL_REDIRECT_PREFIX', '')
+
+# أرشيف فواتير ZIP للمسؤول: أقصى عدد أيام في الطلب الواحد
+INVOICE_ZIP_MAX_DAYS = int(os.getenv('INVOICE_ZIP_MAX_DAYS', '366'))
@@ -0,0 +1,98 @@
+"""
+إشعار الأجهزة المنتظرة للتفعيل (بدل الاستعلام المتكرر)
+
+المشكلة:
+- شاشة التفعيل على التلفاز تستدعي register_device / device_login بشكل متكرر
+  حتى يدخل الموزع الكود، وكل استدعاء = Query على القاعدة
+
+الحل:
+- activate_code_api ينشر إشعار التفعيل:
+  - Socket.IO: الغرفة device_<device_id> (حدث device_activated)
+  - ذاكرة: dict بالأجهزة المفعلة حديثاً يقرأ منه long-poll بدون أي Query
+- الأجهزة بدون Socket.IO تستخدم /api/device/wait-activation (ينتظر حتى timeout)
+- عند انتهاء الانتظار بدون إشعار: Query واحد فقط (للتفعيل من عملية أخرى)
+"""
+
+import time
+import threading
+from flask import current_app
+from config import ACTIVATION_NOTICE_TTL
+
+_notices = {}  # device_id -> (payload, monotonic_time)
+_lock = threading.Lock()
+_stats = {
+    'published': 0,
+    'waiting': 0,
+    'long_polls': 0,
+    'notified_from_memory': 0,
+    'timeouts': 0
+}
+
+
+def device_room(device_id):
+    """اسم غرفة Socket.IO الخاصة بالجهاز"""
+    return f'device_{device_id}'
+
+
+def _cleanup(now):
+    expired = [device_id for device_id, (_, created) in _notices.items() if now - created > ACTIVATION_NOTICE_TTL]
+    for device_id in expired:
+        del _notices[device_id]
+
+
+def publish_activation(device_id, payload):
+    """نشر تفعيل الجهاز لكل من ينتظره"""
+    now = time.monotonic()
+    with _lock:
+        _cleanup(now)
+        _notices[device_id] = (payload, now)
+        _stats['published'] += 1
+
+    socketio = current_app.extensions.get('socketio')
+    if socketio is not None:
+        try:
+            socketio.emit('device_activated', payload, to=device_room(device_id))
+        except Exception as e:
+            print(f"⚠️ تعذر إرسال إشعار التفعيل عبر Socket.IO: {str(e)}")
+
+
+def get_notice(device_id):
+    """إشعار التفعيل المحفوظ للجهاز أو None"""
+    with _lock:
+        notice = _notices.get(device_id)
+    return notice[0] if notice else None
+
+
+def wait_for_activation(device_id, timeout, check_interval=0.5):
+    """
+    انتظار إشعار التفعيل حتى timeout ثانية (يقرأ من الذاكرة فقط)
+
+    الانتظار عبر socketio.sleep حتى لا يحجز الـ eventlet hub
+    """
+    socketio = current_app.extensions.get('socketio')
+    sleep = socketio.sleep if socketio is not None else time.sleep
+    deadline = time.monotonic() + timeout
+
+    with _lock:
+        _stats['long_polls'] += 1
+        _stats['waiting'] += 1
+    try:
+        while True:
+            notice = get_notice(device_id)
+            if notice is not None:
+                with _lock:
+                    _stats['notified_from_memory'] += 1
+                return notice
+            if time.monotonic() >= deadline:
+                with _lock:
+                    _stats['timeouts'] += 1
+                return None
+            sleep(check_interval)
+    finally:
+        with _lock:
+            _stats['waiting'] -= 1
+
+
+def stats():
+    with _lock:
+        return dict(_stats, pending_notices=len(_notices))
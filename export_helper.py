@@ -0,0 +1,278 @@
+"""
+تصدير أكواد التفعيل بدون تحميل كل الصفوف في الذاكرة
+
+المشكلة:
+- export_codes كان يحمل كل الأكواد بـ .all() ثم User.query.get لكل صف
+- openpyxl بالوضع العادي يحتفظ بكل خلية في الذاكرة، و insert_rows في النهاية يزيح كل الصفوف
+- الملف كله يبنى في BytesIO قبل إرسال أول بايت
+
+الحل:
+- Query واحد (JOIN مع المستخدم) يقرأ بدفعات yield_per
+- XLSX بوضع write_only (الصفوف تكتب للملف مباشرة) إلى ملف مؤقت على القرص
+- CSV / NDJSON كـ generator يرسل على دفعات (chunked) أثناء القراءة من القاعدة
+
+ملاحظة: في XLSX التنسيق على العنوان والرؤوس وعمود الحالة فقط
+(تنسيق كل خلية يضاعف وقت التصدير عدة مرات في الملفات الكبيرة)
+"""
+
+import io
+import csv
+import json
+import unicodedata
+from urllib.parse import quote
+from datetime import datetime
+from sqlalchemy import select, func
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.worksheet.cell_range import CellRange
+from models import db, ActivationCode, User
+from subscription_helper import status_label
+from config import EXPORT_BATCH_SIZE
+
+# الصيغ المدعومة: format -> (mimetype, الامتداد)
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson')
+}
+
+CODE_EXPORT_HEADERS = [
+    'Activation Code',
+    'Username',
+    'Plan Type',
+    'Max Devices',
+    'Status',
+    'Created Date',
+    'Expiration Date',
+    'Created At (Full)'
+]
+
+# مفاتيح NDJSON بنفس ترتيب CODE_EXPORT_HEADERS
+CODE_EXPORT_KEYS = [
+    'code', 'username', 'plan_type', 'max_devices', 'status',
+    'created_date', 'expiration_date', 'created_at'
+]
+
+# السجلات الأمنية (CSV / NDJSON فقط)
+AUDIT_EXPORT_KEYS = [
+    'id', 'created_at', 'actor_type', 'actor_id', 'action',
+    'description', 'resource_type', 'resource_id', 'ip_address'
+]
+
+# عرض الأعمدة A..H
+CODE_COLUMN_WIDTHS = [20, 18, 15, 12, 16, 15, 16, 22]
+
+_CHUNK_ROWS = 1000
+
+
+def content_disposition(filename):
+    """
+    Content-Disposition للردود المتدفقة (send_file يفعل ذلك للملفات فقط)
+
+    اسم ASCII احتياطي + filename* بترميز UTF-8 (أسماء الموزعين قد تكون عربية)
+    """
+    ascii_name = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    ascii_name = ascii_name.replace('"', '').replace('\\', '') or 'export'
+    if ascii_name == filename:
+        return f'attachment; filename="{filename}"'
+    return f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(filename)}'
+
+
+# ============================================================================
+# القراءة من القاعدة
+# ============================================================================
+
+def code_export_query(reseller_id):
+    """أكواد الموزع مع اسم المستخدم (JOIN بدل Query لكل صف)"""
+    return select(
+        ActivationCode.id,
+        ActivationCode.code,
+        ActivationCode.max_devices,
+        ActivationCode.is_lifetime,
+        ActivationCode.status,
+        ActivationCode.expiration_date,
+        ActivationCode.created_at,
+        User.username
+    ).outerjoin(
+        User, User.id == ActivationCode.assigned_user_id
+    ).where(
+        ActivationCode.reseller_id == reseller_id
+    ).order_by(ActivationCode.created_at.desc(), ActivationCode.id.desc())
+
+
+def count_codes(reseller_id):
+    return db.session.execute(
+        select(func.count(ActivationCode.id)).where(ActivationCode.reseller_id == reseller_id)
+    ).scalar()
+
+
+def code_record(row):
+    """صف التصدير (بترتيب CODE_EXPORT_HEADERS)"""
+    return [
+        row.code,
+        row.username or 'N/A',
+        'Lifetime' if row.is_lifetime else '1 Year',
+        row.max_devices,
+        status_label(row),  # الحالة المخزنة
+        row.created_at.strftime('%Y-%m-%d') if row.created_at else 'N/A',
+        row.expiration_date.strftime('%Y-%m-%d') if row.expiration_date else 'N/A',
+        row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else 'N/A'
+    ]
+
+
+def iter_code_records(reseller_id, batch_size=EXPORT_BATCH_SIZE):
+    """صفوف التصدير على دفعات من القاعدة (الذاكرة ثابتة مهما كان عدد الأكواد)"""
+    result = db.session.execute(
+        code_export_query(reseller_id).execution_options(yield_per=batch_size)
+    )
+    for row in result:
+        yield code_record(row)
+
+
+def audit_record(record):
+    """صف تصدير سجل أمني (بترتيب AUDIT_EXPORT_KEYS)"""
+    data = record.to_dict()
+    return [data[key] for key in AUDIT_EXPORT_KEYS]
+
+
+# ============================================================================
+# CSV / NDJSON (generator يرسل على دفعات)
+# ============================================================================
+
+def iter_csv(headers, records, chunk_rows=_CHUNK_ROWS):
+    """
+    CSV كقطع نصية (كل قطعة chunk_rows صف)
+
+    يبدأ بـ BOM حتى يفتح Excel الملف بترميز UTF-8
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+
+    pending = 0
+    for record in records:
+        writer.writerow(record)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    yield buffer.getvalue()
+
+
+def iter_ndjson(keys, records, chunk_rows=_CHUNK_ROWS):
+    """سطر JSON لكل صف (كل قطعة chunk_rows سطر)"""
+    lines = []
+    for record in records:
+        lines.append(json.dumps(dict(zip(keys, record)), ensure_ascii=False, default=str))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+# ============================================================================
+# XLSX (write_only)
+# ============================================================================
+
+_HEADER_FILL = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+_HEADER_FONT = Font(bold=True, color="FFFFFF", size=11)
+_HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center", wrap_text=True)
+_THIN_BORDER = Border(
+    left=Side(style='thin', color='000000'),
+    right=Side(style='thin', color='000000'),
+    top=Side(style='thin', color='000000'),
+    bottom=Side(style='thin', color='000000')
+)
+
+# ألوان عمود الحالة: status -> (fill, font)
+_STATUS_STYLES = {
+    'Active': (
+        PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid"),
+        Font(color="006100", bold=True)
+    ),
+    'Expired': (
+        PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid"),
+        Font(color="9C0006", bold=True)
+    ),
+    'Not Activated': (
+        PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid"),
+        Font(color="9C6500", bold=True)
+    )
+}
+
+_STATUS_COLUMN = CODE_EXPORT_HEADERS.index('Status')
+
+
+def _styled_cell(ws, value, fill=None, font=None, alignment=None, border=None):
+    cell = WriteOnlyCell(ws, value=value)
+    if fill:
+        cell.fill = fill
+    if font:
+        cell.font = font
+    if alignment:
+        cell.alignment = alignment
+    if border:
+        cell.border = border
+    return cell
+
+
+def write_codes_xlsx(fileobj, reseller_name, records, total, progress=None):
+    """
+    كتابة تقرير الأكواد إلى fileobj بوضع write_only
+
+    total مطلوب مسبقاً لأن صف المعلومات في الأعلى (لا يمكن إدراج صفوف لاحقاً)
+    progress: دالة اختيارية تستدعى بعدد الصفوف المكتوبة كل _CHUNK_ROWS صف
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Activation Codes")
+
+    last_column = chr(ord('A') + len(CODE_EXPORT_HEADERS) - 1)
+    for index, width in enumerate(CODE_COLUMN_WIDTHS):
+        ws.column_dimensions[chr(ord('A') + index)].width = width
+
+    # صف العنوان + صف معلومات التصدير + الرؤوس (الارتفاعات قبل كتابة الصفوف)
+    ws.row_dimensions[1].height = 28
+    ws.row_dimensions[2].height = 18
+    ws.row_dimensions[3].height = 25
+    ws.merged_cells.add(CellRange(f'A1:{last_column}1'))
+    ws.merged_cells.add(CellRange(f'A2:{last_column}2'))
+
+    ws.append([_styled_cell(
+        ws, f"Activation Codes Report - {reseller_name}",
+        fill=PatternFill(start_color="203864", end_color="203864", fill_type="solid"),
+        font=Font(bold=True, size=14, color="FFFFFF"),
+        alignment=Alignment(horizontal="center", vertical="center")
+    )])
+    ws.append([_styled_cell(
+        ws, f"Exported on: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} | Total Records: {total}",
+        fill=PatternFill(start_color="F0F0F0", end_color="F0F0F0", fill_type="solid"),
+        font=Font(italic=True, size=9, color="666666"),
+        alignment=Alignment(horizontal="left", vertical="center")
+    )])
+    ws.append([
+        _styled_cell(ws, header, _HEADER_FILL, _HEADER_FONT, _HEADER_ALIGNMENT, _THIN_BORDER)
+        for header in CODE_EXPORT_HEADERS
+    ])
+
+    written = 0
+    for record in records:
+        style = _STATUS_STYLES.get(record[_STATUS_COLUMN])
+        if style:
+            record[_STATUS_COLUMN] = _styled_cell(ws, record[_STATUS_COLUMN], *style)
+        ws.append(record)
+
+        written += 1
+        if progress and written % _CHUNK_ROWS == 0:
+            progress(written)
+
+    wb.save(fileobj)
+    if progress:
+        progress(written)
+    return written
@@ -0,0 +1,503 @@
+"""
+مهام التصدير في الخلفية (export_jobs)
+
+المشكلة:
+- export_codes وتصدير السجلات الأمنية يحجزان worker الويب طوال إنشاء الملف
+  (دقائق في الحسابات الكبيرة) وأي انقطاع في التحميل يعني البدء من الصفر
+- موزع واحد يطلب عدة تصديرات كبيرة في نفس الوقت يستهلك كل الـ workers
+
+الحل:
+- الطلب ينشئ صف في export_jobs (queued) ويعيد 202 فوراً مع job_key
+- ThreadPoolExecutor يكتب الملف على القرص على دفعات (export_helper) ثم يعيد تسميته
+- التقدم: في الذاكرة للـ polling + Socket.IO (الغرفة export_<job_key>)
+- الملف الجاهز يرسل بـ send_file(conditional=True) أي دعم Range (استكمال التحميل)
+  ويحذف بعد EXPORT_JOB_TTL_HOURS
+- حد للمهام الجارية لكل مالك (الباقي ينتظر دوره بدون حجز worker) وحد للمهام المعلقة (429)
+- مهام دورية: تشغيل المهام المنتظرة، حذف الملفات المنتهية، إنهاء المهام العالقة
+
+ملاحظة: التقدم أثناء التشغيل محفوظ في ذاكرة العملية التي تنفذ المهمة
+(القاعدة تحدث عند البداية والنهاية فقط حتى لا تتعارض الكتابة مع قراءة الدفعات)
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, send_file
+from sqlalchemy import select, update, func
+from models import db, ExportJob, Reseller
+import audit_store
+import background_tasks
+from export_helper import (
+    EXPORT_FORMATS, CODE_EXPORT_HEADERS, CODE_EXPORT_KEYS, AUDIT_EXPORT_KEYS,
+    count_codes, iter_code_records, audit_record, iter_csv, iter_ndjson, write_codes_xlsx
+)
+from config import (
+    EXPORT_DIR, EXPORT_WORKERS, EXPORT_MAX_RUNNING_PER_OWNER, EXPORT_MAX_PENDING_PER_OWNER,
+    EXPORT_JOB_TTL_HOURS, EXPORT_JOB_TIMEOUT, EXPORT_BATCH_SIZE
+)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_EXPIRED = 'expired'
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+# نوع التصدير -> الصيغ المسموحة
+EXPORT_KINDS = {
+    'activation_codes': ('xlsx', 'csv', 'ndjson'),
+    'audit_logs': ('csv', 'ndjson')
+}
+
+_PROGRESS_EVERY_ROWS = 1000
+_PROGRESS_INTERVAL = 1.0  # أقل مدة (ثوانٍ) بين إشعارين للتقدم
+
+_executor = None
+_active = 0  # المهام الجارية في هذه العملية
+_progress = {}  # job_key -> {'progress_rows', 'total_rows'}
+_lock = threading.Lock()
+_dispatch_lock = threading.Lock()
+_stats = {
+    'enqueued': 0,
+    'rejected': 0,
+    'completed': 0,
+    'failed': 0,
+    'expired_files': 0
+}
+
+
+class ExportLimitError(Exception):
+    """المالك وصل للحد الأقصى من مهام التصدير المعلقة"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__(f'Too many pending exports. Maximum: {limit}')
+
+
+def export_room(job_key):
+    """اسم غرفة Socket.IO الخاصة بمهمة التصدير"""
+    return f'export_{job_key}'
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+        return _executor
+
+
+def _emit(event, payload, job_key):
+    socketio = current_app.extensions.get('socketio')
+    if socketio is None:
+        return
+    try:
+        socketio.emit(event, payload, to=export_room(job_key))
+    except Exception as e:
+        print(f"⚠️ تعذر إرسال حالة التصدير عبر Socket.IO: {str(e)}")
+
+
+# ============================================================================
+# الطابور
+# ============================================================================
+
+def enqueue(owner_type, owner_id, kind, export_format, params=None):
+    """
+    إنشاء مهمة تصدير وتشغيلها إذا كان للمالك مكان (وإلا تنتظر دورها)
+
+    يرفع ValueError لنوع أو صيغة غير مدعومة و ExportLimitError عند تجاوز الحد
+    """
+    if export_format not in EXPORT_KINDS.get(kind, ()):
+        raise ValueError('Invalid export format')
+
+    pending = db.session.execute(
+        select(func.count(ExportJob.id)).where(
+            ExportJob.owner_type == owner_type,
+            ExportJob.owner_id == owner_id,
+            ExportJob.status.in_(ACTIVE_STATUSES)
+        )
+    ).scalar()
+    if pending >= EXPORT_MAX_PENDING_PER_OWNER:
+        with _lock:
+            _stats['rejected'] += 1
+        raise ExportLimitError(EXPORT_MAX_PENDING_PER_OWNER)
+
+    job = ExportJob(
+        job_key=uuid.uuid4().hex,
+        owner_type=owner_type,
+        owner_id=owner_id,
+        kind=kind,
+        format=export_format,
+        params=json.dumps(params) if params else None,
+        status=STATUS_QUEUED
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    with _lock:
+        _stats['enqueued'] += 1
+    dispatch()
+    return job
+
+
+def dispatch():
+    """
+    تشغيل المهام المنتظرة بالترتيب مع احترام:
+    - عدد الـ workers في هذه العملية (EXPORT_WORKERS)
+    - حد المهام الجارية لكل مالك (من القاعدة، يشمل العمليات الأخرى)
+
+    مهمة مالك وصل لحده لا توقف مهام الآخرين خلفها
+    """
+    global _active
+    app = current_app._get_current_object()
+    started = []
+
+    with _dispatch_lock:
+        with _lock:
+            free = EXPORT_WORKERS - _active
+        if free <= 0:
+            return 0
+
+        running = db.session.execute(
+            select(ExportJob.owner_type, ExportJob.owner_id, func.count(ExportJob.id)).where(
+                ExportJob.status == STATUS_RUNNING
+            ).group_by(ExportJob.owner_type, ExportJob.owner_id)
+        ).all()
+        per_owner = {(owner_type, owner_id): count for owner_type, owner_id, count in running}
+
+        queued = db.session.execute(
+            select(ExportJob.id, ExportJob.owner_type, ExportJob.owner_id).where(
+                ExportJob.status == STATUS_QUEUED
+            ).order_by(ExportJob.id).limit(100)
+        ).all()
+
+        for job_id, owner_type, owner_id in queued:
+            if free <= 0:
+                break
+            owner = (owner_type, owner_id)
+            if per_owner.get(owner, 0) >= EXPORT_MAX_RUNNING_PER_OWNER:
+                continue
+
+            # حجز ذري: عملية أخرى قد تكون أخذت نفس المهمة
+            claimed = db.session.execute(
+                update(ExportJob).where(
+                    ExportJob.id == job_id,
+                    ExportJob.status == STATUS_QUEUED
+                ).values(
+                    status=STATUS_RUNNING,
+                    started_at=datetime.utcnow()
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                continue
+
+            per_owner[owner] = per_owner.get(owner, 0) + 1
+            free -= 1
+            started.append(job_id)
+
+        with _lock:
+            _active += len(started)
+
+    for job_id in started:
+        _get_executor().submit(_run_job, app, job_id)
+    return len(started)
+
+
+def _run_job(app, job_id):
+    global _active
+    try:
+        with app.app_context():
+            _execute(job_id)
+    except Exception as e:
+        print(f"❌ خطأ في مهمة التصدير {job_id}: {str(e)}")
+    finally:
+        with _lock:
+            _active -= 1
+        # دور المهمة التالية في الطابور
+        try:
+            with app.app_context():
+                dispatch()
+        except Exception as e:
+            print(f"❌ خطأ في تشغيل مهام التصدير المنتظرة: {str(e)}")
+
+
+# ============================================================================
+# التنفيذ
+# ============================================================================
+
+class _Progress:
+    """عداد الصفوف المكتوبة مع إشعار كل _PROGRESS_EVERY_ROWS صف (بحد أقصى إشعار كل ثانية)"""
+
+    def __init__(self, job_key):
+        self.job_key = job_key
+        self.rows = 0
+        self.total = None
+        self._last_publish = 0
+
+    def start(self, total):
+        self.total = total
+        self.publish(force=True)
+
+    def track(self, records):
+        for record in records:
+            yield record
+            self.rows += 1
+            if self.rows % _PROGRESS_EVERY_ROWS == 0:
+                self.publish()
+
+    def publish(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_publish < _PROGRESS_INTERVAL:
+            return
+        self._last_publish = now
+
+        with _lock:
+            _progress[self.job_key] = {'progress_rows': self.rows, 'total_rows': self.total}
+        _emit('export_progress', {
+            'job_key': self.job_key,
+            'status': STATUS_RUNNING,
+            'progress_rows': self.rows,
+            'total_rows': self.total,
+            'percent': _percent(self.rows, self.total, STATUS_RUNNING)
+        }, self.job_key)
+
+
+def _write_text(path, chunks):
+    with open(path, 'w', encoding='utf-8', newline='') as fileobj:
+        for chunk in chunks:
+            fileobj.write(chunk)
+
+
+def _write_activation_codes(job, path, progress):
+    reseller = db.session.get(Reseller, job.owner_id)
+    progress.start(count_codes(job.owner_id))
+    records = progress.track(iter_code_records(job.owner_id))
+
+    if job.format == 'xlsx':
+        with open(path, 'wb') as fileobj:
+            write_codes_xlsx(fileobj, reseller.name, records, progress.total)
+    elif job.format == 'csv':
+        _write_text(path, iter_csv(CODE_EXPORT_HEADERS, records))
+    else:
+        _write_text(path, iter_ndjson(CODE_EXPORT_KEYS, records))
+
+    return f"activation_codes_{reseller.name}"
+
+
+def _parse_param_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _write_audit_logs(job, path, progress):
+    params = json.loads(job.params) if job.params else {}
+    start = _parse_param_datetime(params.get('from'))
+    end = _parse_param_datetime(params.get('to'))
+    filters = params.get('filters') or {}
+
+    progress.start(audit_store.count_logs(start, end, filters))
+    records = progress.track(
+        audit_record(record)
+        for record in audit_store.iter_logs(start, end, filters, batch_size=EXPORT_BATCH_SIZE)
+    )
+
+    if job.format == 'csv':
+        _write_text(path, iter_csv(AUDIT_EXPORT_KEYS, records))
+    else:
+        _write_text(path, iter_ndjson(AUDIT_EXPORT_KEYS, records))
+
+    return 'audit_logs'
+
+
+# نوع التصدير -> دالة الكتابة (تعيد بداية اسم الملف للتحميل)
+_WRITERS = {
+    'activation_codes': _write_activation_codes,
+    'audit_logs': _write_audit_logs
+}
+
+
+def _execute(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if job is None:
+        return
+
+    extension = EXPORT_FORMATS[job.format][1]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f'{job.job_key}.{extension}')
+    part_path = path + '.part'
+    progress = _Progress(job.job_key)
+
+    try:
+        name = _WRITERS[job.kind](job, part_path, progress)
+        os.replace(part_path, path)
+
+        finished_at = datetime.utcnow()
+        values = {
+            'status': STATUS_DONE,
+            'progress_rows': progress.rows,
+            'total_rows': progress.rows,
+            'filename': f"{name}_{finished_at.strftime('%Y%m%d_%H%M%S')}.{extension}",
+            'file_path': path,
+            'file_size': os.path.getsize(path),
+            'finished_at': finished_at,
+            'expires_at': finished_at + timedelta(hours=EXPORT_JOB_TTL_HOURS)
+        }
+        with _lock:
+            _stats['completed'] += 1
+        print(f"📦 تم التصدير {job.job_key}: {progress.rows} صف ({values['file_size']} بايت)")
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        values = {
+            'status': STATUS_FAILED,
+            'progress_rows': progress.rows,
+            'error': str(e)[:255],
+            'finished_at': datetime.utcnow()
+        }
+        with _lock:
+            _stats['failed'] += 1
+        print(f"❌ فشل التصدير {job.job_key}: {str(e)}")
+
+    db.session.execute(
+        update(ExportJob).where(ExportJob.id == job_id).values(**values).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    with _lock:
+        _progress.pop(job.job_key, None)
+    db.session.expire(job)
+    _emit('export_finished', job_to_dict(job), job.job_key)
+
+
+# ============================================================================
+# القراءة
+# ============================================================================
+
+def _percent(rows, total, status):
+    if status == STATUS_DONE:
+        return 100.0
+    if not total:
+        return 0.0
+    return round(min(rows * 100.0 / total, 100.0), 1)
+
+
+def job_to_dict(job):
+    """حالة المهمة (التقدم الحي من الذاكرة إذا كانت المهمة تعمل في هذه العملية)"""
+    with _lock:
+        live = _progress.get(job.job_key)
+    progress_rows = live['progress_rows'] if live else job.progress_rows
+    total_rows = live['total_rows'] if live else job.total_rows
+
+    return {
+        'job_key': job.job_key,
+        'kind': job.kind,
+        'format': job.format,
+        'status': job.status,
+        'progress_rows': progress_rows,
+        'total_rows': total_rows,
+        'percent': _percent(progress_rows, total_rows, job.status),
+        'filename': job.filename,
+        'file_size': job.file_size,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None
+    }
+
+
+def get_job(owner_type, owner_id, job_key):
+    """مهمة المالك أو None (لا يمكن قراءة مهام مالك آخر)"""
+    return db.session.execute(
+        select(ExportJob).where(
+            ExportJob.job_key == job_key,
+            ExportJob.owner_type == owner_type,
+            ExportJob.owner_id == owner_id
+        )
+    ).scalar_one_or_none()
+
+
+def list_jobs(owner_type, owner_id, limit=20):
+    """آخر مهام المالك"""
+    return db.session.execute(
+        select(ExportJob).where(
+            ExportJob.owner_type == owner_type,
+            ExportJob.owner_id == owner_id
+        ).order_by(ExportJob.id.desc()).limit(limit)
+    ).scalars().all()
+
+
+def artifact_path(job):
+    """مسار الملف الجاهز للتحميل أو None (لم ينته بعد، انتهت صلاحيته، أو حذف)"""
+    if job.status != STATUS_DONE or not job.file_path:
+        return None
+    if job.expires_at and job.expires_at <= datetime.utcnow():
+        return None
+    return job.file_path if os.path.exists(job.file_path) else None
+
+
+def send_artifact(job, path):
+    """إرسال الملف الجاهز مع دعم Range / If-Range (استكمال التحميل المنقطع)"""
+    return send_file(
+        path,
+        mimetype=EXPORT_FORMATS[job.format][0],
+        as_attachment=True,
+        download_name=job.filename,
+        conditional=True
+    )
+
+
+# ============================================================================
+# التنظيف
+# ============================================================================
+
+def cleanup_jobs():
+    """
+    حذف ملفات المهام المنتهية صلاحيتها + إنهاء المهام العالقة (توقفت العملية أثناء التصدير)
+    """
+    now = datetime.utcnow()
+
+    expired = db.session.execute(
+        select(ExportJob).where(
+            ExportJob.status == STATUS_DONE,
+            ExportJob.expires_at <= now
+        )
+    ).scalars().all()
+    for job in expired:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job.status = STATUS_EXPIRED
+        job.file_path = None
+
+    stale = db.session.execute(
+        update(ExportJob).where(
+            ExportJob.status == STATUS_RUNNING,
+            ExportJob.started_at < now - timedelta(seconds=EXPORT_JOB_TIMEOUT)
+        ).values(
+            status=STATUS_FAILED,
+            error='Export timed out',
+            finished_at=now
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    with _lock:
+        _stats['expired_files'] += len(expired)
+    if expired or stale:
+        print(f"🧹 تنظيف التصدير: {len(expired)} ملف منتهي، {stale} مهمة عالقة")
+    return len(expired), stale
+
+
+def stats():
+    with _lock:
+        return dict(_stats, active=_active, workers=EXPORT_WORKERS)
+
+
+# المهام المنتظرة من عمليات أخرى أو بعد إعادة التشغيل
+background_tasks.register_periodic('export_dispatch', 10, dispatch)
+background_tasks.register_periodic('export_cleanup', 600, cleanup_jobs)
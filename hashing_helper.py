@@ -0,0 +1,154 @@
+"""
+تشفير كلمات المرور و PIN خارج الـ eventlet hub
+
+المشكلة:
+- check_password_hash / generate_password_hash تستخدم PBKDF2 وتستهلك المعالج لعشرات الـ ms
+- التطبيق يعمل بـ async_mode='eventlet' لذلك أي عملية تشفير توقف كل الـ greenlets الأخرى
+  (رسائل Socket.IO، الطلبات الأخرى...)
+
+الحل:
+- إرسال عمليات التشفير إلى Process Pool محدود العدد
+- الانتظار بفحص future.done() مع eventlet.sleep حتى يبقى الـ hub حراً أثناء الانتظار
+  (لا ننتظر من thread حقيقي: قفل الـ future بعد monkey_patch قفل eventlet
+   وانتظاره من thread آخر يعلق حتى HASHING_TIMEOUT)
+- حد أقصى لعدد العمليات المعلقة: الطلبات الزائدة ترفض فوراً بدل تكديسها
+- انتهاء المهلة أو تعطل الـ pool: HashingBusyError (503 بدل 500)، والـ pool المعطل يعاد إنشاؤه
+"""
+
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+from config import HASHING_POOL_WORKERS, HASHING_MAX_PENDING, HASHING_TIMEOUT
+
+try:
+    import eventlet
+    from eventlet import tpool
+except ImportError:  # التشغيل بدون eventlet (مثلاً python app.py)
+    eventlet = None
+    tpool = None
+
+# الفترة بين فحصين لانتهاء العملية (ثوانٍ)
+_POLL_INTERVAL = 0.005
+
+
+class HashingBusyError(Exception):
+    """عدد عمليات التشفير المعلقة تجاوز الحد المسموح"""
+    pass
+
+
+class HashingPool:
+    """Process Pool لعمليات PBKDF2 مع حد أقصى للطابور"""
+
+    def __init__(self, workers=HASHING_POOL_WORKERS, max_pending=HASHING_MAX_PENDING, timeout=HASHING_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """إنشاء الـ pool عند أول استخدام (spawn لتجنب نسخ حالة eventlet عند fork)"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HashingBusyError('Too many pending hashing operations')
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _reset_executor(self, executor):
+        """إزالة pool معطل (عملية انتهت فجأة) حتى ينشأ pool جديد في الطلب التالي"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _wait(self, future):
+        """انتظار النتيجة دون حجز الـ hub - TimeoutError بعد self.timeout"""
+        if eventlet is None:
+            return future.result(self.timeout)
+
+        deadline = time.monotonic() + self.timeout
+        while not future.done():
+            if time.monotonic() >= deadline:
+                future.cancel()
+                raise TimeoutError('Hashing operation timed out')
+            eventlet.sleep(_POLL_INTERVAL)
+        return future.result()
+
+    def run(self, func, *args):
+        """تنفيذ دالة تشفير في الـ pool وانتظار النتيجة دون حجز الـ hub"""
+        self._acquire()
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(func, *args)
+            except Exception as e:
+                # في حالة تعطل الـ pool: التنفيذ في thread حقيقي بدل إيقاف الخدمة
+                print(f"⚠️ Hashing pool unavailable, running in thread: {str(e)}")
+                if isinstance(e, BrokenProcessPool):
+                    self._reset_executor(executor)
+                return tpool.execute(func, *args) if tpool else func(*args)
+
+            try:
+                return self._wait(future)
+            except TimeoutError:
+                with self._lock:
+                    self._timeouts += 1
+                print("⚠️ Hashing operation timed out")
+                raise HashingBusyError('Hashing operation timed out')
+            except BrokenProcessPool:
+                print("⚠️ Hashing pool broken, recreating")
+                self._reset_executor(executor)
+                raise HashingBusyError('Hashing pool unavailable')
+        finally:
+            self._release()
+
+    def stats(self):
+        """إحصائيات الـ pool (للمراقبة)"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+hashing_pool = HashingPool()
+
+
+def verify_password(password_hash, password):
+    """بديل check_password_hash يعمل في الـ pool"""
+    if not password_hash or password is None:
+        return False
+    return hashing_pool.run(check_password_hash, password_hash, password)
+
+
+def hash_password(password):
+    """بديل generate_password_hash يعمل في الـ pool"""
+    return hashing_pool.run(generate_password_hash, password)
@@ -51,8 +51,9 @@ if __name__ == '__main__':
     
     print("🔄 بدء تهيئة قاعدة البيانات...")
     with app.app_context():
-        # إنشاء الجداول
-        db.create_all()
+        # إنشاء الجداول والأعمدة والفهارس الجديدة
+        from app import ensure_schema
+        ensure_schema()
         print("✅ تم إنشاء الجداول")
         
         # إضافة البيانات التجريبية
@@ -0,0 +1,510 @@
+"""
+توليد فواتير الشحن (PDF) خارج الطلب
+
+المشكلة:
+- reseller_topup كان يستدعي save_invoice_pdf داخل الطلب: xhtml2pdf يستهلك المعالج
+  لمئات الـ ms ويوقف الـ eventlet hub (كل الطلبات ورسائل Socket.IO)
+- commit إضافي بعد commit الشحن لحفظ invoice_path
+- القالب يقرأ ويحلل والخطوط تحمل من جديد مع كل فاتورة
+
+الحل:
+- Process Pool (spawn) يولد الفاتورة ويكتبها في ملف مؤقت ثم يعيد تسميته (لا يوجد ملف ناقص)
+- كل عملية تحمل القالب والخطوط مرة واحدة عند بدايتها (initializer + فاتورة تجريبية)
+- invoice_path يحفظ مع الشحن في نفس الـ transaction، والـ pool لا يلمس القاعدة
+- الحالة: الملف موجود = جاهزة، وإلا pending (التحميل يعيد 202 ويطلب التوليد إن لم يكن جارياً)
+- أمر لإعادة توليد فواتير الشحنات القديمة بالجملة
+- الإرسال بـ send_file (ETag / Last-Modified / Range) أو X-Accel-Redirect لـ Nginx
+  بدل قراءة الملف كاملاً في الذاكرة
+- الفاتورة البديلة (reportlab عند فشل xhtml2pdf) تحفظ كملف، فكل فاتورة تولد مرة واحدة
+- أرشيف ZIP لفواتير فترة يبنى أثناء الإرسال (ZIP_STORED، قطع ثابتة الحجم، ملخص CSV اختياري)
+
+ملاحظة: الفواتير الجارية في الذاكرة (لكل عملية)، لذلك إعادة التشغيل تفقدها فقط
+ويعاد توليدها عند أول طلب تحميل
+"""
+
+import io
+import os
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, send_file
+from sqlalchemy import select
+from models import db, ResellerTopUp, Reseller
+from export_helper import iter_csv
+from config import INVOICE_POOL_WORKERS, INVOICE_MAX_PENDING, INVOICE_ACCEL_REDIRECT_PREFIX
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+INVOICE_TEMPLATE = 'admin/components/invoice.html'
+
+_RERENDER_BATCH_SIZE = 200
+_ZIP_BATCH_SIZE = 500
+_ZIP_CHUNK_SIZE = 64 * 1024
+
+INVOICE_SUMMARY_HEADERS = [
+    'Invoice Number', 'Date', 'Reseller', 'Email', 'Points', 'Amount (USD)', 'File'
+]
+
+_executor = None
+_pending = {}  # topup_id -> Future
+_failed = {}  # topup_id -> آخر خطأ
+_lock = threading.Lock()
+_stats = {
+    'queued': 0,
+    'rendered': 0,
+    'failed': 0,
+    'rejected': 0,
+    'fallback': 0,
+    'pool_restarts': 0
+}
+
+
+# ============================================================================
+# المسارات والبيانات
+# ============================================================================
+
+def invoice_relative_path(topup):
+    """المسار داخل static (يحفظ في invoice_path): invoices/YYYY/MM/DD/<رقم>.pdf"""
+    return f"invoices/{topup.created_at.strftime('%Y/%m/%d')}/{topup.invoice_number}.pdf"
+
+
+def invoice_file_path(topup):
+    """المسار الكامل للملف (الشحنات القديمة بدون invoice_path تستخدم نفس التقسيم بالتاريخ)"""
+    relative_path = topup.invoice_path or invoice_relative_path(topup)
+    return os.path.join(BASE_DIR, 'static', relative_path.replace('/', os.sep))
+
+
+def invoice_context(topup, reseller):
+    """متغيرات القالب (قيم بسيطة فقط حتى تنتقل للعملية الأخرى)"""
+    return {
+        'invoice_number': topup.invoice_number,
+        'reseller_name': reseller.name,
+        'reseller_email': reseller.email,
+        'invoice_date': topup.created_at.strftime('%B %d, %Y'),
+        'points': topup.points,
+        'amount_usd': f'{topup.amount_usd:.2f}'
+    }
+
+
+# ============================================================================
+# داخل عملية الـ pool
+# ============================================================================
+
+_template = None
+
+
+def _init_worker(template_dir):
+    """تحميل القالب مرة واحدة + فاتورة تجريبية لتحميل الخطوط قبل أول طلب"""
+    global _template
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    from xhtml2pdf import pisa
+
+    env = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(['html']))
+    _template = env.get_template(INVOICE_TEMPLATE)
+    pisa.CreatePDF(_template.render(
+        invoice_number='', reseller_name='', reseller_email='',
+        invoice_date='', points=0, amount_usd='0.00'
+    ), dest=io.BytesIO())
+
+
+def _write_atomic(file_path, write):
+    """كتابة الملف عبر ملف مؤقت ثم إعادة تسمية (لا يرى أحد ملفاً ناقصاً) - يعيد حجم الملف"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'wb') as result_file:
+            write(result_file)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return os.path.getsize(file_path)
+
+
+def render_invoice(context, file_path):
+    """توليد PDF وكتابته إلى file_path - يعيد حجم الملف"""
+    from xhtml2pdf import pisa
+
+    if _template is None:
+        _init_worker(TEMPLATE_DIR)
+
+    def write(result_file):
+        status = pisa.CreatePDF(_template.render(**context), dest=result_file)
+        if status.err:
+            raise RuntimeError(f'xhtml2pdf reported {status.err} errors')
+
+    return _write_atomic(file_path, write)
+
+
+def render_fallback_invoice(context, file_path, created_at):
+    """فاتورة مبسطة بـ reportlab (عند فشل xhtml2pdf) - تحفظ في نفس المسار"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+    styles = getSampleStyleSheet()
+    invoice_info = Table([
+        ['Invoice Number:', context['invoice_number']],
+        ['Date:', created_at.strftime('%Y-%m-%d %H:%M')],
+        ['Reseller:', context['reseller_name']],
+        ['Email:', context['reseller_email']],
+    ])
+    invoice_info.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+
+    details = Table([
+        ['Description', 'Quantity', 'Amount'],
+        ['Points Top Up', f"{context['points']} PTS", f"${context['amount_usd']}"],
+        ['', '', ''],
+        ['Total', '', f"${context['amount_usd']}"]
+    ], colWidths=[300, 100, 100])
+    details.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+
+    def write(result_file):
+        SimpleDocTemplate(result_file, pagesize=letter).build([
+            Paragraph("<b>Invoice</b>", styles['Heading1']),
+            Spacer(1, 12),
+            invoice_info,
+            Spacer(1, 20),
+            details
+        ])
+
+    return _write_atomic(file_path, write)
+
+
+# ============================================================================
+# الطابور
+# ============================================================================
+
+def _get_executor():
+    """إنشاء الـ pool عند أول استخدام (spawn لتجنب نسخ حالة eventlet عند fork)"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=INVOICE_POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(TEMPLATE_DIR,)
+            )
+        return _executor
+
+
+def _reset_executor(executor):
+    """
+    إزالة pool معطل (عملية ماتت: BrokenProcessPool) حتى ينشأ pool جديد مع الطلب التالي
+
+    الـ pool المعطل أنهى عملياته بنفسه، لذلك يكفي إسقاط المرجع
+    """
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+            _stats['pool_restarts'] += 1
+            print('⚠️ Invoice pool is broken, a new pool will be started')
+
+
+def _submit(func, *args):
+    """submit للـ pool - يعيد (executor, future)، ومع pool معطل يعيد المحاولة مرة في pool جديد"""
+    executor = _get_executor()
+    try:
+        return executor, executor.submit(func, *args)
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        executor = _get_executor()
+        return executor, executor.submit(func, *args)
+
+
+def _on_done(topup_id, invoice_number, executor, future):
+    with _lock:
+        _pending.pop(topup_id, None)
+        error = future.exception()
+        if error is None:
+            _failed.pop(topup_id, None)
+            _stats['rendered'] += 1
+        else:
+            _failed[topup_id] = str(error)
+            _stats['failed'] += 1
+
+    if isinstance(error, BrokenProcessPool):
+        _reset_executor(executor)
+
+    if error is None:
+        print(f'✅ Invoice generated: {invoice_number}')
+    else:
+        print(f'❌ Invoice generation error ({invoice_number}): {str(error)}')
+
+
+def enqueue_invoice(topup, reseller=None):
+    """
+    طلب توليد فاتورة الشحن (بدون انتظار)
+
+    يعيد True إذا كانت في الطابور أو جارية، و False عند امتلاء الطابور أو تعطل الـ pool
+    """
+    with _lock:
+        if topup.id in _pending:
+            return True
+        if len(_pending) >= INVOICE_MAX_PENDING:
+            _stats['rejected'] += 1
+            return False
+
+    context = invoice_context(topup, reseller or topup.reseller)
+    try:
+        executor, future = _submit(render_invoice, context, invoice_file_path(topup))
+    except Exception as e:
+        print(f'⚠️ Invoice pool unavailable: {str(e)}')
+        with _lock:
+            _failed[topup.id] = str(e)
+        return False
+
+    with _lock:
+        _pending[topup.id] = future
+        _failed.pop(topup.id, None)
+        _stats['queued'] += 1
+    future.add_done_callback(lambda done: _on_done(topup.id, topup.invoice_number, executor, done))
+    return True
+
+
+def invoice_status(topup):
+    """ready (الملف موجود)، pending (في الطابور)، failed (آخر محاولة فشلت)، missing"""
+    if os.path.exists(invoice_file_path(topup)):
+        return 'ready'
+    with _lock:
+        if topup.id in _pending:
+            return 'pending'
+        if topup.id in _failed:
+            return 'failed'
+    return 'missing'
+
+
+def stats():
+    """إحصائيات الطابور (للمراقبة)"""
+    with _lock:
+        return dict(_stats, workers=INVOICE_POOL_WORKERS, pending=len(_pending), failed_now=len(_failed))
+
+
+# ============================================================================
+# الإرسال
+# ============================================================================
+
+def ensure_fallback_invoice(topup):
+    """حفظ الفاتورة البديلة (reportlab) إذا لم يوجد الملف - مرة واحدة لكل فاتورة"""
+    file_path = invoice_file_path(topup)
+    if os.path.exists(file_path):
+        return file_path
+    render_fallback_invoice(invoice_context(topup, topup.reseller), file_path, topup.created_at)
+    with _lock:
+        _failed.pop(topup.id, None)
+        _stats['fallback'] += 1
+    print(f'⚠️ Fallback invoice saved: {topup.invoice_number}')
+    return file_path
+
+
+def send_invoice(topup, as_attachment=True):
+    """
+    إرسال ملف الفاتورة بدون قراءته في الذاكرة
+
+    - INVOICE_ACCEL_REDIRECT_PREFIX: Nginx يرسل الملف (مع ETag / Range) والتطبيق يرسل الرؤوس فقط
+    - وإلا send_file مع conditional (ETag، Last-Modified، 304، Range)
+    """
+    download_name = f'{topup.invoice_number}.pdf'
+    file_path = invoice_file_path(topup)
+
+    if INVOICE_ACCEL_REDIRECT_PREFIX:
+        relative_path = os.path.relpath(file_path, os.path.join(BASE_DIR, 'static', 'invoices'))
+        response = current_app.response_class(mimetype='application/pdf')
+        response.headers['X-Accel-Redirect'] = (
+            INVOICE_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative_path.replace(os.sep, '/')
+        )
+        disposition = 'attachment' if as_attachment else 'inline'
+        response.headers['Content-Disposition'] = f'{disposition}; filename="{download_name}"'
+    else:
+        response = send_file(
+            file_path,
+            mimetype='application/pdf',
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True
+        )
+
+    # الفاتورة لا تتغير بعد توليدها، لكنها خاصة بالمسؤول
+    response.cache_control.private = True
+    return response
+
+
+# ============================================================================
+# أرشيف ZIP لفترة
+# ============================================================================
+
+class _ZipSink:
+    """
+    وجهة zipfile بدون seek: تجمع ما يكتب حتى يرسل
+
+    بدون tell / seek يكتب zipfile الأحجام و CRC بعد كل ملف (data descriptor)
+    فلا حاجة للرجوع للخلف ولا لحفظ الأرشيف
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _topups_in_range(start, end, reseller_id=None):
+    """شحنات [start, end) مع الموزع - قراءة بدفعات"""
+    query = select(ResellerTopUp, Reseller).join(
+        Reseller, Reseller.id == ResellerTopUp.reseller_id
+    ).where(
+        ResellerTopUp.created_at >= start,
+        ResellerTopUp.created_at < end
+    ).order_by(ResellerTopUp.created_at, ResellerTopUp.id)
+    if reseller_id is not None:
+        query = query.where(ResellerTopUp.reseller_id == reseller_id)
+    return db.session.execute(query.execution_options(yield_per=_ZIP_BATCH_SIZE))
+
+
+def _archive_name(topup):
+    return f"{topup.created_at.strftime('%Y/%m/%d')}/{topup.invoice_number}.pdf"
+
+
+def _summary_records(start, end, reseller_id):
+    for topup, reseller in _topups_in_range(start, end, reseller_id):
+        file_path = invoice_file_path(topup)
+        yield [
+            topup.invoice_number,
+            topup.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            reseller.name,
+            reseller.email,
+            topup.points,
+            f'{topup.amount_usd:.2f}',
+            _archive_name(topup) if os.path.exists(file_path) else 'missing'
+        ]
+
+
+def _iter_zip_parts(start, end, reseller_id, include_summary):
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED)
+
+    if include_summary:
+        info = zipfile.ZipInfo('summary.csv', date_time=end.timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, 'w') as entry:
+            for chunk in iter_csv(INVOICE_SUMMARY_HEADERS, _summary_records(start, end, reseller_id)):
+                entry.write(chunk.encode('utf-8'))
+                yield sink.drain()
+        yield sink.drain()
+
+    for topup, _ in _topups_in_range(start, end, reseller_id):
+        file_path = invoice_file_path(topup)
+        if not os.path.exists(file_path):
+            continue
+        info = zipfile.ZipInfo(_archive_name(topup), date_time=topup.created_at.timetuple()[:6])
+        with open(file_path, 'rb') as source, archive.open(info, 'w') as entry:
+            for chunk in iter(lambda: source.read(_ZIP_CHUNK_SIZE), b''):
+                entry.write(chunk)
+                yield sink.drain()
+        yield sink.drain()
+
+    archive.close()
+    yield sink.drain()
+
+
+def iter_invoice_zip(start, end, reseller_id=None, include_summary=True):
+    """
+    أرشيف ZIP لفواتير الفترة [start, end) كقطع bytes (الذاكرة ثابتة مهما كان الحجم)
+
+    - summary.csv أولاً (كل الشحنات، الفواتير غير الموجودة "missing")
+    - ثم ملفات PDF من static/invoices بنفس مسار YYYY/MM/DD (ZIP_STORED: PDF مضغوط أصلاً)
+    - الفواتير غير الموجودة على القرص تتخطى (python invoice_helper.py rerender يولدها)
+    """
+    return (part for part in _iter_zip_parts(start, end, reseller_id, include_summary) if part)
+
+
+# ============================================================================
+# إعادة التوليد بالجملة
+# ============================================================================
+
+def rerender_invoices(missing_only=True, batch_size=_RERENDER_BATCH_SIZE):
+    """
+    إعادة توليد فواتير الشحنات القديمة في الـ pool (دفعة بعد دفعة)
+
+    missing_only: الفواتير التي لا يوجد ملفها فقط
+    يحفظ invoice_path للشحنات القديمة التي لا تملكه - يعيد (المولدة، الفاشلة)
+    """
+    query = select(ResellerTopUp, Reseller).join(
+        Reseller, Reseller.id == ResellerTopUp.reseller_id
+    ).where(ResellerTopUp.created_at.isnot(None)).order_by(ResellerTopUp.id)
+
+    rendered = failed = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(ResellerTopUp.id > last_id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+
+        futures = []
+        for topup, reseller in rows:
+            if not topup.invoice_path:
+                topup.invoice_path = invoice_relative_path(topup)
+            file_path = invoice_file_path(topup)
+            if missing_only and os.path.exists(file_path):
+                continue
+            futures.append((topup, *_submit(render_invoice, invoice_context(topup, reseller), file_path)))
+
+        for topup, executor, future in futures:
+            try:
+                future.result()
+                rendered += 1
+            except Exception as e:
+                failed += 1
+                if isinstance(e, BrokenProcessPool):
+                    _reset_executor(executor)
+                print(f'❌ Invoice generation error ({topup.invoice_number}): {str(e)}')
+
+        db.session.commit()
+        print(f'📄 {rendered} فاتورة حتى الآن (آخر شحنة: {last_id})')
+
+    return rendered, failed
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == 'rerender':
+            done, errors = rerender_invoices(missing_only='--all' not in sys.argv)
+            print(f'✅ تم توليد {done} فاتورة، {errors} فشلت')
+        else:
+            print("الاستخدام: python invoice_helper.py rerender [--all]")
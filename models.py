@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 # تهيئة قاعدة البيانات
 db = SQLAlchemy()
@@ -18,6 +19,10 @@ class BaseModel(db.Model):
 # ----------------------
 class User(BaseModel):
     __tablename__ = 'users'
+    __table_args__ = (
+        # صفحات الموزع: مستخدمو موزع واحد
+        db.Index('ix_users_reseller', 'reseller_id', 'created_at'),
+    )
 
     username = db.Column(db.String(50), unique=True, nullable=False)
     reseller_id = db.Column(db.Integer, db.ForeignKey('resellers.id'), nullable=False)
@@ -87,6 +92,14 @@ Reseller.topups = db.relationship('ResellerTopUp', back_populates='reseller', ca
 # ----------------------
 class ActivationCode(BaseModel):
     __tablename__ = 'activation_codes'
+    __table_args__ = (
+        # عد وفلترة اشتراكات الموزع حسب الحالة
+        db.Index('ix_activation_codes_reseller_status', 'reseller_id', 'status'),
+        # مهمة تحويل المنتهية إلى expired
+        db.Index('ix_activation_codes_status_expiry', 'status', 'expiration_date'),
+        # آخر كود لكل مستخدم
+        db.Index('ix_activation_codes_user_created', 'assigned_user_id', 'created_at'),
+    )
 
     code = db.Column(db.String(50), unique=True, nullable=False)
     reseller_id = db.Column(db.Integer, db.ForeignKey('resellers.id'), nullable=False)
@@ -97,6 +110,7 @@ class ActivationCode(BaseModel):
     is_lifetime = db.Column(db.Boolean, default=False)  # True if lifetime, False if 1 year
     activated_at = db.Column(db.DateTime, nullable=True)
     expiration_date = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending', server_default='pending')  # pending, active, expired, suspended
 
     # Relationships
     reseller = db.relationship('Reseller', back_populates='activation_codes')
@@ -107,6 +121,14 @@ class ActivationCode(BaseModel):
 # ----------------------
 class DeviceActivationCode(BaseModel):
     __tablename__ = 'device_activation_codes'
+    __table_args__ = (
+        # register_device / device_login: البحث بالجهاز + الحالة + الصلاحية
+        db.Index('ix_device_activation_codes_device', 'device_id', 'is_used', 'expires_at'),
+        # activate_code_api: البحث بالكود
+        db.Index('ix_device_activation_codes_code', 'activation_code', 'is_used'),
+        # حذف الأكواد المنتهية
+        db.Index('ix_device_activation_codes_expiry', 'is_used', 'expires_at'),
+    )
 
     activation_code = db.Column(db.String(50), nullable=False)
     device_id = db.Column(db.String(100), nullable=False)
@@ -129,6 +151,10 @@ class DeviceActivationCode(BaseModel):
 # ----------------------
 class Device(BaseModel):
     __tablename__ = 'devices'
+    __table_args__ = (
+        # أجهزة المستخدم (صفحات الموزع وعدد الأجهزة)
+        db.Index('ix_devices_user', 'user_id', 'is_deleted'),
+    )
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     device_uid = db.Column(db.String(100), unique=True, nullable=False)
@@ -210,6 +236,9 @@ class TicketMessage(BaseModel):
 # ----------------------
 class AuditLog(BaseModel):
     __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_created_at', 'created_at'),
+    )
 
     actor_type = db.Column(db.Enum('user','reseller','admin', name='actor_types'), nullable=False)
     actor_id = db.Column(db.Integer, nullable=False)
@@ -218,3 +247,183 @@ class AuditLog(BaseModel):
     resource_type = db.Column(db.String(50), nullable=True)
     resource_id = db.Column(db.Integer, nullable=True)
     ip_address = db.Column(db.String(45), nullable=True)
+
+# ----------------------
+# Audit Log Storage (تخزين مضغوط مقسم حسب الشهر)
+# ----------------------
+class AuditDictionary(db.Model):
+    """ترميز قيم action / resource_type كأرقام صغيرة"""
+    __tablename__ = 'audit_dictionary'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'value', name='uq_audit_dictionary_kind_value'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)  # action, resource_type
+    value = db.Column(db.String(100), nullable=False)
+
+
+class AuditPartition(db.Model):
+    """سجل الجداول الشهرية audit_log_YYYYMM وحالتها"""
+    __tablename__ = 'audit_partitions'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    month_key = db.Column(db.String(6), unique=True, nullable=False)  # YYYYMM
+    table_name = db.Column(db.String(50), unique=True, nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='active', nullable=False)  # active, archived
+    archive_path = db.Column(db.String(255), nullable=True)
+    archived_rows = db.Column(db.Integer, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=True)
+
+
+# ----------------------
+# Security Counters (عدادات السجلات الأمنية بالساعة)
+# ----------------------
+class SecurityCounter(db.Model):
+    """عدد الأحداث لكل (ساعة، نوع، مفتاح) - مثلاً FAILED_LOGIN أو عنوان IP"""
+    __tablename__ = 'security_counters'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'key', 'bucket_start', name='uq_security_counters_bucket'),
+        db.Index('ix_security_counters_window', 'kind', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(10), nullable=False)  # action, ip (أو action_5m, ip_5m)
+    key = db.Column(db.String(100), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # بداية الساعة (أو الـ 5 دقائق)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+
+# ----------------------
+# Points Ledger (سجل حركات النقاط - إضافة فقط)
+# ----------------------
+class PointsLedger(db.Model):
+    """
+    حركة نقاط غير قابلة للتعديل: delta موجب للشحن وسالب للخصم
+    resellers.points_balance = مجموع delta (رصيد مخزن للقراءة السريعة)
+    """
+    __tablename__ = 'points_ledger'
+    __table_args__ = (
+        db.Index('ix_points_ledger_reseller', 'reseller_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    reseller_id = db.Column(db.Integer, db.ForeignKey('resellers.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    balance_after = db.Column(db.Integer, nullable=False)
+    entry_type = db.Column(db.String(30), nullable=False)  # opening_balance, topup, activation, bulk_activation, adjustment
+    reference_type = db.Column(db.String(50), nullable=True)
+    reference_id = db.Column(db.Integer, nullable=True)
+    description = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+@event.listens_for(PointsLedger, 'before_update')
+@event.listens_for(PointsLedger, 'before_delete')
+def _points_ledger_is_append_only(mapper, connection, target):
+    raise ValueError('points_ledger entries are immutable')
+
+
+# ----------------------
+# Reseller Daily Stats (تجميع يومي للتفعيلات لكل موزع)
+# ----------------------
+class ResellerDailyStats(db.Model):
+    """عدد التفعيلات والنقاط لكل (موزع، يوم) - تحدث مع كل تفعيل"""
+    __tablename__ = 'reseller_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('reseller_id', 'day', name='uq_reseller_daily_stats_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    reseller_id = db.Column(db.Integer, db.ForeignKey('resellers.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    activations = db.Column(db.Integer, default=0, nullable=False)
+    lifetime_activations = db.Column(db.Integer, default=0, nullable=False)
+    yearly_activations = db.Column(db.Integer, default=0, nullable=False)
+    points_spent = db.Column(db.Integer, default=0, nullable=False)
+
+
+# ----------------------
+# Export Jobs (تصدير في الخلفية)
+# ----------------------
+class ExportJob(db.Model):
+    """مهمة تصدير: تكتب في الخلفية إلى ملف على القرص ويحذف الملف بعد expires_at"""
+    __tablename__ = 'export_jobs'
+    __table_args__ = (
+        db.Index('ix_export_jobs_owner', 'owner_type', 'owner_id', 'status'),
+        db.Index('ix_export_jobs_status', 'status', 'expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_key = db.Column(db.String(32), unique=True, nullable=False)
+    owner_type = db.Column(db.String(20), nullable=False)  # reseller, admin
+    owner_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(30), nullable=False)  # activation_codes, audit_logs
+    format = db.Column(db.String(10), nullable=False)  # xlsx, csv, ndjson
+    params = db.Column(db.Text, nullable=True)  # JSON (فلاتر التصدير)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, failed, expired
+    progress_rows = db.Column(db.Integer, default=0, nullable=False)
+    total_rows = db.Column(db.Integer, nullable=True)
+    filename = db.Column(db.String(255), nullable=True)
+    file_path = db.Column(db.String(500), nullable=True)
+    file_size = db.Column(db.BigInteger, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+
+# ----------------------
+# System Counters (عدادات لوحة المسؤول)
+# ----------------------
+class SystemCounter(db.Model):
+    """
+    عداد واحد لكل اسم (resellers, users, active_devices, revenue_cents:YYYY-MM)
+    يحدث في نفس transaction الإضافة / الحذف (system_counters.py)
+    """
+    __tablename__ = 'system_counters'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+# ----------------------
+# Revenue Rollup (تجميع الإيرادات بالساعة / اليوم / الشهر لكل موزع)
+# ----------------------
+class RevenueRollup(db.Model):
+    """مبلغ ونقاط وعدد الشحنات لكل (الدقة، بداية الفترة، موزع) - تحدث مع كل شحن"""
+    __tablename__ = 'revenue_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket_start', 'reseller_id', name='uq_revenue_rollup_bucket'),
+        db.Index('ix_revenue_rollup_reseller', 'reseller_id', 'grain', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    grain = db.Column(db.String(10), nullable=False)  # hour, day, month
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    reseller_id = db.Column(db.Integer, db.ForeignKey('resellers.id'), nullable=False)
+    amount_cents = db.Column(db.BigInteger, default=0, nullable=False)
+    points = db.Column(db.BigInteger, default=0, nullable=False)
+    topups = db.Column(db.Integer, default=0, nullable=False)
+
+
+# ----------------------
+# Reseller Metrics (مقاييس كل موزع لقائمة الموزعين عند المسؤول)
+# ----------------------
+class ResellerMetrics(db.Model):
+    """عدد المستخدمين والأجهزة النشطة والشحنات وآخر شحن - تحدث مع كل تغيير (system_counters.py)"""
+    __tablename__ = 'reseller_metrics'
+    __table_args__ = (
+        db.Index('ix_reseller_metrics_users', 'user_count', 'reseller_id'),
+        db.Index('ix_reseller_metrics_devices', 'active_devices', 'reseller_id'),
+    )
+
+    reseller_id = db.Column(db.Integer, db.ForeignKey('resellers.id'), primary_key=True)
+    user_count = db.Column(db.Integer, default=0, nullable=False)
+    active_devices = db.Column(db.Integer, default=0, nullable=False)
+    topup_count = db.Column(db.Integer, default=0, nullable=False)
+    last_topup_at = db.Column(db.DateTime, nullable=True)
+    last_topup_amount = db.Column(db.Float, nullable=True)
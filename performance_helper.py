@@ -346,3 +346,607 @@ def serialize_activation_code(code):
         'is_active': not (code.expiration_date and code.expiration_date < datetime.utcnow()),
         'expiration_date': code.expiration_date.isoformat() if code.expiration_date else None
     }
+
+
+# ============================================================================
+# 7️⃣ Upsert (إضافة أو زيادة عداد في عملية واحدة)
+# ============================================================================
+
+def upsert_increment(connection, table, rows, key_columns, increment_columns):
+    """
+    إضافة صفوف أو زيادة أعمدة العداد إذا كان المفتاح موجوداً
+    
+    ❌ الطريقة القديمة:
+    row = Counter.query.filter_by(...).first()  # Query
+    if row: row.count += n                      # سباق بين الطلبات
+    else: db.session.add(Counter(...))
+    
+    ✅ الطريقة الجديدة:
+    INSERT ... ON CONFLICT (key) DO UPDATE SET count = count + excluded.count
+    
+    key_columns يجب أن تطابق UniqueConstraint على الجدول
+    """
+    if not rows:
+        return 0
+    
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: table.c[column] + stmt.excluded[column] for column in increment_columns}
+        )
+        connection.execute(stmt, rows)
+        return len(rows)
+    
+    # قواعد بيانات أخرى: UPDATE ثم INSERT إن لم يوجد الصف
+    for row in rows:
+        key_filter = [table.c[column] == row[column] for column in key_columns]
+        result = connection.execute(
+            table.update().where(*key_filter).values(
+                {column: table.c[column] + row[column] for column in increment_columns}
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+    return len(rows)
+
+
+# ============================================================================
+# 8️⃣ إنشاء الفهارس الناقصة على الجداول الموجودة
+# ============================================================================
+
+def ensure_indexes(*models):
+    """
+    db.create_all() لا يضيف الفهارس الجديدة لجداول موجودة مسبقاً
+    هذه الدالة تنشئ فهارس الـ models المعطاة إن لم تكن موجودة
+    """
+    with db.engine.begin() as connection:
+        for model in models:
+            for index in model.__table__.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def ensure_columns(model, *column_names):
+    """
+    إضافة الأعمدة الجديدة لجدول موجود مسبقاً (ALTER TABLE ADD COLUMN)
+    
+    الأعمدة NOT NULL يجب أن يكون لها server_default
+    """
+    from sqlalchemy import inspect, text
+    
+    table = model.__table__
+    with db.engine.begin() as connection:
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        for name in column_names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=connection.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+            if not column.nullable:
+                ddl += ' NOT NULL'
+            connection.execute(text(ddl))
+            print(f"🔧 تمت إضافة العمود {table.name}.{name}")
+
+
+# ============================================================================
+# 9️⃣ كاش في الذاكرة مع مدة صلاحية (لكل عملية)
+# ============================================================================
+
+class TTLCache:
+    """
+    كاش بسيط في ذاكرة العملية مع مدة صلاحية لكل مفتاح
+    
+    بخلاف SessionCache: مشترك بين كل الطلبات (مثلاً إحصائيات موزع واحد
+    يفتح لوحة التحكم من عدة أجهزة)
+    """
+    
+    def __init__(self, ttl, max_entries=10000):
+        import threading
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        import time
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._data[key]
+            self.misses += 1
+            return None
+    
+    def set(self, key, value):
+        import time
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                self._data.clear()
+            self._data[key] = (value, time.monotonic() + self.ttl)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+# ============================================================================
+# 🔟 نسخة البيانات + ETag للردود القابلة للكاش في المتصفح
+# ============================================================================
+
+class DataVersions:
+    """
+    رقم نسخة لكل مفتاح (مثلاً موزع) يزيد عند تغيير بياناته
+    
+    النسخة تبدأ من رقم عشوائي لكل عملية حتى لا يطابق ETag قديم بعد إعادة التشغيل
+    """
+    
+    def __init__(self):
+        import threading
+        import uuid
+        self.boot_id = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            return f'{self.boot_id}.{self._versions.get(key, 0)}'
+    
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+    
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._versions), 'bumps': sum(self._versions.values())}
+
+
+def conditional_json_response(memo, cache_key, max_age, factory):
+    """
+    رد JSON مع ETag و Cache-Control: private
+    
+    - cache_key يجب أن يتضمن نسخة البيانات (DataVersions) وكل ما يؤثر على الرد
+    - If-None-Match مطابق: 304 بدون أي حساب
+    - غير ذلك: الجسم من memo (TTLCache) أو factory() مرة واحدة لكل نسخة
+    """
+    from flask import request, jsonify, make_response
+    
+    etag = hashlib.md5(repr(cache_key).encode()).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(memo.get_or_set(cache_key, factory))
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    response.headers['Vary'] = 'Cookie'
+    return response
+
+
+# ============================================================================
+# 1️⃣1️⃣ صفحات المستخدمين والأجهزة للموزع (JOIN + window function)
+# ============================================================================
+
+def latest_activation_codes(reseller_id=None):
+    """
+    آخر كود تفعيل لكل مستخدم كـ subquery (بدل Query لكل مستخدم)
+    
+    ROW_NUMBER() OVER (PARTITION BY assigned_user_id ORDER BY created_at DESC, id DESC) = 1
+    """
+    from sqlalchemy import select, func
+    
+    row_number = func.row_number().over(
+        partition_by=ActivationCode.assigned_user_id,
+        order_by=(ActivationCode.created_at.desc(), ActivationCode.id.desc())
+    ).label('row_number')
+    
+    ranked = select(
+        ActivationCode.id.label('code_id'),
+        ActivationCode.assigned_user_id.label('user_id'),
+        ActivationCode.code,
+        ActivationCode.expiration_date,
+        ActivationCode.is_lifetime,
+        ActivationCode.status,
+        ActivationCode.max_devices,
+        row_number
+    ).where(ActivationCode.assigned_user_id.isnot(None))
+    
+    if reseller_id is not None:
+        ranked = ranked.where(ActivationCode.reseller_id == reseller_id)
+    
+    ranked = ranked.subquery('ranked_codes')
+    return select(ranked).where(ranked.c.row_number == 1).subquery('latest_code')
+
+
+def paginate_select(query, page=1, per_page=50, max_per_page=200):
+    """
+    تنفيذ select مع COUNT و LIMIT/OFFSET
+    
+    يعيد: {'items': [...Row], 'total', 'page', 'per_page', 'pages'}
+    """
+    from sqlalchemy import select, func
+    
+    per_page = max(1, min(int(per_page), max_per_page))
+    page = max(1, int(page))
+    
+    total = db.session.execute(
+        select(func.count()).select_from(query.order_by(None).subquery())
+    ).scalar()
+    items = db.session.execute(query.limit(per_page).offset((page - 1) * per_page)).all()
+    
+    return {
+        'items': items,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page
+    }
+
+
+def _search_pattern(search):
+    return f"%{search.strip()}%" if search and search.strip() else None
+
+
+def query_reseller_users(reseller_id, search=None, sort='newest'):
+    """
+    مستخدمو الموزع مع آخر كود وعدد الأجهزة في Query واحد
+    
+    sort: newest, oldest, username, expiration
+    """
+    from sqlalchemy import select, func, or_
+    
+    latest = latest_activation_codes(reseller_id)
+    device_counts = select(
+        Device.user_id,
+        func.count(Device.id).label('devices')
+    ).join(User, User.id == Device.user_id).where(
+        User.reseller_id == reseller_id,
+        Device.is_deleted == False
+    ).group_by(Device.user_id).subquery('device_counts')
+    
+    query = select(
+        User.id,
+        User.username,
+        User.created_at,
+        latest.c.code_id,
+        latest.c.code,
+        latest.c.expiration_date,
+        latest.c.is_lifetime,
+        latest.c.status,
+        latest.c.max_devices,
+        func.coalesce(device_counts.c.devices, 0).label('devices')
+    ).outerjoin(
+        latest, latest.c.user_id == User.id
+    ).outerjoin(
+        device_counts, device_counts.c.user_id == User.id
+    ).where(User.reseller_id == reseller_id)
+    
+    pattern = _search_pattern(search)
+    if pattern:
+        conditions = [User.username.ilike(pattern), latest.c.code.ilike(pattern)]
+        if search.strip().isdigit():
+            conditions.append(User.id == int(search.strip()))
+        query = query.where(or_(*conditions))
+    
+    sorts = {
+        'newest': (User.created_at.desc(), User.id.desc()),
+        'oldest': (User.created_at.asc(), User.id.asc()),
+        'username': (User.username.asc(), User.id.asc()),
+        'expiration': (latest.c.expiration_date.is_(None), latest.c.expiration_date.asc(), User.id.asc())
+    }
+    return query.order_by(*sorts.get(sort, sorts['newest']))
+
+
+def query_reseller_devices(reseller_id, search=None, sort='newest'):
+    """
+    أجهزة مستخدمي الموزع مع المستخدم وآخر كود في Query واحد
+    
+    sort: newest, oldest, last_login, user
+    """
+    from sqlalchemy import select, or_
+    
+    latest = latest_activation_codes(reseller_id)
+    
+    query = select(
+        Device.id,
+        Device.device_uid,
+        Device.device_name,
+        Device.device_type,
+        Device.is_active,
+        Device.first_login_at,
+        Device.last_login_at,
+        Device.last_ip,
+        Device.media_link,
+        User.id.label('user_id'),
+        User.username,
+        latest.c.code
+    ).join(
+        User, User.id == Device.user_id
+    ).outerjoin(
+        latest, latest.c.user_id == User.id
+    ).where(
+        User.reseller_id == reseller_id,
+        Device.is_deleted == False
+    )
+    
+    pattern = _search_pattern(search)
+    if pattern:
+        query = query.where(or_(
+            Device.device_uid.ilike(pattern),
+            Device.device_name.ilike(pattern),
+            Device.last_ip.ilike(pattern),
+            User.username.ilike(pattern)
+        ))
+    
+    sorts = {
+        'newest': (Device.created_at.desc(), Device.id.desc()),
+        'oldest': (Device.created_at.asc(), Device.id.asc()),
+        'last_login': (Device.last_login_at.is_(None), Device.last_login_at.desc(), Device.id.desc()),
+        'user': (User.username.asc(), Device.id.asc())
+    }
+    return query.order_by(*sorts.get(sort, sorts['newest']))
+
+
+# تاريخ بديل لـ NULL في ترتيب آخر شحن (keyset لا يقبل NULL) - يعاد كـ None في الـ API
+NO_TOPUP_SENTINEL = datetime(1970, 1, 1)
+
+
+def query_reseller_directory(search=None, today=None):
+    """
+    قائمة الموزعين للمسؤول مع مقاييس كل موزع في Query واحد
+    
+    - المستخدمون والأجهزة النشطة وآخر شحن من reseller_metrics (تحدث مع كل تغيير)
+    - التفعيلات آخر 30 يوم من reseller_daily_stats (30 صف لكل موزع كحد أقصى)
+    
+    يعيد (query, sort_fields): حقول الترتيب لـ KeysetPaginator بنفس أسماء أعمدة الصفوف
+    """
+    from sqlalchemy import select, func, or_, literal
+    from models import Reseller, ResellerMetrics, ResellerDailyStats
+    
+    today = today or datetime.utcnow().date()
+    activations = select(
+        ResellerDailyStats.reseller_id,
+        func.sum(ResellerDailyStats.activations).label('activations')
+    ).where(
+        ResellerDailyStats.day > today - timedelta(days=30)
+    ).group_by(ResellerDailyStats.reseller_id).subquery('recent_activations')
+    
+    metrics = {
+        'user_count': func.coalesce(ResellerMetrics.user_count, 0),
+        'active_devices': func.coalesce(ResellerMetrics.active_devices, 0),
+        'activations_30d': func.coalesce(activations.c.activations, 0),
+        'last_topup_at': func.coalesce(ResellerMetrics.last_topup_at, literal(NO_TOPUP_SENTINEL)),
+        'points_balance': func.coalesce(Reseller.points_balance, 0),
+        'total_amount_charged': func.coalesce(Reseller.total_amount_charged, 0)
+    }
+    
+    query = select(
+        Reseller.id,
+        Reseller.name,
+        Reseller.email,
+        Reseller.country,
+        Reseller.is_active,
+        Reseller.total_points_charged,
+        Reseller.created_at,
+        ResellerMetrics.last_topup_amount,
+        *[expression.label(name) for name, expression in metrics.items()]
+    ).outerjoin(
+        ResellerMetrics, ResellerMetrics.reseller_id == Reseller.id
+    ).outerjoin(
+        activations, activations.c.reseller_id == Reseller.id
+    )
+    
+    pattern = _search_pattern(search)
+    if pattern:
+        query = query.where(or_(
+            Reseller.name.ilike(pattern),
+            Reseller.email.ilike(pattern),
+            Reseller.country.ilike(pattern)
+        ))
+    
+    sort_fields = dict(metrics, created_at=Reseller.created_at, name=Reseller.name)
+    return query, sort_fields
+
+
+def serialize_reseller_directory_row(row):
+    """صف من query_reseller_directory إلى JSON"""
+    has_topup = row.last_topup_at and row.last_topup_at != NO_TOPUP_SENTINEL
+    return {
+        'id': row.id,
+        'name': row.name,
+        'email': row.email,
+        'country': row.country,
+        'is_active': row.is_active,
+        'points_balance': row.points_balance,
+        'total_points_charged': row.total_points_charged,
+        'total_amount_charged': row.total_amount_charged,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'user_count': row.user_count,
+        'active_devices': row.active_devices,
+        'activations_30d': int(row.activations_30d),
+        'last_topup_at': row.last_topup_at.isoformat() if has_topup else None,
+        'last_topup_amount': row.last_topup_amount if has_topup else None
+    }
+
+
+# ============================================================================
+# 1️⃣2️⃣ Keyset Pagination عام (مؤشر مبهم بدل OFFSET)
+# ============================================================================
+
+def encode_cursor(payload):
+    """مؤشر مبهم (base64 لـ JSON) من قيم آخر صف في الصفحة"""
+    import json
+    import base64
+    
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """القيم من المؤشر أو ValueError إذا كان غير صالح"""
+    import json
+    import base64
+    
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _cursor_python_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+class KeysetPaginator:
+    """
+    Pagination بنظام keyset لأي Query
+    
+    - الصفحة التالية تبدأ بعد (قيمة الترتيب، id) لآخر صف: WHERE (col, id) > (:v, :id)
+      فكل صفحة تستخدم الفهرس مباشرة مهما كان عمقها (بدون OFFSET)
+    - الترتيب والفلترة من قائمة مسموحة فقط (أسماء الحقول = أسماء الخصائص في الصفوف)
+    - حقول الترتيب يجب ألا تحتوي NULL، والـ id يحسم التساوي (ترتيب ثابت)
+    
+    مثال:
+        paginator = KeysetPaginator(
+            SupportTicket.id,
+            sort_fields={'created_at': SupportTicket.created_at},
+            filter_fields={'status': SupportTicket.status},
+            default_sort='-created_at'
+        )
+        page = paginator.paginate(SupportTicket.query.filter_by(...), request.args)
+    """
+    
+    def __init__(self, id_column, sort_fields, filter_fields=None, default_sort='-id',
+                 default_limit=50, max_limit=200):
+        self.id_column = id_column
+        self.sort_fields = dict(sort_fields)
+        self.sort_fields.setdefault('id', id_column)
+        self.filter_fields = filter_fields or {}
+        self.default_sort = default_sort
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+    
+    def _parse_sort(self, sort):
+        sort = sort or self.default_sort
+        descending = sort.startswith('-')
+        name = sort.lstrip('-')
+        if name not in self.sort_fields:
+            raise ValueError(f'Invalid sort field: {name}')
+        return sort, name, descending
+    
+    def _coerce(self, column, value):
+        """تحويل قيمة الفلتر (نص) لنوع العمود"""
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return value
+        if python_type is bool:
+            return value.lower() in ('1', 'true', 'yes')
+        if python_type in (int, float):
+            try:
+                return python_type(value)
+            except ValueError:
+                raise ValueError(f'Invalid filter value: {value}')
+        return value
+    
+    def apply_filters(self, query, args):
+        """فلاتر التساوي من args للحقول المسموحة فقط"""
+        applied = {}
+        for name, column in self.filter_fields.items():
+            value = args.get(name)
+            if value is None or value == '':
+                continue
+            query = query.filter(column == self._coerce(column, value))
+            applied[name] = value
+        return query, applied
+    
+    def paginate(self, query, args):
+        """
+        صفحة واحدة من query (Query أو select)
+        
+        args: request.args (sort, cursor, limit + حقول الفلترة)
+        يعيد: {'items', 'next_cursor', 'limit', 'sort', 'filters'}
+        """
+        from sqlalchemy import and_, or_
+        
+        sort, name, descending = self._parse_sort(args.get('sort'))
+        column = self.sort_fields[name]
+        
+        try:
+            limit = int(args.get('limit', self.default_limit))
+        except (TypeError, ValueError):
+            raise ValueError('Invalid limit')
+        limit = max(1, min(limit, self.max_limit))
+        
+        query, filters = self.apply_filters(query, args)
+        
+        cursor = args.get('cursor')
+        if cursor:
+            payload = decode_cursor(cursor)
+            if not isinstance(payload, dict) or payload.get('s') != sort:
+                raise ValueError('Cursor does not match sort')
+            value, last_id = _cursor_python_value(payload.get('v')), payload.get('i')
+            if descending:
+                after = or_(column < value, and_(column == value, self.id_column < last_id))
+            else:
+                after = or_(column > value, and_(column == value, self.id_column > last_id))
+            query = query.filter(after)
+        
+        if descending:
+            query = query.order_by(None).order_by(column.desc(), self.id_column.desc())
+        else:
+            query = query.order_by(None).order_by(column.asc(), self.id_column.asc())
+        
+        # صف إضافي لمعرفة وجود صفحة تالية بدون COUNT
+        query = query.limit(limit + 1)
+        rows = query.all() if hasattr(query, 'all') else db.session.execute(query).all()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor({
+                's': sort,
+                'v': _cursor_value(getattr(last, name)),
+                'i': getattr(last, 'id')
+            })
+        
+        return {
+            'items': rows,
+            'next_cursor': next_cursor,
+            'limit': limit,
+            'sort': sort,
+            'filters': filters
+        }
@@ -0,0 +1,179 @@
+"""
+رصيد نقاط الموزعين: سجل حركات (ledger) + خصم ذري
+
+المشكلة:
+- activate_code_api و reseller_topup كانوا يقرؤون points_balance ويتحققون منه في Python
+  ثم يكتبونه (read-modify-write)، لذلك تفعيلان متزامنان قد يصرفان نفس النقاط
+
+الحل:
+- الخصم بـ UPDATE واحد مشروط:
+  UPDATE resellers SET points_balance = points_balance - n WHERE id = :id AND points_balance >= n
+  و rowcount = 0 يعني رصيد غير كافٍ (لا يمكن أن يصبح الرصيد سالباً)
+- كل حركة تسجل في points_ledger (إضافة فقط) داخل نفس الـ transaction
+- مهمة مطابقة دورية تقارن الرصيد المخزن بمجموع الحركات
+"""
+
+from datetime import datetime
+from sqlalchemy import update, select, func
+from models import db, Reseller, PointsLedger
+import background_tasks
+
+
+class InsufficientPointsError(Exception):
+    """رصيد الموزع لا يكفي للخصم"""
+
+    def __init__(self, required, available):
+        self.required = required
+        self.available = available
+        super().__init__(f'Insufficient points. Required: {required}, Available: {available}')
+
+
+def _current_balance(reseller_id):
+    return db.session.execute(
+        select(Reseller.points_balance).where(Reseller.id == reseller_id)
+    ).scalar() or 0
+
+
+def _add_entry(reseller_id, delta, balance_after, entry_type, reference_type, reference_id, description):
+    db.session.execute(PointsLedger.__table__.insert().values(
+        reseller_id=reseller_id,
+        delta=delta,
+        balance_after=balance_after,
+        entry_type=entry_type,
+        reference_type=reference_type,
+        reference_id=reference_id,
+        description=description[:255] if description else None,
+        created_at=datetime.utcnow()
+    ))
+
+
+def debit_points(reseller_id, points, entry_type, reference_type=None, reference_id=None, description=None):
+    """
+    خصم نقاط بشكل ذري داخل transaction الطلب (بدون commit)
+
+    يعيد الرصيد بعد الخصم، أو يرفع InsufficientPointsError
+    """
+    result = db.session.execute(
+        update(Reseller).where(
+            Reseller.id == reseller_id,
+            Reseller.points_balance >= points
+        ).values(
+            points_balance=Reseller.points_balance - points,
+            total_points_charged=Reseller.total_points_charged + points
+        ).execution_options(synchronize_session='fetch')
+    )
+
+    if result.rowcount == 0:
+        raise InsufficientPointsError(points, _current_balance(reseller_id))
+
+    balance_after = _current_balance(reseller_id)
+    _add_entry(reseller_id, -points, balance_after, entry_type, reference_type, reference_id, description)
+    return balance_after
+
+
+def credit_points(reseller_id, points, entry_type, reference_type=None, reference_id=None, description=None, amount_usd=0):
+    """إضافة نقاط (شحن) داخل transaction الطلب (بدون commit) - يعيد الرصيد بعد الإضافة"""
+    db.session.execute(
+        update(Reseller).where(Reseller.id == reseller_id).values(
+            points_balance=Reseller.points_balance + points,
+            total_points_charged=Reseller.total_points_charged + points,
+            total_amount_charged=Reseller.total_amount_charged + amount_usd
+        ).execution_options(synchronize_session='fetch')
+    )
+
+    balance_after = _current_balance(reseller_id)
+    _add_entry(reseller_id, points, balance_after, entry_type, reference_type, reference_id, description)
+    return balance_after
+
+
+# ============================================================================
+# المطابقة
+# ============================================================================
+
+def ensure_opening_balances():
+    """
+    رصيد افتتاحي لكل موزع ليس له قيد opening_balance
+
+    الرصيد الافتتاحي = الرصيد المخزن - مجموع الحركات المسجلة، أي الرصيد الذي كان
+    لدى الموزع قبل إنشاء الـ ledger (القراءة في SELECT واحد لأن الرصيد والحركات
+    يحدثان في نفس الـ transaction)
+    """
+    has_opening = select(PointsLedger.id).where(
+        PointsLedger.reseller_id == Reseller.id,
+        PointsLedger.entry_type == 'opening_balance'
+    ).exists()
+    ledger_sum = select(func.coalesce(func.sum(PointsLedger.delta), 0)).where(
+        PointsLedger.reseller_id == Reseller.id
+    ).scalar_subquery()
+
+    resellers = db.session.execute(
+        select(Reseller.id, Reseller.points_balance, ledger_sum).where(~has_opening)
+    ).all()
+
+    for reseller_id, balance, recorded in resellers:
+        opening = (balance or 0) - int(recorded or 0)
+        _add_entry(reseller_id, opening, opening, 'opening_balance', None, None,
+                   'Balance before points ledger was introduced')
+    db.session.commit()
+    return len(resellers)
+
+
+def reconcile_balances(fix=False):
+    """
+    مقارنة points_balance بمجموع حركات الـ ledger لكل موزع
+
+    fix=True: تصحيح الرصيد المخزن ليطابق الـ ledger (الـ ledger هو المرجع)
+    يعيد قائمة الفروقات
+    """
+    ensure_opening_balances()
+
+    ledger_totals = select(
+        PointsLedger.reseller_id,
+        func.sum(PointsLedger.delta).label('ledger_balance')
+    ).group_by(PointsLedger.reseller_id).subquery()
+
+    rows = db.session.execute(
+        select(Reseller.id, Reseller.points_balance, ledger_totals.c.ledger_balance).join(
+            ledger_totals, ledger_totals.c.reseller_id == Reseller.id
+        ).where(Reseller.points_balance != ledger_totals.c.ledger_balance)
+    ).all()
+
+    mismatches = [{
+        'reseller_id': reseller_id,
+        'cached_balance': cached,
+        'ledger_balance': int(ledger_balance)
+    } for reseller_id, cached, ledger_balance in rows]
+
+    for mismatch in mismatches:
+        print(f"⚠️ رصيد غير مطابق للموزع {mismatch['reseller_id']}: "
+              f"{mismatch['cached_balance']} (المخزن) ≠ {mismatch['ledger_balance']} (الـ ledger)")
+
+    if fix and mismatches:
+        for mismatch in mismatches:
+            db.session.execute(
+                update(Reseller).where(Reseller.id == mismatch['reseller_id']).values(
+                    points_balance=mismatch['ledger_balance']
+                ).execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+        print(f"✅ تم تصحيح {len(mismatches)} رصيد")
+
+    return mismatches
+
+
+background_tasks.register_periodic('points_reconcile', 24 * 3600, reconcile_balances)
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'reconcile'
+
+    with app.app_context():
+        db.create_all()
+        if command == 'reconcile':
+            mismatches = reconcile_balances(fix='--fix' in sys.argv)
+            print(f"✅ المطابقة انتهت: {len(mismatches)} فرق")
+        else:
+            print("الاستخدام: python points_helper.py reconcile [--fix]")
@@ -0,0 +1,147 @@
+"""
+التجميع اليومي لتفعيلات الموزعين (reseller_daily_stats)
+
+المشكلة:
+- كل فترة في صفحة التحليلات كانت تعمل count() منفصل لكل يوم / أسبوع / شهر / سنة
+  على جدول activation_codes (4 إلى 7 queries لكل طلب)
+
+الحل:
+- صف واحد لكل (موزع، يوم): عدد التفعيلات، مدى الحياة مقابل السنوي، النقاط المصروفة
+- activate_code_api والتفعيل الجماعي يزيدون الصف في نفس الـ transaction (UPSERT)
+- كل فترات التحليلات تقرأ نطاق أيام واحد (range scan على reseller_id, day)
+- أمر backfill لإعادة البناء من activation_codes
+- نسخة بيانات لكل موزع (تزيد مع التفعيل والإيقاف والشحن) لـ ETag وكاش ردود التحليلات
+"""
+
+from datetime import datetime, date
+from sqlalchemy import select, func, case
+from models import db, ActivationCode, ResellerDailyStats
+from performance_helper import upsert_increment, DataVersions
+from subscription_helper import SUBSCRIPTION_PLANS
+
+_COUNTER_COLUMNS = ['activations', 'lifetime_activations', 'yearly_activations', 'points_spent']
+
+# نسخة بيانات كل موزع: أي رد محسوب من نسخة أقدم لم يعد صالحاً
+reseller_data_versions = DataVersions()
+
+
+def get_data_version(reseller_id):
+    return reseller_data_versions.get(reseller_id)
+
+
+def bump_data_version(reseller_id):
+    """تستدعى بعد commit أي تغيير على اشتراكات أو رصيد الموزع"""
+    reseller_data_versions.bump(reseller_id)
+
+
+def record_activations(reseller_id, plans, day=None):
+    """
+    زيادة عدادات اليوم لمجموعة تفعيلات (داخل transaction الطلب، بدون commit)
+
+    plans: قائمة أنواع الاشتراك المفعلة ('1year' / 'lifetime')
+    """
+    if not plans:
+        return
+    lifetime = sum(1 for plan in plans if SUBSCRIPTION_PLANS[plan]['is_lifetime'])
+    upsert_increment(
+        db.session.connection(),
+        ResellerDailyStats.__table__,
+        [{
+            'reseller_id': reseller_id,
+            'day': day or datetime.utcnow().date(),
+            'activations': len(plans),
+            'lifetime_activations': lifetime,
+            'yearly_activations': len(plans) - lifetime,
+            'points_spent': sum(SUBSCRIPTION_PLANS[plan]['points'] for plan in plans)
+        }],
+        key_columns=['reseller_id', 'day'],
+        increment_columns=_COUNTER_COLUMNS
+    )
+
+
+def get_daily_counts(reseller_id, start_day, end_day):
+    """
+    عدد التفعيلات لكل يوم في [start_day, end_day) - Query واحد
+
+    يعيد dict: day -> activations (الأيام بدون تفعيلات غير موجودة)
+    """
+    rows = db.session.execute(
+        select(ResellerDailyStats.day, ResellerDailyStats.activations).where(
+            ResellerDailyStats.reseller_id == reseller_id,
+            ResellerDailyStats.day >= start_day,
+            ResellerDailyStats.day < end_day
+        )
+    )
+    return {row.day: row.activations for row in rows}
+
+
+def sum_range(daily_counts, start_day, end_day):
+    """مجموع التفعيلات من نتيجة get_daily_counts في [start_day, end_day)"""
+    return sum(count for day, count in daily_counts.items() if start_day <= day < end_day)
+
+
+def backfill_daily_stats(reseller_id=None):
+    """
+    إعادة بناء reseller_daily_stats من activation_codes (لموزع واحد أو للجميع)
+
+    التفعيلات التي تحدث أثناء التشغيل قد تحسب مرتين، لذلك يفضل تشغيله في وقت هادئ
+    """
+    lifetime_points = SUBSCRIPTION_PLANS['lifetime']['points']
+    yearly_points = SUBSCRIPTION_PLANS['1year']['points']
+    day_column = func.date(ActivationCode.created_at)
+
+    query = select(
+        ActivationCode.reseller_id,
+        day_column.label('day'),
+        func.count(ActivationCode.id),
+        func.sum(case((ActivationCode.is_lifetime == True, 1), else_=0)),
+        func.sum(case((ActivationCode.is_lifetime == True, lifetime_points), else_=yearly_points))
+    ).where(ActivationCode.created_at.isnot(None)).group_by(ActivationCode.reseller_id, day_column)
+
+    delete = ResellerDailyStats.__table__.delete()
+    if reseller_id is not None:
+        query = query.where(ActivationCode.reseller_id == reseller_id)
+        delete = delete.where(ResellerDailyStats.reseller_id == reseller_id)
+
+    rows = []
+    for row_reseller_id, day, activations, lifetime, points in db.session.execute(query):
+        if isinstance(day, str):  # SQLite يعيد date() كنص
+            day = date.fromisoformat(day)
+        rows.append({
+            'reseller_id': row_reseller_id,
+            'day': day,
+            'activations': activations,
+            'lifetime_activations': int(lifetime or 0),
+            'yearly_activations': activations - int(lifetime or 0),
+            'points_spent': int(points or 0)
+        })
+
+    db.session.execute(delete)
+    if rows:
+        db.session.execute(ResellerDailyStats.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def ensure_daily_stats():
+    """بناء التجميع مرة واحدة إذا كان الجدول فارغاً وفيه تفعيلات سابقة (أول تشغيل بعد إضافته)"""
+    has_stats = db.session.execute(select(ResellerDailyStats.id).limit(1)).first()
+    has_codes = db.session.execute(select(ActivationCode.id).limit(1)).first()
+    if has_stats or not has_codes:
+        return 0
+    built = backfill_daily_stats()
+    print(f"📊 تم بناء التجميع اليومي للموزعين: {built} صف")
+    return built
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    with app.app_context():
+        db.create_all()
+        target = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+            print(f"✅ تم بناء {backfill_daily_stats(target)} صف يومي")
+        else:
+            print("الاستخدام: python reseller_stats_helper.py backfill [reseller_id]")
@@ -0,0 +1,331 @@
+"""
+تجميع الإيرادات (revenue_rollup) للتحليلات المالية للمسؤول
+
+المشكلة:
+- analytics_revenue كان يجمع reseller_topups بـ func.strftime (SQLite فقط، لا يعمل على PostgreSQL)
+  ويقرأ كل شحنات الفترة مع كل طلب
+- صفحة Financials كانت بيانات ثابتة
+
+الحل:
+- صف لكل (الدقة hour / day / month، بداية الفترة، موزع): المبلغ بالسنت، النقاط، عدد الشحنات
+- reseller_topup يزيد الصفوف الثلاثة في نفس الـ transaction (UPSERT)
+- بداية الفترة تحسب في Python عند الكتابة، لذلك القراءة range scan عادي
+  بدون أي دالة تاريخ خاصة بنوع قاعدة البيانات
+- مطابقة النقاط المباعة (هذا التجميع) مع المصروفة (reseller_daily_stats) والرصيد الحالي
+- أمر backfill لإعادة البناء من reseller_topups
+
+ملاحظة: الفترات بتوقيت UTC (نفس created_at)
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from models import db, RevenueRollup, ResellerTopUp, ResellerDailyStats, Reseller
+from performance_helper import upsert_increment
+
+GRAINS = ('hour', 'day', 'month')
+
+# فترات الرسوم البيانية: period -> (الدقة، تنسيق العنوان)
+REVENUE_PERIODS = {
+    'day': ('hour', '%H'),
+    'week': ('day', '%a'),
+    'month': ('day', '%d'),
+    'year': ('month', '%b')
+}
+
+_COUNTER_COLUMNS = ['amount_cents', 'points', 'topups']
+_BACKFILL_BATCH_SIZE = 5000
+
+
+def truncate(dt, grain):
+    """بداية الفترة التي يقع فيها الوقت"""
+    if grain == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    if grain == 'day':
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if grain == 'month':
+        return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f'Invalid grain: {grain}')
+
+
+def next_bucket(dt, grain):
+    """بداية الفترة التالية"""
+    if grain == 'hour':
+        return dt + timedelta(hours=1)
+    if grain == 'day':
+        return dt + timedelta(days=1)
+    return dt.replace(year=dt.year + 1, month=1) if dt.month == 12 else dt.replace(month=dt.month + 1)
+
+
+def _cents(amount):
+    return int(round((amount or 0) * 100))
+
+
+def _rows_for(reseller_id, amount_cents, points, topups, created_at):
+    return [{
+        'grain': grain,
+        'bucket_start': truncate(created_at, grain),
+        'reseller_id': reseller_id,
+        'amount_cents': amount_cents,
+        'points': points,
+        'topups': topups
+    } for grain in GRAINS]
+
+
+def _upsert(connection, rows):
+    return upsert_increment(
+        connection,
+        RevenueRollup.__table__,
+        rows,
+        key_columns=['grain', 'bucket_start', 'reseller_id'],
+        increment_columns=_COUNTER_COLUMNS
+    )
+
+
+def record_topup(reseller_id, amount_usd, points, created_at=None):
+    """زيادة فترات الساعة واليوم والشهر لشحنة واحدة (داخل transaction الطلب، بدون commit)"""
+    _upsert(db.session.connection(), _rows_for(
+        reseller_id, _cents(amount_usd), points, 1, created_at or datetime.utcnow()
+    ))
+
+
+# ============================================================================
+# القراءة
+# ============================================================================
+
+def _period_start(period, now):
+    today = truncate(now, 'day')
+    if period == 'day':
+        return today
+    if period == 'week':
+        return today - timedelta(days=today.weekday())
+    if period == 'year':
+        return today.replace(month=1, day=1)
+    return today.replace(day=1)
+
+
+def _period_end(period, start):
+    if period == 'day':
+        return start + timedelta(days=1)
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'year':
+        return start.replace(year=start.year + 1)
+    return next_bucket(start, 'month')
+
+
+def _sum_buckets(grain, start, end, reseller_id=None):
+    """المجموع لكل فترة في [start, end) - dict: bucket_start -> (amount_cents, points, topups)"""
+    query = select(
+        RevenueRollup.bucket_start,
+        func.sum(RevenueRollup.amount_cents),
+        func.sum(RevenueRollup.points),
+        func.sum(RevenueRollup.topups)
+    ).where(
+        RevenueRollup.grain == grain,
+        RevenueRollup.bucket_start >= start,
+        RevenueRollup.bucket_start < end
+    ).group_by(RevenueRollup.bucket_start)
+    if reseller_id is not None:
+        query = query.where(RevenueRollup.reseller_id == reseller_id)
+
+    return {
+        bucket: (int(amount or 0), int(points or 0), int(topups or 0))
+        for bucket, amount, points, topups in db.session.execute(query)
+    }
+
+
+def revenue_series(period='month', now=None, reseller_id=None):
+    """
+    الإيرادات لكل فترة جزئية من الفترة الحالية (كل الفترات الجزئية حتى الفارغة) - Query واحد
+
+    period: day (بالساعة)، week / month (باليوم)، year (بالشهر)
+    """
+    if period not in REVENUE_PERIODS:
+        raise ValueError(f'Invalid period: {period}')
+    grain, label_format = REVENUE_PERIODS[period]
+    start = _period_start(period, now or datetime.utcnow())
+    end = _period_end(period, start)
+    sums = _sum_buckets(grain, start, end, reseller_id)
+
+    labels, amounts, points, topups = [], [], [], []
+    bucket = start
+    while bucket < end:
+        amount_cents, bucket_points, bucket_topups = sums.get(bucket, (0, 0, 0))
+        labels.append(bucket.strftime(label_format))
+        amounts.append(amount_cents / 100.0)
+        points.append(bucket_points)
+        topups.append(bucket_topups)
+        bucket = next_bucket(bucket, grain)
+
+    return {
+        'period': period,
+        'labels': labels,
+        'amounts': amounts,
+        'points': points,
+        'topups': topups,
+        'total_amount': round(sum(amounts), 2),
+        'total_points': sum(points)
+    }
+
+
+def revenue_totals(start=None, end=None):
+    """المبلغ والنقاط وعدد الشحنات من فترات الشهر (start / end بداية شهر أو None)"""
+    query = select(
+        func.coalesce(func.sum(RevenueRollup.amount_cents), 0),
+        func.coalesce(func.sum(RevenueRollup.points), 0),
+        func.coalesce(func.sum(RevenueRollup.topups), 0)
+    ).where(RevenueRollup.grain == 'month')
+    if start is not None:
+        query = query.where(RevenueRollup.bucket_start >= start)
+    if end is not None:
+        query = query.where(RevenueRollup.bucket_start < end)
+
+    amount_cents, points, topups = db.session.execute(query).one()
+    return {
+        'amount': int(amount_cents) / 100.0,
+        'points': int(points),
+        'topups': int(topups)
+    }
+
+
+def top_resellers(start=None, limit=5):
+    """أعلى الموزعين حسب المبلغ (من فترات الشهر منذ start)"""
+    amount = func.sum(RevenueRollup.amount_cents).label('amount_cents')
+    query = select(
+        Reseller.id, Reseller.name, amount, func.sum(RevenueRollup.points)
+    ).join(
+        Reseller, Reseller.id == RevenueRollup.reseller_id
+    ).where(RevenueRollup.grain == 'month')
+    if start is not None:
+        query = query.where(RevenueRollup.bucket_start >= start)
+    query = query.group_by(Reseller.id, Reseller.name).order_by(amount.desc()).limit(limit)
+
+    return [{
+        'reseller_id': reseller_id,
+        'name': name,
+        'amount': int(amount_cents or 0) / 100.0,
+        'points': int(points or 0)
+    } for reseller_id, name, amount_cents, points in db.session.execute(query)]
+
+
+def financial_summary(now=None):
+    """بيانات صفحة Financials (كلها من التجميع)"""
+    now = now or datetime.utcnow()
+    month_start = truncate(now, 'month')
+    year_start = month_start.replace(month=1)
+
+    return {
+        'all_time': revenue_totals(),
+        'this_month': revenue_totals(month_start),
+        'this_year': revenue_totals(year_start),
+        'top_resellers': top_resellers(year_start),
+        'monthly': revenue_series('year', now)
+    }
+
+
+def points_reconciliation(limit=None):
+    """
+    النقاط المباعة (الشحنات) مقابل المصروفة (التفعيلات) مقابل الرصيد الحالي لكل موزع
+
+    difference = الرصيد - (المباع - المصروف): غير صفر يعني رصيد افتتاحي قديم أو تعديل يدوي
+    أو خصم لم يمر على التجميع (المرجع الكامل هو points_ledger)
+    """
+    sold = select(
+        RevenueRollup.reseller_id,
+        func.sum(RevenueRollup.points).label('points')
+    ).where(RevenueRollup.grain == 'month').group_by(RevenueRollup.reseller_id).subquery()
+    consumed = select(
+        ResellerDailyStats.reseller_id,
+        func.sum(ResellerDailyStats.points_spent).label('points')
+    ).group_by(ResellerDailyStats.reseller_id).subquery()
+
+    query = select(
+        Reseller.id, Reseller.name, Reseller.points_balance,
+        func.coalesce(sold.c.points, 0), func.coalesce(consumed.c.points, 0)
+    ).outerjoin(sold, sold.c.reseller_id == Reseller.id).outerjoin(
+        consumed, consumed.c.reseller_id == Reseller.id
+    ).order_by(Reseller.id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    rows = []
+    for reseller_id, name, balance, points_sold, points_consumed in db.session.execute(query):
+        points_sold, points_consumed, balance = int(points_sold), int(points_consumed), balance or 0
+        rows.append({
+            'reseller_id': reseller_id,
+            'name': name,
+            'points_sold': points_sold,
+            'points_consumed': points_consumed,
+            'balance': balance,
+            'difference': balance - (points_sold - points_consumed)
+        })
+
+    totals = {
+        key: sum(row[key] for row in rows)
+        for key in ('points_sold', 'points_consumed', 'balance', 'difference')
+    }
+    return rows, totals
+
+
+# ============================================================================
+# إعادة البناء
+# ============================================================================
+
+def backfill_revenue_rollup():
+    """
+    إعادة بناء revenue_rollup من reseller_topups (قراءة بدفعات والتجميع في Python)
+
+    الشحنات التي تحدث أثناء التشغيل قد تحسب مرتين، لذلك يفضل تشغيله في وقت هادئ
+    """
+    totals = {}
+    result = db.session.execute(
+        select(
+            ResellerTopUp.reseller_id, ResellerTopUp.amount_usd,
+            ResellerTopUp.points, ResellerTopUp.created_at
+        ).where(ResellerTopUp.created_at.isnot(None)).execution_options(yield_per=_BACKFILL_BATCH_SIZE)
+    )
+    for reseller_id, amount_usd, points, created_at in result:
+        for row in _rows_for(reseller_id, _cents(amount_usd), points or 0, 1, created_at):
+            key = (row['grain'], row['bucket_start'], row['reseller_id'])
+            current = totals.setdefault(key, [0, 0, 0])
+            current[0] += row['amount_cents']
+            current[1] += row['points']
+            current[2] += row['topups']
+
+    rows = [{
+        'grain': grain,
+        'bucket_start': bucket_start,
+        'reseller_id': reseller_id,
+        'amount_cents': amount_cents,
+        'points': points,
+        'topups': topups
+    } for (grain, bucket_start, reseller_id), (amount_cents, points, topups) in totals.items()]
+
+    db.session.execute(RevenueRollup.__table__.delete())
+    if rows:
+        db.session.execute(RevenueRollup.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def ensure_revenue_rollup():
+    """بناء التجميع مرة واحدة إذا كان الجدول فارغاً وفيه شحنات سابقة (أول تشغيل بعد إضافته)"""
+    has_rollup = db.session.execute(select(RevenueRollup.id).limit(1)).first()
+    has_topups = db.session.execute(select(ResellerTopUp.id).limit(1)).first()
+    if has_rollup or not has_topups:
+        return 0
+    built = backfill_revenue_rollup()
+    print(f"📊 تم بناء تجميع الإيرادات: {built} صف")
+    return built
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    with app.app_context():
+        db.create_all()
+        if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+            print(f"✅ تم بناء {backfill_revenue_rollup()} صف")
+        else:
+            print("الاستخدام: python revenue_helper.py backfill")
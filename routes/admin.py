@@ -1,22 +1,29 @@
 """
 المسارات الخاصة بالمسؤولين
 """
-from flask import Blueprint, render_template, jsonify , make_response
+from flask import Blueprint, render_template, jsonify , make_response, Response, stream_with_context
 from flask import render_template, request, redirect, url_for, flash, session
-from werkzeug.security import check_password_hash, generate_password_hash
-from models import Admin, Reseller, ResellerTopUp, AuditLog, SupportTicket, TicketMessage, db
+from hashing_helper import verify_password, hash_password, HashingBusyError
+from models import Admin, Reseller, ResellerTopUp, AuditLog, SupportTicket, TicketMessage, User, db
 from functools import wraps
 import random
 import string
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from audit_helper import log_admin_action, log_reseller_action
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from io import BytesIO
-from xhtml2pdf import pisa
+import audit_store
+import export_jobs
+import system_counters
+import revenue_helper
+import invoice_helper
+import security_stats
+from points_helper import credit_points
+from reseller_stats_helper import bump_data_version
+from config import AUDIT_PAGE_SIZE, AUDIT_PAGE_MAX_SIZE, API_PAGE_SIZE, API_PAGE_MAX_SIZE, INVOICE_RETRY_AFTER, INVOICE_ZIP_MAX_DAYS
+from export_helper import content_disposition
+from performance_helper import KeysetPaginator, query_reseller_directory, serialize_reseller_directory_row
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
 
 #======================================================
 #======================================================
@@ -24,6 +31,43 @@ from xhtml2pdf import pisa
 
 admin_bp = Blueprint('admin', __name__)
 
+# قوائم لوحة المسؤول بنظام keyset (الترتيب والفلاتر المسموحة فقط)
+def reseller_directory_page(args):
+    """
+    صفحة من قائمة الموزعين مع المقاييس (بحث q في الاسم/البريد/الدولة، ترتيب بأي مقياس)
+    
+    حقول الترتيب تبنى مع الـ Query (تعتمد على subquery التفعيلات)، لذلك paginator لكل طلب
+    """
+    query, sort_fields = query_reseller_directory(args.get('q'))
+    paginator = KeysetPaginator(
+        Reseller.id,
+        sort_fields=sort_fields,
+        filter_fields={'is_active': Reseller.is_active, 'country': Reseller.country},
+        default_sort='-created_at',
+        default_limit=API_PAGE_SIZE,
+        max_limit=API_PAGE_MAX_SIZE
+    )
+    return paginator.paginate(query, args)
+
+tickets_paginator = KeysetPaginator(
+    SupportTicket.id,
+    sort_fields={'created_at': SupportTicket.created_at, 'updated_at': SupportTicket.updated_at},
+    filter_fields={'status': SupportTicket.status, 'priority': SupportTicket.priority},
+    default_sort='-created_at',
+    default_limit=API_PAGE_SIZE,
+    max_limit=API_PAGE_MAX_SIZE
+)
+
+
+def page_links(endpoint, page):
+    """روابط الصفحة الأولى والتالية (تحافظ على الترتيب والفلاتر)"""
+    args = {key: value for key, value in request.args.items() if key != 'cursor'}
+    return {
+        'first_url': url_for(endpoint, **args) if request.args.get('cursor') else None,
+        'next_url': url_for(endpoint, cursor=page['next_cursor'], **args) if page['next_cursor'] else None
+    }
+
+
 def admin_login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -45,7 +89,13 @@ def login():
 
         admin = Admin.query.filter_by(email=email).first()
 
-        if not admin or not check_password_hash(admin.password_hash, password):
+        try:
+            password_ok = admin is not None and verify_password(admin.password_hash, password)
+        except HashingBusyError:
+            flash('Server is busy, please try again in a moment', 'danger')
+            return redirect(url_for('admin.login'))
+
+        if not password_ok:
             flash('Invalid email or password', 'danger')
             return redirect(url_for('admin.login'))
 
@@ -84,31 +134,15 @@ def logout():
 @admin_bp.route('/dashboard')
 @admin_login_required
 def dashboard():
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
-    from models import User, Device
-    
-    # عدد الموزعين
-    total_resellers = Reseller.query.count()
-    
-    # عدد المستخدمين الكلي
-    total_users = User.query.count()
-    
-    # عدد الأجهزة النشطة
-    active_devices = Device.query.filter_by(is_active=True, is_deleted=False).count()
-    
-    # المبلغ الإجمالي المباع خلال الشهر الحالي
-    current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    monthly_revenue = db.session.query(func.sum(ResellerTopUp.amount_usd)).filter(
-        ResellerTopUp.created_at >= current_month_start
-    ).scalar() or 0
+    # العدادات من system_counters (Query واحد بدل count() على كل جدول)
+    counters = system_counters.get_counters()
     
     return render_template(
         'admin/dashboard.html',
-        total_users=total_users,
-        total_resellers=total_resellers,
-        active_devices=active_devices,
-        monthly_revenue=round(monthly_revenue, 2)
+        total_users=counters['total_users'],
+        total_resellers=counters['total_resellers'],
+        active_devices=counters['active_devices'],
+        monthly_revenue=counters['monthly_revenue']
     )
 
 
@@ -117,95 +151,60 @@ def dashboard():
 @admin_login_required
 def analytics_revenue():
     """
-    احصائيات الإيرادات حسب الفترة الزمنية
+    احصائيات الإيرادات حسب الفترة الزمنية (من revenue_rollup - Query واحد بدون دوال تاريخ خاصة بـ SQLite)
+    
+    period: day (بالساعة)، week / month (باليوم)، year (بالشهر)
     """
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
-    
-    period = request.args.get('period', 'month')  # day, week, month, year
-    
-    now = datetime.now()
-    
-    # تحديد نقطة البداية حسب الفترة
-    if period == 'day':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        group_format = '%H:00'  # بالساعة
-        label_format = '%H:%M'
-    elif period == 'week':
-        start_date = now - timedelta(days=now.weekday())
-        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        group_format = '%Y-%m-%d'
-        label_format = '%a'  # اسم اليوم
-    elif period == 'year':
-        start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        group_format = '%Y-%m'
-        label_format = '%b'  # اسم الشهر
-    else:  # month
-        start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        group_format = '%Y-%m-%d'
-        label_format = '%d'
-    
-    # استعلام البيانات من قاعدة البيانات
-    revenue_data = db.session.query(
-        func.strftime(group_format, ResellerTopUp.created_at).label('date'),
-        func.sum(ResellerTopUp.amount_usd).label('amount'),
-        func.sum(ResellerTopUp.points).label('points')
-    ).filter(
-        ResellerTopUp.created_at >= start_date
-    ).group_by(
-        func.strftime(group_format, ResellerTopUp.created_at)
-    ).order_by('date').all()
-    
-    # معالجة النتائج
-    labels = []
-    amounts = []
-    points = []
-    
-    for row in revenue_data:
-        # تحويل التاريخ إلى التنسيق المطلوب للعرض
-        try:
-            if period == 'day':
-                # تحويل من "HH:00" إلى "HH" (مثل 00, 01, 02, ... 23)
-                hour = row.date.split(':')[0] if ':' in row.date else row.date
-                labels.append(hour)
-            elif period == 'week':
-                # تحويل التاريخ إلى اسم اليوم (مثل Mon, Tue, إلخ)
-                from datetime import datetime
-                date_obj = datetime.strptime(row.date, '%Y-%m-%d')
-                labels.append(date_obj.strftime('%a'))
-            elif period == 'month':
-                # تحويل التاريخ إلى اليوم (1, 2, 3, ...)
-                from datetime import datetime
-                date_obj = datetime.strptime(row.date, '%Y-%m-%d')
-                labels.append(date_obj.strftime('%d'))
-            elif period == 'year':
-                # تحويل التاريخ إلى اسم الشهر (Jan, Feb, إلخ)
-                from datetime import datetime
-                date_obj = datetime.strptime(row.date, '%Y-%m')
-                labels.append(date_obj.strftime('%b'))
-        except:
-            labels.append(row.date)
-        
-        amounts.append(float(row.amount) if row.amount else 0)
-        points.append(int(row.points) if row.points else 0)
+    period = request.args.get('period', 'month')
+    if period not in revenue_helper.REVENUE_PERIODS:
+        period = 'month'
     
-    return jsonify({
-        'success': True,
-        'period': period,
-        'labels': labels,
-        'amounts': amounts,
-        'points': points,
-        'total_amount': sum(amounts),
-        'total_points': sum(points)
-    })
+    data = revenue_helper.revenue_series(period, reseller_id=request.args.get('reseller_id', type=int))
+    return jsonify(dict(data, success=True))
 
 
 @admin_bp.route('/resellers')
 @admin_login_required
 def resellers():
-    # جلب كل الموزعين من قاعدة البيانات
-    all_resellers = Reseller.query.all()
-    return render_template('admin/resellers.html', resellers=all_resellers)
+    # صفحة واحدة من الموزعين (keyset) مع المقاييس في Query واحد
+    try:
+        page = reseller_directory_page(request.args)
+    except ValueError:
+        return redirect(url_for('admin.resellers'))
+    
+    return render_template(
+        'admin/resellers.html',
+        resellers=page['items'],
+        search=request.args.get('q', ''),
+        **page_links('admin.resellers', page)
+    )
+
+
+@admin_bp.route('/api/resellers', methods=['GET'])
+@admin_login_required
+def api_resellers():
+    """
+    قائمة الموزعين مع المقاييس (keyset)
+    
+    q: بحث في الاسم/البريد/الدولة
+    sort: user_count, active_devices, activations_30d, last_topup_at, points_balance,
+          total_amount_charged, created_at, name (مع - للتنازلي)
+    is_active / country: فلاتر، cursor / limit: الصفحات
+    """
+    try:
+        page = reseller_directory_page(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'resellers': [serialize_reseller_directory_row(row) for row in page['items']],
+        'next_cursor': page['next_cursor'],
+        'has_more': page['next_cursor'] is not None,
+        'limit': page['limit'],
+        'sort': page['sort'],
+        'filters': page['filters']
+    })
 
 
 
@@ -280,7 +279,7 @@ def create_reseller():
         new_reseller = Reseller(
             name=str(data['name']).strip(),
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=hash_password(password),
             country=str(data['country']).strip(),
             points_balance=0,
             is_active=True,
@@ -310,6 +309,12 @@ def create_reseller():
             }
         }), 201
         
+    except HashingBusyError:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': 'Server is busy, please try again in a moment'
+        }), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -387,21 +392,31 @@ def reseller_topup(reseller_id):
             reseller_id=reseller.id,
             points=points,
             amount_usd=amount_usd,
-            invoice_number=invoice_number
+            invoice_number=invoice_number,
+            created_at=datetime.utcnow()
+        )
+        # مسار الفاتورة يحفظ مع الشحن (الملف يولد في الخلفية)
+        topup.invoice_path = invoice_helper.invoice_relative_path(topup)
+        db.session.add(topup)
+        db.session.flush()
+        
+        # تحديث رصيد الموزع والمبلغ والنقاط الإجمالية (UPDATE ذري + قيد في points_ledger)
+        credit_points(
+            reseller.id, points, 'topup',
+            reference_type='topup',
+            reference_id=topup.id,
+            description=f'Top-up {invoice_number}',
+            amount_usd=amount_usd
         )
         
-        # تحديث رصيد الموزع
-        reseller.points_balance += points
-        
-        # تحديث المبلغ الإجمالي والنقاط الإجمالية
-        reseller.total_amount_charged += amount_usd
-        reseller.total_points_charged += points
+        # تجميع الإيرادات (ساعة / يوم / شهر) في نفس الـ transaction
+        revenue_helper.record_topup(reseller.id, amount_usd, points, topup.created_at)
 
-        db.session.add(topup)
         db.session.commit()
+        bump_data_version(reseller.id)
 
-        # توليد وحفظ الفاتورة
-        save_invoice_pdf(topup, reseller)
+        # توليد الفاتورة في الـ Process Pool (بدون انتظار)
+        invoice_helper.enqueue_invoice(topup, reseller)
         
         # تسجيل العملية
         log_admin_action(
@@ -417,61 +432,6 @@ def reseller_topup(reseller_id):
     return render_template('admin/components/reseller_topup.html', reseller=reseller)
 
 
-def save_invoice_pdf(topup, reseller):
-    """حفظ الفاتورة كملف PDF باستخدام تصميم احترافي"""
-    try:
-        # المسار: static/invoices/YYYY/MM/DD/
-        year = topup.created_at.strftime('%Y')
-        month = topup.created_at.strftime('%m')
-        day = topup.created_at.strftime('%d')
-        
-        invoices_dir = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)),
-            'static', 'invoices', year, month, day
-        )
-        
-        # إنشاء الفولدرات إن لم تكن موجودة
-        if not os.path.exists(invoices_dir):
-            os.makedirs(invoices_dir)
-        
-        # تحضير بيانات الفاتورة
-        invoice_html = render_template('admin/components/invoice.html',
-            invoice_number=topup.invoice_number,
-            reseller_name=reseller.name,
-            reseller_email=reseller.email,
-            invoice_date=topup.created_at.strftime('%B %d, %Y'),
-            points=topup.points,
-            amount_usd=f'{topup.amount_usd:.2f}'
-        )
-        
-        # حفظ الملف
-        file_path = os.path.join(invoices_dir, f'{topup.invoice_number}.pdf')
-        result_file = open(file_path, 'w+b')
-        pisa.CreatePDF(invoice_html, result_file)
-        result_file.close()
-        
-        # حفظ مسار الفاتورة في قاعدة البيانات بصيغة ويب
-        relative_path = f'invoices/{year}/{month}/{day}/{topup.invoice_number}.pdf'
-        topup.invoice_path = relative_path
-        db.session.commit()
-        
-        print(f'✅ Invoice generated: {topup.invoice_number}')
-        return True
-    except Exception as e:
-        print(f'❌ Invoice generation error: {str(e)}')
-        # محاولة حفظ المسار حتى لو فشل توليد PDF
-        try:
-            year = topup.created_at.strftime('%Y')
-            month = topup.created_at.strftime('%m')
-            day = topup.created_at.strftime('%d')
-            relative_path = f'invoices/{year}/{month}/{day}/{topup.invoice_number}.pdf'
-            topup.invoice_path = relative_path
-            db.session.commit()
-        except:
-            pass
-        return False
-
-
 @admin_bp.route('/invoice/<int:topup_id>')
 @admin_bp.route('/invoice/<int:topup_id>/<action>')
 @admin_login_required
@@ -484,104 +444,89 @@ def generate_invoice(topup_id, action='download'):
             'error': 'Invoice not found'
         }), 404
     
-    # تسجيل العملية
+    status = invoice_helper.invoice_status(topup)
+    if status in ('pending', 'missing'):
+        # الفاتورة قيد التوليد (أو لم تطلب بعد): 202 والعميل يعيد الطلب بعد Retry-After
+        if status == 'missing' and not invoice_helper.enqueue_invoice(topup):
+            status = 'failed'
+        else:
+            response = jsonify({
+                'success': False,
+                'status': 'pending',
+                'message': 'Invoice is being generated, please retry shortly',
+                'retry_after': INVOICE_RETRY_AFTER
+            })
+            response.status_code = 202
+            response.headers['Retry-After'] = str(INVOICE_RETRY_AFTER)
+            return response
+    
+    # تسجيل العملية (عند إرسال الفاتورة فقط، وليس مع كل إعادة طلب)
     log_admin_action(
         action=action,
         description=f'Invoice {topup.invoice_number} was {action}ed',
         resource_type='invoice',
         resource_id=topup.id
     )
-    # استخدام المسار المحفوظ في قاعدة البيانات
-    if topup.invoice_path:
-        # تحويل المسار من forward slash إلى backslash لـ Windows
-        file_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)),
-            'static', topup.invoice_path.replace('/', os.sep)
-        )
-    else:
-        # للفاتورات القديمة التي لا تملك invoice_path
-        year = topup.created_at.strftime('%Y')
-        month = topup.created_at.strftime('%m')
-        day = topup.created_at.strftime('%d')
-        
-        invoices_dir = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)),
-            'static', 'invoices', year, month, day
-        )
-        file_path = os.path.join(invoices_dir, f'{topup.invoice_number}.pdf')
-    
-    # إذا كان الملف موجوداً، اقرأه مباشرة
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as f:
-            pdf_content = f.read()
-    else:
-        # وإلا قم بتوليده
-        reseller = topup.reseller
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        title = Paragraph(f"<b>Invoice</b>", styles['Heading1'])
-        elements.append(title)
-        elements.append(Spacer(1, 12))
-        
-        invoice_info = [
-            ['Invoice Number:', topup.invoice_number],
-            ['Date:', topup.created_at.strftime('%Y-%m-%d %H:%M')],
-            ['Reseller:', reseller.name],
-            ['Email:', reseller.email],
-        ]
-        
-        table = Table(invoice_info)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elements.append(table)
-        elements.append(Spacer(1, 20))
-        
-        details = [
-            ['Description', 'Quantity', 'Amount'],
-            ['Points Top Up', f'{topup.points} PTS', f'${topup.amount_usd:.2f}'],
-            ['', '', ''],
-            ['Total', '', f'${topup.amount_usd:.2f}']
-        ]
-        
-        detail_table = Table(details, colWidths=[300, 100, 100])
-        detail_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elements.append(detail_table)
-        doc.build(elements)
-        
-        buffer.seek(0)
-        pdf_content = buffer.getvalue()
-    
-    response = make_response(pdf_content)
-    response.headers['Content-Type'] = 'application/pdf'
-    
-    # تحديد نوع الـ disposition حسب الـ action
-    if action == 'view':
-        response.headers['Content-Disposition'] = f'inline; filename={topup.invoice_number}.pdf'
-    else:
-        response.headers['Content-Disposition'] = f'attachment; filename={topup.invoice_number}.pdf'
+    if status != 'ready':
+        # فشل التوليد: فاتورة مبسطة بـ reportlab تحفظ كملف (لا تولد مرة أخرى)
+        invoice_helper.ensure_fallback_invoice(topup)
+    
+    return invoice_helper.send_invoice(topup, as_attachment=(action != 'view'))
+
+
+def _invoice_archive_range(args):
+    """الفترة [start, end) من month=YYYY-MM أو start / end بصيغة YYYY-MM-DD (end ضمن الفترة)"""
+    try:
+        if args.get('month'):
+            start = datetime.strptime(args['month'], '%Y-%m')
+            end = revenue_helper.next_bucket(start, 'month')
+        else:
+            start = datetime.strptime(args['start'], '%Y-%m-%d')
+            end = datetime.strptime(args['end'], '%Y-%m-%d') + timedelta(days=1)
+    except (KeyError, ValueError):
+        raise ValueError('Provide month=YYYY-MM or start and end as YYYY-MM-DD')
+    
+    if end <= start:
+        raise ValueError('end must not be before start')
+    if (end - start).days > INVOICE_ZIP_MAX_DAYS:
+        raise ValueError(f'Date range is limited to {INVOICE_ZIP_MAX_DAYS} days')
+    return start, end
+
+
+@admin_bp.route('/api/invoices/archive', methods=['GET'])
+@admin_login_required
+def invoice_archive():
+    """
+    كل فواتير فترة في ملف ZIP يبنى أثناء الإرسال
     
+    month=YYYY-MM أو start / end (YYYY-MM-DD)، reseller_id اختياري،
+    summary=0 لإلغاء summary.csv
+    """
+    try:
+        start, end = _invoice_archive_range(request.args)
+        reseller_id = request.args.get('reseller_id', type=int)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    include_summary = request.args.get('summary', '1') not in ('0', 'false')
+    last_day = end - timedelta(days=1)
+    filename = f"invoices_{start.strftime('%Y%m%d')}_{last_day.strftime('%Y%m%d')}.zip"
+    
+    log_admin_action(
+        action='download',
+        description=f"Invoices archive {start.strftime('%Y-%m-%d')} to {last_day.strftime('%Y-%m-%d')} was downloaded",
+        resource_type='invoice',
+        resource_id=reseller_id
+    )
+    
+    response = Response(
+        stream_with_context(invoice_helper.iter_invoice_zip(start, end, reseller_id, include_summary)),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = content_disposition(filename)
+    response.headers['Cache-Control'] = 'no-store'
+    # عدم تجميع الرد في Nginx حتى يبدأ التحميل فوراً
+    response.headers['X-Accel-Buffering'] = 'no'
     return response
 
 
@@ -602,6 +547,7 @@ def get_last_invoice(reseller_id):
         'invoice_id': topup.id,
         'invoice_number': topup.invoice_number,
         'invoice_path': topup.invoice_path,
+        'status': invoice_helper.invoice_status(topup),
         'created_at': topup.created_at.strftime('%Y-%m-%d %H:%M')
     }), 200
 
@@ -640,26 +586,22 @@ def get_audit_logs():
 @admin_bp.route('/audit-logs')
 @admin_login_required
 def audit_logs():
-    """عرض صفحة السجلات الأمنية مع جميع البيانات"""
+    """عرض صفحة السجلات الأمنية (الصفحة الأولى فقط، الباقي عبر API البحث)"""
     try:
-        # جلب جميع سجلات التدقيق مع الترتيب من الأحدث
-        all_logs = AuditLog.query.order_by(AuditLog.created_at.desc()).all()
+        # أول نافذة من السجلات فقط (الأحدث)
+        first_logs, next_cursor = audit_store.search_logs(limit=AUDIT_PAGE_SIZE)
         
-        # إحصائيات
-        failed_logins = len([log for log in all_logs if log.action == 'FAILED_LOGIN'])
+        # إحصائيات من العدادات المجمعة بالساعة (security_counters)
+        failed_logins = security_stats.get_action_counts('FAILED_LOGIN')
         
-        # حساب أعلى الأماكن بناءً على عنوان IP
-        ip_locations = {}
-        for log in all_logs:
-            if log.ip_address:
-                ip_locations[log.ip_address] = ip_locations.get(log.ip_address, 0) + 1
-        
-        top_locations = sorted(ip_locations.items(), key=lambda x: x[1], reverse=True)[:3]
+        # أعلى الأماكن بناءً على عنوان IP خلال آخر 7 أيام
+        top_locations = security_stats.get_top('ip', window='7d', limit=3)
         top_locations_str = ', '.join([ip[0] for ip in top_locations]) if top_locations else 'Unknown'
         
         return render_template(
             'admin/Securitylogs.html',
-            audit_logs=all_logs,
+            audit_logs=first_logs,
+            next_cursor=next_cursor,
             failed_logins=failed_logins,
             top_locations=top_locations_str
         )
@@ -669,6 +611,145 @@ def audit_logs():
         return redirect(url_for('admin.dashboard'))
 
 
+def _parse_log_datetime(value):
+    """تحويل تاريخ ISO من query string أو None"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        # السجلات مخزنة بتوقيت UTC بدون tzinfo
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@admin_bp.route('/api/audit-logs/search', methods=['GET'])
+@admin_login_required
+def search_audit_logs():
+    """
+    البحث في السجلات الأمنية مع keyset pagination
+    
+    Query params: actor_type, actor_id, action, resource_type, resource_id, ip,
+                  from, to (ISO)، cursor، limit
+    """
+    try:
+        filters = {
+            'actor_type': request.args.get('actor_type') or None,
+            'actor_id': request.args.get('actor_id', type=int),
+            'action': request.args.get('action') or None,
+            'resource_type': request.args.get('resource_type') or None,
+            'resource_id': request.args.get('resource_id', type=int),
+            'ip_address': request.args.get('ip') or None
+        }
+        start = _parse_log_datetime(request.args.get('from'))
+        end = _parse_log_datetime(request.args.get('to'))
+        limit = min(max(request.args.get('limit', AUDIT_PAGE_SIZE, type=int), 1), AUDIT_PAGE_MAX_SIZE)
+        cursor = request.args.get('cursor') or None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid date format. Use ISO 8601'
+        }), 400
+    
+    try:
+        logs, next_cursor = audit_store.search_logs(
+            start=start, end=end, filters=filters, cursor=cursor, limit=limit
+        )
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid cursor'
+        }), 400
+    except Exception as e:
+        print(f"❌ خطأ في البحث في السجلات: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Error searching audit logs'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'logs': [log.to_dict() for log in logs],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }), 200
+
+
+@admin_bp.route('/api/audit-logs/export', methods=['POST'])
+@admin_login_required
+def export_audit_logs():
+    """
+    تصدير السجلات الأمنية في الخلفية (نفس فلاتر البحث)
+    
+    JSON: format (csv / ndjson)، actor_type, actor_id, action, resource_type, resource_id, ip، from, to (ISO)
+    يعيد 202 مع job_key
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        start = _parse_log_datetime(data.get('from'))
+        end = _parse_log_datetime(data.get('to'))
+        filters = {
+            'actor_type': data.get('actor_type') or None,
+            'actor_id': int(data['actor_id']) if data.get('actor_id') not in (None, '') else None,
+            'action': data.get('action') or None,
+            'resource_type': data.get('resource_type') or None,
+            'resource_id': int(data['resource_id']) if data.get('resource_id') not in (None, '') else None,
+            'ip_address': data.get('ip') or None
+        }
+    except (ValueError, TypeError):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid filters. Dates must be ISO 8601'
+        }), 400
+    
+    params = {
+        'from': start.isoformat() if start else None,
+        'to': end.isoformat() if end else None,
+        'filters': {key: value for key, value in filters.items() if value is not None}
+    }
+    
+    try:
+        job = export_jobs.enqueue('admin', session['admin_id'], 'audit_logs', data.get('format', 'csv'), params)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid format'}), 400
+    except export_jobs.ExportLimitError as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
+    
+    return jsonify({
+        'success': True,
+        'message': 'Export started',
+        'job': export_jobs.job_to_dict(job),
+        'status_url': url_for('admin.export_status', job_key=job.job_key),
+        'download_url': url_for('admin.download_export', job_key=job.job_key)
+    }), 202
+
+
+@admin_bp.route('/api/exports/<job_key>', methods=['GET'])
+@admin_login_required
+def export_status(job_key):
+    """حالة وتقدم مهمة التصدير (polling)"""
+    job = export_jobs.get_job('admin', session['admin_id'], job_key)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    return jsonify({'success': True, 'job': export_jobs.job_to_dict(job)}), 200
+
+
+@admin_bp.route('/api/exports/<job_key>/download', methods=['GET'])
+@admin_login_required
+def download_export(job_key):
+    """تحميل الملف الجاهز (يدعم Range لاستكمال التحميل)"""
+    job = export_jobs.get_job('admin', session['admin_id'], job_key)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    if job.status in export_jobs.ACTIVE_STATUSES:
+        return jsonify({'success': False, 'message': 'Export is not ready yet'}), 409
+    
+    path = export_jobs.artifact_path(job)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Export file is no longer available'}), 410
+    
+    return export_jobs.send_artifact(job, path)
+
+
 #======================================================
 #======================================================
 
@@ -691,7 +772,11 @@ def settings():
             if len(new_password) < 6:
                 flash('Password must be at least 6 characters long', 'danger')
                 return redirect(url_for('admin.settings'))
-            admin.password_hash = generate_password_hash(new_password.strip())
+            try:
+                admin.password_hash = hash_password(new_password.strip())
+            except HashingBusyError:
+                flash('Server is busy, please try again in a moment', 'danger')
+                return redirect(url_for('admin.settings'))
         
         db.session.commit()
         
@@ -730,7 +815,7 @@ def change_admin_password():
         new_password = data['new_password'].strip()
         
         # التحقق من كلمة المرور الحالية
-        if not check_password_hash(admin.password_hash, current_password):
+        if not verify_password(admin.password_hash, current_password):
             return jsonify({
                 'success': False,
                 'message': 'Current password is incorrect'
@@ -744,7 +829,7 @@ def change_admin_password():
             }), 400
         
         # تحديث كلمة المرور
-        admin.password_hash = generate_password_hash(new_password)
+        admin.password_hash = hash_password(new_password)
         db.session.commit()
         
         # تسجيل العملية
@@ -760,6 +845,12 @@ def change_admin_password():
             'message': 'Password changed successfully'
         }), 200
         
+    except HashingBusyError:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': 'Server is busy, please try again in a moment'
+        }), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -776,13 +867,19 @@ def change_admin_password():
 def support():
     """صفحة الدعم للمسؤول - تحميل جميع التذاكر والبيانات المرتبطة بها"""
     try:
-        # جلب جميع التذاكر مرتبة بحسب تاريخ الإنشاء
-        tickets = SupportTicket.query.order_by(SupportTicket.created_at.desc()).all()
+        # صفحة واحدة من التذاكر (keyset) مع الموزع والرسائل (بدون Query لكل تذكرة)
+        page = tickets_paginator.paginate(
+            SupportTicket.query.options(
+                joinedload(SupportTicket.reseller),
+                selectinload(SupportTicket.messages)
+            ),
+            request.args
+        )
         
         # تحضير بيانات التذاكر للعرض
         tickets_data = []
-        for ticket in tickets:
-            reseller = Reseller.query.get(ticket.reseller_id)
+        for ticket in page['items']:
+            reseller = ticket.reseller
             
             # جلب الرسائل المرتبطة بالتذكرة
             messages = []
@@ -814,7 +911,7 @@ def support():
                 'message_count': len(messages)
             })
         
-        return render_template('admin/support.html', tickets=tickets_data)
+        return render_template('admin/support.html', tickets=tickets_data, **page_links('admin.support', page))
     
     except Exception as e:
         print(f"Error in support route: {str(e)}")
@@ -932,7 +1029,29 @@ def add_admin_message(ticket_id):
 @admin_bp.route('/Financials')
 @admin_login_required
 def Financials():
-    return render_template('admin/financials.html')
+    # الملخص ومطابقة النقاط من revenue_rollup (بدون قراءة reseller_topups)
+    reconciliation, reconciliation_totals = revenue_helper.points_reconciliation()
+    return render_template(
+        'admin/financials.html',
+        summary=revenue_helper.financial_summary(),
+        reconciliation=reconciliation,
+        reconciliation_totals=reconciliation_totals
+    )
+
+
+@admin_bp.route('/api/financials/summary', methods=['GET'])
+@admin_login_required
+def financials_summary():
+    """ملخص الإيرادات: الكل، الشهر، السنة، أعلى الموزعين، والإيرادات الشهرية للسنة"""
+    return jsonify({'success': True, 'summary': revenue_helper.financial_summary()}), 200
+
+
+@admin_bp.route('/api/financials/points-reconciliation', methods=['GET'])
+@admin_login_required
+def financials_points_reconciliation():
+    """النقاط المباعة مقابل المصروفة مقابل الرصيد لكل موزع"""
+    rows, totals = revenue_helper.points_reconciliation()
+    return jsonify({'success': True, 'resellers': rows, 'totals': totals}), 200
 
 #===================================================
 #===================================================
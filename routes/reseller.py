@@ -2,17 +2,38 @@
 المسارات الخاصة بالموزعين
 """
 from flask import Blueprint, render_template, jsonify, request, session, redirect, url_for, flash
-from werkzeug.security import check_password_hash, generate_password_hash
-from datetime import datetime, timedelta, timezone
+from hashing_helper import verify_password, hash_password, HashingBusyError
+from datetime import datetime, date, timedelta, timezone
 from models import SupportTicket, db, Reseller, User, ActivationCode, Device, DeviceActivationCode
 import uuid
 import re
-from flask import send_file
-from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-from audit_helper import log_reseller_action, log_user_action
+from flask import send_file, Response, stream_with_context
+import tempfile
+from export_helper import (
+    EXPORT_FORMATS, CODE_EXPORT_HEADERS, CODE_EXPORT_KEYS,
+    iter_code_records, count_codes, iter_csv, iter_ndjson, write_codes_xlsx, content_disposition
+)
+from audit_helper import log_reseller_action, log_user_action, log_actions
+import export_jobs
+from config import (
+    BULK_ACTIVATION_MAX_CODES, DASHBOARD_STATS_TTL, ANALYTICS_HTTP_MAX_AGE, ANALYTICS_MEMO_TTL,
+    RESELLER_PAGE_SIZE, RESELLER_PAGE_MAX_SIZE, API_PAGE_SIZE, API_PAGE_MAX_SIZE
+)
+from performance_helper import (
+    TTLCache, KeysetPaginator, conditional_json_response, paginate_select, query_reseller_users, query_reseller_devices
+)
+from sqlalchemy import func, case, and_
+from activity_helper import get_device_last_seen
+from activation_code_helper import outstanding_codes
+from device_notify_helper import publish_activation
+from points_helper import debit_points, InsufficientPointsError
+import analytics_helper
+from reseller_stats_helper import (
+    record_activations, get_daily_counts, sum_range, get_data_version, bump_data_version
+)
+from subscription_helper import (
+    SUBSCRIPTION_PLANS, is_subscription_active, status_label, STATUS_ACTIVE, STATUS_EXPIRED, STATUS_SUSPENDED
+)
 
 reseller_bp = Blueprint('reseller', __name__)
 
@@ -42,31 +63,80 @@ def safe_datetime_compare(dt1, dt2):
 # 🟢 دوال مساعدة لحساب الإحصائيات
 # ============================================================================
 
+# كاش الإحصائيات لكل موزع (يحذف عند أي تفعيل أو تغيير حالة)
+dashboard_stats_cache = TTLCache(DASHBOARD_STATS_TTL)
+
+# ردود التحليلات المحسوبة (المفتاح يتضمن نسخة بيانات الموزع، فالقديم لا يقرأ أبداً)
+analytics_memo = TTLCache(ANALYTICS_MEMO_TTL)
+
+
+# قوائم الـ API بنظام keyset (الترتيب والفلاتر المسموحة فقط)
+codes_paginator = KeysetPaginator(
+    ActivationCode.id,
+    sort_fields={'created_at': ActivationCode.created_at},
+    filter_fields={'status': ActivationCode.status, 'is_lifetime': ActivationCode.is_lifetime},
+    default_sort='-created_at',
+    default_limit=API_PAGE_SIZE,
+    max_limit=API_PAGE_MAX_SIZE
+)
+
+tickets_paginator = KeysetPaginator(
+    SupportTicket.id,
+    sort_fields={'created_at': SupportTicket.created_at, 'updated_at': SupportTicket.updated_at},
+    filter_fields={'status': SupportTicket.status, 'priority': SupportTicket.priority},
+    default_sort='-created_at',
+    default_limit=API_PAGE_SIZE,
+    max_limit=API_PAGE_MAX_SIZE
+)
+
+
+def invalidate_dashboard_stats(reseller_id):
+    """حذف إحصائيات الموزع ومصفوفات التحليلات من الكاش بعد تغيير اشتراكاته"""
+    dashboard_stats_cache.delete(reseller_id)
+    analytics_helper.invalidate_timeline(reseller_id)
+    bump_data_version(reseller_id)
+
+
 def get_dashboard_stats(reseller_id):
     """
-    حساب إحصائيات لوحة التحكم للموزع
+    حساب إحصائيات لوحة التحكم للموزع (مع كاش قصير)
     """
-    now = datetime.now(timezone.utc)
+    return dashboard_stats_cache.get_or_set(reseller_id, lambda: _compute_dashboard_stats(reseller_id))
+
+
+def _compute_dashboard_stats(reseller_id):
+    """
+    كل أرقام لوحة التحكم في Query واحد (conditional aggregation)
+    
+    ❌ الطريقة القديمة: 5 queries منها اثنان يحملان كل أكواد الموزع في Python
+    ✅ الطريقة الجديدة: SELECT COUNT(*), SUM(CASE ...) ... WHERE reseller_id = ?
+    """
+    now = datetime.utcnow()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     yesterday_start = today_start - timedelta(days=1)
+    week_ago = now - timedelta(days=7)
     
-    # 🔴 إجمالي الاشتراكات (التفعيلات)
-    total_activations = ActivationCode.query.filter_by(
-        reseller_id=reseller_id
-    ).count()
-    
-    # 🔴 الاشتراكات اليوم
-    today_activations = ActivationCode.query.filter(
-        ActivationCode.reseller_id == reseller_id,
-        ActivationCode.created_at >= today_start
-    ).count()
-    
-    # 🔴 الاشتراكات أمس
-    yesterday_activations = ActivationCode.query.filter(
-        ActivationCode.reseller_id == reseller_id,
-        ActivationCode.created_at >= yesterday_start,
-        ActivationCode.created_at < today_start
-    ).count()
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+    
+    row = db.session.query(
+        func.count(ActivationCode.id),
+        # 🔴 الاشتراكات اليوم
+        count_if(ActivationCode.created_at >= today_start),
+        # 🔴 الاشتراكات أمس
+        count_if(and_(ActivationCode.created_at >= yesterday_start, ActivationCode.created_at < today_start)),
+        # 🔴 الاشتراكات النشطة (المفعلة وغير منتهية)
+        count_if(ActivationCode.status == STATUS_ACTIVE),
+        # 🔴 الاشتراكات المنتهية الصلاحية
+        count_if(ActivationCode.status == STATUS_EXPIRED),
+        # 🔴 الاشتراكات الموقوفة (رقم منفصل، ليست منتهية)
+        count_if(ActivationCode.status == STATUS_SUSPENDED),
+        # للمقارنة مع أسبوع ماضي
+        count_if(and_(ActivationCode.activated_at != None, ActivationCode.created_at <= week_ago))
+    ).filter(ActivationCode.reseller_id == reseller_id).one()
+    
+    (total_activations, today_activations, yesterday_activations,
+     active_subscriptions, expired_subscriptions, suspended_subscriptions, active_week_ago) = [int(value or 0) for value in row]
     
     # حساب نسبة التغير اليومي
     daily_change_percent = 0
@@ -75,28 +145,8 @@ def get_dashboard_stats(reseller_id):
     elif today_activations > 0:
         daily_change_percent = 100  # زيادة من 0 إلى رقم موجب
     
-    # 🔴 الاشتراكات المنتهية الصلاحية
-    all_codes = ActivationCode.query.filter_by(reseller_id=reseller_id).all()
-    expired_subscriptions = sum(1 for code in all_codes if code.expiration_date and safe_datetime_compare(code.expiration_date, now))
-    
-    # 🔴 الاشتراكات النشطة (المفعلة وغير منتهية)
-    active_subscriptions = ActivationCode.query.filter(
-        ActivationCode.reseller_id == reseller_id,
-        ActivationCode.activated_at != None
-    ).all()
-    
-    # عد الاشتراكات العاملة بعد مقارنة آمنة
-    active_subscriptions = sum(1 for code in active_subscriptions if not (code.expiration_date and safe_datetime_compare(code.expiration_date, now)))
-    
     # حساب نسبة التغير للاشتراكات النشطة
     # (مقارنة مع أسبوع ماضي)
-    week_ago = now - timedelta(days=7)
-    active_week_ago = ActivationCode.query.filter(
-        ActivationCode.reseller_id == reseller_id,
-        ActivationCode.activated_at != None,
-        ActivationCode.created_at <= week_ago
-    ).count()
-    
     active_change_percent = 0
     if active_week_ago > 0:
         active_change_percent = ((active_subscriptions - active_week_ago) / active_week_ago) * 100
@@ -109,7 +159,8 @@ def get_dashboard_stats(reseller_id):
         'daily_change_percent': round(daily_change_percent, 1),
         'active_subscriptions': active_subscriptions,
         'active_change_percent': round(active_change_percent, 1),
-        'expired_subscriptions': expired_subscriptions
+        'expired_subscriptions': expired_subscriptions,
+        'suspended_subscriptions': suspended_subscriptions
     }
 
 @reseller_bp.route('/dashboard')
@@ -171,25 +222,30 @@ def users():
         session.clear()
         return redirect(url_for('reseller.login'))
     
-    # جلب المستخدمين الخاصين بالموزع وبيانات اشتراكاتهم
-    users_list = User.query.filter_by(reseller_id=session['reseller_id']).all()
-    users = []
+    # المستخدمون مع آخر كود وعدد الأجهزة في Query واحد (صفحة واحدة فقط)
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'newest')
+    result = paginate_select(
+        query_reseller_users(reseller.id, search, sort),
+        request.args.get('page', 1, type=int),
+        request.args.get('per_page', RESELLER_PAGE_SIZE, type=int),
+        RESELLER_PAGE_MAX_SIZE
+    )
     
-    for user in users_list:
-        # جلب آخر كود تفعيل للمستخدم
-        latest_code = ActivationCode.query.filter_by(
-            assigned_user_id=user.id
-        ).order_by(ActivationCode.created_at.desc()).first()
-        
-        users.append({
-            'id': user.id,
-            'username': user.username,
-            'created_at': user.created_at.isoformat() if user.created_at else None,
-            'expiration_date': latest_code.expiration_date.strftime('%Y-%m-%d') if latest_code and latest_code.expiration_date else None,
-            'activation_code': latest_code.code if latest_code else None
-        })
+    users = [{
+        'id': row.id,
+        'username': row.username,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'expiration_date': row.expiration_date.strftime('%Y-%m-%d') if row.expiration_date else None,
+        'activation_code': row.code,
+        'devices': f'{row.devices} / {row.max_devices or 1}',
+        'is_active': is_subscription_active(row)
+    } for row in result['items']]
+    
+    pagination = {key: result[key] for key in ('total', 'page', 'per_page', 'pages')}
+    pagination.update(q=search, sort=sort)
     
-    return render_template('reseller/users.html', reseller=reseller, users=users)
+    return render_template('reseller/users.html', reseller=reseller, users=users, pagination=pagination)
 
 
 @reseller_bp.route('/DeviceActivation')
@@ -204,37 +260,40 @@ def device_activation():
         session.clear()
         return redirect(url_for('reseller.login'))
 
-    # جلب جميع المستخدمين الخاصين بالموزع
-    users = User.query.filter_by(reseller_id=session['reseller_id']).all()
+    # الأجهزة مع المستخدم وآخر كود في Query واحد (صفحة واحدة فقط)
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'newest')
+    result = paginate_select(
+        query_reseller_devices(reseller.id, search, sort),
+        request.args.get('page', 1, type=int),
+        request.args.get('per_page', RESELLER_PAGE_SIZE, type=int),
+        RESELLER_PAGE_MAX_SIZE
+    )
     
-    # جلب جميع الأجهزة المرتبطة بمستخدمي هذا الموزع
     devices_data = []
-    for user in users:
-        devices = Device.query.filter_by(user_id=user.id, is_deleted=False).all()
-        
-        for device in devices:
-            # الحصول على آخر كود تفعيل للمستخدم
-            latest_code = ActivationCode.query.filter_by(
-                assigned_user_id=user.id
-            ).order_by(ActivationCode.created_at.desc()).first()
-            
-            devices_data.append({
-                'id': device.id,  # معرف الجهاز في قاعدة البيانات
-                'device_id': device.device_uid,  # معرف الجهاز الفريد
-                'user_id': user.id,
-                'user_name': user.username,
-                'user_email': user.username,
-                'platform': device.device_type or 'Unknown',
-                'device_type': device.device_type or 'Unknown',
-                'last_login': device.last_login_at.strftime('%Y-%m-%d %H:%M') if device.last_login_at else 'Never',
-                'last_ip': device.last_ip or 'N/A',
-                'is_active': device.is_active,
-                'status': 'Active' if device.is_active else 'Blocked',
-                'first_login': device.first_login_at.strftime('%Y-%m-%d %H:%M') if device.first_login_at else 'N/A',
-                'activation_code': latest_code.code if latest_code else 'N/A'
-            })
+    for device in result['items']:
+        last_login_at, last_ip = get_device_last_seen(device)
+        
+        devices_data.append({
+            'id': device.id,  # معرف الجهاز في قاعدة البيانات
+            'device_id': device.device_uid,  # معرف الجهاز الفريد
+            'user_id': device.user_id,
+            'user_name': device.username,
+            'user_email': device.username,
+            'platform': device.device_type or 'Unknown',
+            'device_type': device.device_type or 'Unknown',
+            'last_login': last_login_at.strftime('%Y-%m-%d %H:%M') if last_login_at else 'Never',
+            'last_ip': last_ip or 'N/A',
+            'is_active': device.is_active,
+            'status': 'Active' if device.is_active else 'Blocked',
+            'first_login': device.first_login_at.strftime('%Y-%m-%d %H:%M') if device.first_login_at else 'N/A',
+            'activation_code': device.code or 'N/A'
+        })
+    
+    pagination = {key: result[key] for key in ('total', 'page', 'per_page', 'pages')}
+    pagination.update(q=search, sort=sort)
 
-    return render_template('reseller/devices.html', reseller=reseller, devices=devices_data)
+    return render_template('reseller/devices.html', reseller=reseller, devices=devices_data, pagination=pagination)
 
 
 @reseller_bp.route('/reports')
@@ -286,7 +345,13 @@ def login():
         # البحث عن الموزع
         reseller = Reseller.query.filter_by(email=email).first()
         
-        if reseller and check_password_hash(reseller.password_hash, password):
+        try:
+            password_ok = reseller is not None and verify_password(reseller.password_hash, password)
+        except HashingBusyError:
+            flash('Server is busy, please try again in a moment', 'error')
+            return render_template('reseller/login.html')
+        
+        if password_ok:
             if not reseller.is_active:
                 flash('Your account is inactive. Contact support.', 'error')
                 # تسجيل محاولة دخول فاشلة
@@ -373,11 +438,14 @@ def setup_pin():
         
         try:
             # حفظ PIN المشفر
-            reseller.pin_hash = generate_password_hash(pin)
+            reseller.pin_hash = hash_password(pin)
             db.session.commit()
             
             flash('PIN set successfully! You can now access your dashboard.', 'success')
             return redirect(url_for('reseller.dashboard'))
+        except HashingBusyError:
+            flash('Server is busy, please try again in a moment', 'error')
+            return render_template('reseller/setup_pin.html', reseller=reseller)
         except Exception as e:
             db.session.rollback()
             flash('Error setting PIN. Please try again.', 'error')
@@ -398,33 +466,37 @@ def get_activation_codes():
     
     reseller_id = session['reseller_id']
     
-    # الحصول على جميع الأكواز الخاصة بهذا الموزع
-    activation_codes = ActivationCode.query.filter_by(
-        reseller_id=reseller_id
-    ).order_by(ActivationCode.created_at.desc()).all()
+    # الأكواد مع اسم المستخدم في Query واحد، صفحة واحدة فقط (keyset)
+    query = db.session.query(
+        ActivationCode.id,
+        ActivationCode.code,
+        ActivationCode.duration_months,
+        ActivationCode.max_devices,
+        ActivationCode.is_lifetime,
+        ActivationCode.status,
+        ActivationCode.activated_at,
+        ActivationCode.expiration_date,
+        ActivationCode.created_at,
+        User.username
+    ).outerjoin(User, User.id == ActivationCode.assigned_user_id).filter(
+        ActivationCode.reseller_id == reseller_id
+    )
+    
+    try:
+        page = codes_paginator.paginate(query, request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
     codes_data = []
-    for code in activation_codes:
-        # الحصول على بيانات المستخدم إن وجدت
-        user = User.query.get(code.assigned_user_id) if code.assigned_user_id else None
-        
-        # حساب الحالة
-        now = datetime.now(timezone.utc)
-        if code.expiration_date and safe_datetime_compare(code.expiration_date, now):
-            status = "Expired"
-        elif code.activated_at:
-            status = "Active"
-        else:
-            status = "Not Activated"
-        
+    for code in page['items']:
         codes_data.append({
             'id': code.id,
             'code': code.code,
-            'username': user.username if user else 'N/A',
+            'username': code.username or 'N/A',
             'duration_months': code.duration_months,
             'max_devices': code.max_devices,
             'is_lifetime': code.is_lifetime,
-            'status': status,
+            'status': status_label(code),  # الحالة المخزنة
             'activated_at': code.activated_at.isoformat() if code.activated_at else None,
             'expiration_date': code.expiration_date.isoformat() if code.expiration_date else None,
             'created_at': code.created_at.isoformat() if code.created_at else None,
@@ -433,9 +505,11 @@ def get_activation_codes():
     return jsonify({
         'success': True,
         'data': codes_data,
-        'count': len(codes_data)
+        'count': len(codes_data),
+        'next_cursor': page['next_cursor']
     }), 200
 
+
 @reseller_bp.route('/api/users/<int:user_id>', methods=['GET'])
 def get_user_detail(user_id):
     """الحصول على تفاصيل مستخدم معين"""
@@ -443,15 +517,31 @@ def get_user_detail(user_id):
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
     try:
-        user = User.query.filter_by(id=user_id, reseller_id=session['reseller_id']).first()
-        if not user:
+        # المستخدم + آخر كود في Query واحد، ثم الأجهزة في Query ثاني
+        latest_code_id = db.session.query(ActivationCode.id).filter(
+            ActivationCode.assigned_user_id == User.id
+        ).order_by(ActivationCode.created_at.desc(), ActivationCode.id.desc()).limit(1).correlate(User).scalar_subquery()
+        
+        row = db.session.query(User, ActivationCode).outerjoin(
+            ActivationCode, ActivationCode.id == latest_code_id
+        ).filter(User.id == user_id, User.reseller_id == session['reseller_id']).first()
+        if not row:
             return jsonify({'success': False, 'message': 'User not found'}), 404
-        
-        latest_code = ActivationCode.query.filter_by(assigned_user_id=user.id).order_by(
-            ActivationCode.created_at.desc()).first()
+        user, latest_code = row
         
         devices = Device.query.filter_by(user_id=user.id).all()
         
+        devices_data = []
+        for d in devices:
+            last_login_at, _ = get_device_last_seen(d)
+            devices_data.append({
+                'id': d.id,
+                'device_uid': d.device_uid,
+                'device_type': d.device_type,
+                'is_active': d.is_active,
+                'last_login': last_login_at.isoformat() if last_login_at else None
+            })
+        
         # حساب حالة الاشتراك
         now = datetime.now(timezone.utc)
         is_active = False
@@ -460,15 +550,15 @@ def get_user_detail(user_id):
         
         if latest_code:
             expiration_date = latest_code.expiration_date.isoformat() if latest_code.expiration_date else None
-            if latest_code.is_lifetime:
+            if not is_subscription_active(latest_code):
+                plan_type = 'Expired'
+                is_active = False
+            elif latest_code.is_lifetime:
                 plan_type = 'مدى الحياة'
                 is_active = True
-            elif latest_code.expiration_date and not safe_datetime_compare(latest_code.expiration_date, now):
+            else:
                 plan_type = 'Yearly'
                 is_active = True
-            else:
-                plan_type = 'Expired'
-                is_active = False
         
         return jsonify({
             'success': True,
@@ -481,13 +571,7 @@ def get_user_detail(user_id):
                 'plan_type': plan_type,
                 'is_active': is_active,
                 'max_devices': latest_code.max_devices if latest_code else 1,
-                'devices': [{
-                    'id': d.id,
-                    'device_uid': d.device_uid,
-                    'device_type': d.device_type,
-                    'is_active': d.is_active,
-                    'last_login': d.last_login_at.isoformat() if d.last_login_at else None
-                } for d in devices]
+                'devices': devices_data
             }
         }), 200
     except Exception as e:
@@ -509,6 +593,7 @@ def suspend_user(user_id):
         codes = ActivationCode.query.filter_by(assigned_user_id=user.id).all()
         for code in codes:
             code.expiration_date = datetime.now(timezone.utc)
+            code.status = STATUS_SUSPENDED
         
         # إلغاء تفعيل الأجهزة
         devices = Device.query.filter_by(user_id=user.id).all()
@@ -516,9 +601,16 @@ def suspend_user(user_id):
             device.is_active = False
         
         db.session.commit()
+        invalidate_dashboard_stats(session['reseller_id'])
         
         # تسجيل الإجراء
-        log_reseller_action(session['reseller_id'], f"Suspended user {user.username}")
+        log_reseller_action(
+            reseller_id=session['reseller_id'],
+            action='suspend_user',
+            description=f'Suspended user {user.username}',
+            resource_type='user',
+            resource_id=user.id
+        )
         
         return jsonify({
             'success': True,
@@ -550,6 +642,8 @@ def activate_user(user_id):
                     code.expiration_date = now + timedelta(days=365*100)
                 else:
                     code.expiration_date = now + timedelta(days=365)
+            if code.activated_at:
+                code.status = STATUS_ACTIVE
         
         # تفعيل الأجهزة
         devices = Device.query.filter_by(user_id=user.id).all()
@@ -557,9 +651,16 @@ def activate_user(user_id):
             device.is_active = True
         
         db.session.commit()
+        invalidate_dashboard_stats(session['reseller_id'])
         
         # تسجيل الإجراء
-        log_reseller_action(session['reseller_id'], f"Activated user {user.username}")
+        log_reseller_action(
+            reseller_id=session['reseller_id'],
+            action='activate_user',
+            description=f'Activated user {user.username}',
+            resource_type='user',
+            resource_id=user.id
+        )
         
         return jsonify({
             'success': True,
@@ -603,8 +704,15 @@ def change_user_password(user_id):
         code.assigned_user_id = user.id
         code.activated_at = datetime.now(timezone.utc)
         db.session.commit()
+        invalidate_dashboard_stats(session['reseller_id'])
         
-        log_reseller_action(session['reseller_id'], f"Assigned new code to user {user.username}")
+        log_reseller_action(
+            reseller_id=session['reseller_id'],
+            action='assign_code',
+            description=f'Assigned new code {code.code} to user {user.username}',
+            resource_type='activation_code',
+            resource_id=code.id
+        )
         
         return jsonify({
             'success': True,
@@ -629,8 +737,16 @@ def delete_user(user_id):
         username = user.username
         db.session.delete(user)
         db.session.commit()
+        # أكواد المستخدم حذفت معه (التجميع اليومي يبقى كسجل تاريخي للتفعيلات)
+        invalidate_dashboard_stats(session['reseller_id'])
         
-        log_reseller_action(session['reseller_id'], f"Deleted user {username}")
+        log_reseller_action(
+            reseller_id=session['reseller_id'],
+            action='delete_user',
+            description=f'Deleted user {username}',
+            resource_type='user',
+            resource_id=user_id
+        )
         
         return jsonify({
             'success': True,
@@ -685,7 +801,12 @@ def verify_pin():
         return jsonify({'success': False, 'message': 'Invalid PIN format'}), 400
     
     # التحقق من PIN
-    if reseller.pin_hash and check_password_hash(reseller.pin_hash, pin):
+    try:
+        pin_ok = verify_password(reseller.pin_hash, pin)
+    except HashingBusyError:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again'}), 503
+    
+    if pin_ok:
         return jsonify({'success': True, 'message': 'PIN verified successfully'}), 200
     else:
         return jsonify({'success': False, 'message': 'Invalid PIN'}), 401
@@ -693,207 +814,239 @@ def verify_pin():
 
 @reseller_bp.route('/api/export-codes', methods=['GET'])
 def export_codes():
-    """تصدير أكواد التفعيل إلى Excel بصيغة احترافية"""
+    """
+    تصدير أكواد التفعيل (format: xlsx افتراضياً، أو csv / ndjson)
+    
+    القراءة بدفعات من القاعدة:
+    - xlsx: write_only إلى ملف مؤقت ثم إرساله على دفعات
+    - csv / ndjson: إرسال مباشر أثناء القراءة (chunked)
+    """
     if 'reseller_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
     reseller_id = session['reseller_id']
     reseller = Reseller.query.get(reseller_id)
     
-    # الحصول على جميع الأكواز الخاصة بهذا الموزع
-    activation_codes = ActivationCode.query.filter_by(
-        reseller_id=reseller_id
-    ).order_by(ActivationCode.created_at.desc()).all()
-    
-    # إنشاء Workbook جديد
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Activation Codes"
-    
-    # تعريف الأنماط
-    # Header Style
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    
-    # Border Style
-    thin_border = Border(
-        left=Side(style='thin', color='000000'),
-        right=Side(style='thin', color='000000'),
-        top=Side(style='thin', color='000000'),
-        bottom=Side(style='thin', color='000000')
-    )
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Invalid format'}), 400
     
-    # Data Style
-    data_alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    data_font = Font(size=10, color="000000")
-    
-    # Row alternating colors
-    light_fill = PatternFill(start_color="D9E8F5", end_color="D9E8F5", fill_type="solid")
-    white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    
-    # Status colors
-    active_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-    active_font = Font(color="006100", bold=True)
-    
-    expired_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-    expired_font = Font(color="9C0006", bold=True)
-    
-    not_activated_fill = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid")
-    not_activated_font = Font(color="9C6500", bold=True)
-    
-    # Headers
-    headers = [
-        'Activation Code',
-        'Username',
-        'Plan Type',
-        'Max Devices',
-        'Status',
-        'Created Date',
-        'Expiration Date',
-        'Created At (Full)'
-    ]
-    
-    # Write headers
-    for col_idx, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_idx)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-        cell.border = thin_border
-    
-    # Set header row height
-    ws.row_dimensions[1].height = 25
-    
-    # Write data
-    now = datetime.now(timezone.utc)
-    for row_idx, code in enumerate(activation_codes, 2):
-        user = User.query.get(code.assigned_user_id) if code.assigned_user_id else None
-        
-        # حساب الحالة
-        if code.expiration_date and safe_datetime_compare(code.expiration_date, now):
-            status = "Expired"
-        elif code.activated_at:
-            status = "Active"
-        else:
-            status = "Not Activated"
-        
-        # تحديد نوع الخطة
-        plan_type = "Lifetime" if code.is_lifetime else "1 Year"
-        
-        # تنسيق التواريخ
-        created_date = code.created_at.strftime('%Y-%m-%d') if code.created_at else 'N/A'
-        expiration_date = code.expiration_date.strftime('%Y-%m-%d') if code.expiration_date else 'N/A'
-        created_at_full = code.created_at.strftime('%Y-%m-%d %H:%M:%S') if code.created_at else 'N/A'
-        
-        row_data = [
-            code.code,
-            user.username if user else 'N/A',
-            plan_type,
-            code.max_devices,
-            status,
-            created_date,
-            expiration_date,
-            created_at_full
-        ]
-        
-        # اختيار لون الصف بناءً على الحالة
-        row_fill = light_fill if row_idx % 2 == 0 else white_fill
-        
-        for col_idx, value in enumerate(row_data, 1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            cell.value = value
-            cell.border = thin_border
-            cell.alignment = data_alignment
-            cell.font = data_font
-            
-            # تطبيق ألوان الحالة على عمود Status فقط
-            if col_idx == 5:  # Status column
-                if status == "Active":
-                    cell.fill = active_fill
-                    cell.font = active_font
-                elif status == "Expired":
-                    cell.fill = expired_fill
-                    cell.font = expired_font
-                elif status == "Not Activated":
-                    cell.fill = not_activated_fill
-                    cell.font = not_activated_font
-            else:
-                cell.fill = row_fill
-        
-        # Set row height
-        ws.row_dimensions[row_idx].height = 20
-    
-    # ضبط عرض الأعمدة
-    column_widths = {
-        'A': 20,  # Activation Code
-        'B': 18,  # Username
-        'C': 15,  # Plan Type
-        'D': 12,  # Max Devices
-        'E': 16,  # Status
-        'F': 15,  # Created Date
-        'G': 16,  # Expiration Date
-        'H': 22   # Created At (Full)
-    }
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"activation_codes_{reseller.name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{extension}"
     
-    for col, width in column_widths.items():
-        ws.column_dimensions[col].width = width
-    
-    # إضافة صف معلومات في الأعلى
-    ws.insert_rows(1)
-    ws.merge_cells('A1:H1')
-    title_cell = ws['A1']
-    title_cell.value = f"Activation Codes Report - {reseller.name}"
-    title_cell.font = Font(bold=True, size=14, color="FFFFFF")
-    title_cell.fill = PatternFill(start_color="203864", end_color="203864", fill_type="solid")
-    title_cell.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[1].height = 28
-    
-    # إضافة معلومات التصدير
-    ws.insert_rows(2)
-    ws.merge_cells('A2:H2')
-    info_cell = ws['A2']
-    info_cell.value = f"Exported on: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} | Total Records: {len(activation_codes)}"
-    info_cell.font = Font(italic=True, size=9, color="666666")
-    info_cell.fill = PatternFill(start_color="F0F0F0", end_color="F0F0F0", fill_type="solid")
-    info_cell.alignment = Alignment(horizontal="left", vertical="center")
-    ws.row_dimensions[2].height = 18
-    
-    # إرجاع الملف
-    mem = BytesIO()
-    wb.save(mem)
-    mem.seek(0)
-    
-    filename = f"activation_codes_{reseller.name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return send_file(
-        mem,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    if export_format == 'xlsx':
+        # الملف المؤقت يحذف تلقائياً عند إغلاقه بعد الإرسال
+        tmp = tempfile.TemporaryFile()
+        write_codes_xlsx(tmp, reseller.name, iter_code_records(reseller_id), count_codes(reseller_id))
+        tmp.seek(0)
+        return send_file(tmp, mimetype=mimetype, as_attachment=True, download_name=filename)
+    
+    records = iter_code_records(reseller_id)
+    if export_format == 'csv':
+        body = iter_csv(CODE_EXPORT_HEADERS, records)
+    else:
+        body = iter_ndjson(CODE_EXPORT_KEYS, records)
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = content_disposition(filename)
+    return response
+
+
+@reseller_bp.route('/api/exports', methods=['POST'])
+def create_export():
+    """
+    طلب تصدير في الخلفية (لا يحجز الطلب حتى ينتهي الملف)
+    
+    JSON: kind (activation_codes)، format (xlsx / csv / ndjson)
+    يعيد 202 مع job_key، والحالة عبر GET /api/exports/<job_key> أو Socket.IO (join_export)
+    """
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind', 'activation_codes')
+    if kind != 'activation_codes':
+        return jsonify({'success': False, 'message': 'Invalid export kind'}), 400
+    
+    try:
+        job = export_jobs.enqueue('reseller', session['reseller_id'], kind, data.get('format', 'xlsx'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid format'}), 400
+    except export_jobs.ExportLimitError as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
+    
+    return jsonify({
+        'success': True,
+        'message': 'Export started',
+        'job': export_jobs.job_to_dict(job),
+        'status_url': url_for('reseller.export_status', job_key=job.job_key),
+        'download_url': url_for('reseller.download_export', job_key=job.job_key)
+    }), 202
+
+
+@reseller_bp.route('/api/exports', methods=['GET'])
+def list_exports():
+    """آخر مهام التصدير للموزع"""
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    jobs = export_jobs.list_jobs('reseller', session['reseller_id'])
+    return jsonify({'success': True, 'jobs': [export_jobs.job_to_dict(job) for job in jobs]}), 200
+
+
+@reseller_bp.route('/api/exports/<job_key>', methods=['GET'])
+def export_status(job_key):
+    """حالة وتقدم مهمة التصدير (polling)"""
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    job = export_jobs.get_job('reseller', session['reseller_id'], job_key)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    
+    return jsonify({'success': True, 'job': export_jobs.job_to_dict(job)}), 200
+
+
+@reseller_bp.route('/api/exports/<job_key>/download', methods=['GET'])
+def download_export(job_key):
+    """تحميل الملف الجاهز (يدعم Range لاستكمال التحميل)"""
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    job = export_jobs.get_job('reseller', session['reseller_id'], job_key)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    if job.status in export_jobs.ACTIVE_STATUSES:
+        return jsonify({'success': False, 'message': 'Export is not ready yet'}), 409
+    
+    path = export_jobs.artifact_path(job)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Export file is no longer available'}), 410
+    
+    return export_jobs.send_artifact(job, path)
 
 
 # ============================================================================
 # 🔴 المرحلة 3-8: نظام تفعيل الأكواز
 # ============================================================================
 
+# ============================================================================
+# 🟢 نواة التفعيل (مشتركة بين التفعيل الفردي والجماعي)
+# ============================================================================
+
+def sanitize_username(base_name):
+    """تنظيف اسم المستخدم المطلوب (حروف وأرقام و _ فقط)"""
+    if not base_name:
+        return None
+    return re.sub(r'[^a-zA-Z0-9_]', '', base_name) or None
+
+
+def allocate_usernames(requested_names):
+    """
+    توليد أسماء مستخدمين فريدة لمجموعة طلبات دفعة واحدة
+    
+    ❌ الطريقة القديمة: Query لكل اسم (وأكثر عند التكرار)
+    ✅ الطريقة الجديدة: Query واحد للأسماء المطلوبة + Query لكل جولة أسماء عشوائية (عادة جولة واحدة)
+    
+    requested_names: قائمة (اسم أو None) - يعيد قائمة بنفس الترتيب
+    """
+    wanted = [sanitize_username(name) for name in requested_names]
+    candidates = {name for name in wanted if name}
+    
+    taken = set()
+    if candidates:
+        taken = {row.username for row in db.session.query(User.username).filter(User.username.in_(candidates))}
+    
+    result = []
+    used = set()
+    missing = []
+    for index, name in enumerate(wanted):
+        if name and name not in taken and name not in used:
+            used.add(name)
+            result.append(name)
+        else:
+            result.append(None)
+            missing.append(index)
+    
+    # أسماء عشوائية لمن لم يطلب اسماً أو كان اسمه محجوزاً
+    while missing:
+        generated = {f"SERVO-{uuid.uuid4().hex[:8]}" for _ in missing} - used
+        taken = {row.username for row in db.session.query(User.username).filter(User.username.in_(generated))}
+        for name in generated - taken:
+            if not missing:
+                break
+            used.add(name)
+            result[missing.pop()] = name
+    
+    return result
+
+
 def generate_username(base_name=None):
     """توليد اسم مستخدم فريد"""
-    if base_name:
-        base_name = re.sub(r'[^a-zA-Z0-9_]', '', base_name)
-        if base_name:
-            # تحقق من أن الاسم غير موجود
-            existing = User.query.filter_by(username=base_name).first()
-            if not existing:
-                return base_name
+    return allocate_usernames([base_name])[0]
+
+
+def build_activation(reseller_id, device_activation_code, username, subscription_duration, media_link=None):
+    """
+    إنشاء المستخدم والاشتراك والجهاز لكود تفعيل (بدون commit)
+    
+    الكائنات مربوطة بالعلاقات لذلك لا حاجة لـ flush للحصول على user_id،
+    وعند التفعيل الجماعي تكتب كل الصفوف في flush واحد
+    
+    يعيد: (new_user, new_activation_code, new_device)
+    """
+    plan = SUBSCRIPTION_PLANS[subscription_duration]
+    now = datetime.utcnow()
+    
+    # 🟢 المرحلة 5: إنشاء المستخدم
+    new_user = User(
+        username=username,
+        reseller_id=reseller_id
+    )
     
-    # إنشاء اسم عشوائي
-    while True:
-        random_user = f"SERVO-{uuid.uuid4().hex[:8]}"
-        if not User.query.filter_by(username=random_user).first():
-            return random_user
+    # 🟢 المرحلة 6: تفعيل الاشتراك
+    new_activation_code = ActivationCode(
+        code=device_activation_code.activation_code,
+        reseller_id=reseller_id,
+        assigned_user=new_user,
+        duration_months=plan['duration_months'],
+        max_devices=1,  # ثابت دائماً = 1
+        is_lifetime=plan['is_lifetime'],
+        activated_at=now,
+        expiration_date=now + timedelta(days=plan['days']),
+        status=STATUS_ACTIVE
+    )
+    
+    # 🟢 المرحلة 7: ربط الجهاز بالمستخدم (device_id من التسجيل الأولي للجهاز)
+    new_device = Device(
+        user=new_user,
+        device_uid=device_activation_code.device_id,
+        device_type=device_activation_code.device_type or 'unknown',
+        is_active=True,
+        first_login_at=now,
+        media_link=media_link
+    )
+    
+    # 🟢 المرحلة 8: إغلاق كود التفعيل
+    device_activation_code.is_used = True
+    device_activation_code.used_at = now
+    device_activation_code.activated_by_reseller_id = reseller_id
+    device_activation_code.user = new_user
+    device_activation_code.username = username
+    
+    return new_user, new_activation_code, new_device
+
+
+def check_device_activation_code(device_activation_code):
+    """رسالة الخطأ إذا كان الكود غير صالح للتفعيل، أو None"""
+    if not device_activation_code:
+        return '❌ Activation code not found'
+    if device_activation_code.is_used:
+        return '❌ Activation code has already been used'
+    now = datetime.now(timezone.utc)
+    if device_activation_code.expires_at and safe_datetime_compare(device_activation_code.expires_at, now):
+        return '❌ Activation code has expired'
+    return None
 
 
 @reseller_bp.route('/api/activate-code', methods=['POST'])
@@ -935,124 +1088,80 @@ def activate_code_api():
     if not activation_code:
         return jsonify({'success': False, 'message': 'Activation code is required'}), 400
     
-    if subscription_duration not in ['1year', 'lifetime']:
+    if subscription_duration not in SUBSCRIPTION_PLANS:
         return jsonify({'success': False, 'message': 'Invalid subscription duration. Must be "1year" or "lifetime"'}), 400
     
     # ============================================================================
     # 🟢 المرحلة 4: التحقق من كود التفعيل
     # ============================================================================
     
-    # البحث عن الكود في device_activation_codes
-    device_activation_code = DeviceActivationCode.query.filter_by(
-        activation_code=activation_code
-    ).first()
-    
-    # التحقق: غير موجود
-    if not device_activation_code:
+    # رفض الأكواد غير الموجودة (أو محاولات التخمين) بدون أي Query
+    if not outstanding_codes.might_exist(activation_code):
         return jsonify({'success': False, 'message': '❌ Activation code not found'}), 404
     
-    # التحقق: مستخدم من قبل
-    if device_activation_code.is_used:
-        return jsonify({'success': False, 'message': '❌ Activation code has already been used'}), 400
+    # البحث عن الكود في device_activation_codes (الكود غير المستخدم أولاً إن تكرر)
+    device_activation_code = DeviceActivationCode.query.filter_by(
+        activation_code=activation_code
+    ).order_by(DeviceActivationCode.is_used).first()
     
-    # التحقق: Expired
-    now = datetime.now(timezone.utc)
-    if device_activation_code.expires_at and safe_datetime_compare(device_activation_code.expires_at, now):
-        return jsonify({'success': False, 'message': '❌ Activation code has expired'}), 400
+    error_message = check_device_activation_code(device_activation_code)
+    if error_message:
+        status_code = 404 if not device_activation_code else 400
+        return jsonify({'success': False, 'message': error_message}), status_code
     
     # ============================================================================
     # 🟢 حساب مدة الاشتراك وخصم النقاط
     # ============================================================================
     
-    is_lifetime = subscription_duration == 'lifetime'
-    duration_months = 12 if subscription_duration == '1year' else 120  # 120 شهر لمدى الحياة (10 سنوات)
+    plan = SUBSCRIPTION_PLANS[subscription_duration]
+    is_lifetime = plan['is_lifetime']
+    points_to_deduct = plan['points']
     
-    # حساب خصم النقاط
-    points_to_deduct = 2 if is_lifetime else 1
-    
-    # التحقق من أن الموزع لديه نقاط كافية
+    # فحص سريع فقط (الخصم الفعلي شرطي وذري في debit_points)
     if reseller.points_balance < points_to_deduct:
         return jsonify({
             'success': False, 
             'message': f'❌ Insufficient points. Required: {points_to_deduct}, Available: {reseller.points_balance}'
         }), 400
     
-    # ============================================================================
-    # 🟢 المرحلة 5: إنشاء المستخدم
-    # ============================================================================
-    
     # توليد أو استخدام اسم المستخدم المعطى
     final_username = generate_username(username)
     
     try:
-        # إنشاء سجل جديد في جدول users
-        new_user = User(
-            username=final_username,
-            reseller_id=reseller_id
+        new_user, new_activation_code, new_device = build_activation(
+            reseller_id, device_activation_code, final_username, subscription_duration, media_link
         )
-        db.session.add(new_user)
-        db.session.flush()  # للحصول على user_id قبل الـ commit
-        user_id = new_user.id
-        
-        # ============================================================================
-        # 🟢 المرحلة 6: تفعيل الاشتراك
-        # ============================================================================
+        db.session.add_all([new_user, new_activation_code, new_device])
         
-        now = datetime.now(timezone.utc)
-        if is_lifetime:
-            # لمدى الحياة: لا يوجد تاريخ انتهاء (أو سنة 2099)
-            expiration_date = now + timedelta(days=365*100)  # 100 سنة
-        else:
-            # سنة واحدة: 12 شهر
-            expiration_date = now
-            expiration_date = datetime.utcnow() + timedelta(days=365)
-        
-        new_activation_code = ActivationCode(
-            code=activation_code,
-            reseller_id=reseller_id,
-            assigned_user_id=user_id,
-            duration_months=duration_months,
-            max_devices=1,  # ثابت دائماً = 1
-            is_lifetime=is_lifetime,
-            activated_at=datetime.utcnow(),
-            expiration_date=expiration_date
-        )
-        db.session.add(new_activation_code)
-        
-        # ============================================================================
-        # 🟢 المرحلة 7: ربط الجهاز بالمستخدم
-        # ============================================================================
-        
-        # استخدام device_id الموجود من التسجيل الأولي للجهاز
-        device_uid = device_activation_code.device_id
-        
-        new_device = Device(
-            user_id=user_id,
-            device_uid=device_uid,
-            device_type=device_activation_code.device_type or 'unknown',
-            is_active=True,
-            first_login_at=datetime.utcnow(),
-            media_link=media_link
+        # القيم المطلوبة للرد قبل الـ commit (حتى لا يعاد تحميل الكائنات بعده)
+        db.session.flush()
+        user_id = new_user.id
+        subscription_id = new_activation_code.id
+        expiration_date = new_activation_code.expiration_date
+        device_uid = new_device.device_uid
+        
+        # خصم النقاط من رصيد الموزع (UPDATE مشروط + قيد في points_ledger)
+        remaining_points = debit_points(
+            reseller_id, points_to_deduct, 'activation',
+            reference_type='activation_code',
+            reference_id=subscription_id,
+            description=f'Activation code {activation_code} ({subscription_duration})'
         )
-        db.session.add(new_device)
-        
-        # ============================================================================
-        # 🟢 المرحلة 8: خصم النقاط والإغلاق
-        # ============================================================================
-        
-        # خصم النقاط من رصيد الموزع
-        reseller.points_balance -= points_to_deduct
-        reseller.total_points_charged += points_to_deduct
         
-        # إغلاق كود التفعيل
-        device_activation_code.is_used = True
-        device_activation_code.used_at = datetime.utcnow()
-        device_activation_code.activated_by_reseller_id = reseller_id
-        device_activation_code.user_id = user_id
-        device_activation_code.username = final_username
+        # تحديث التجميع اليومي (نفس الـ transaction)
+        record_activations(reseller_id, [subscription_duration])
         
         # حفظ جميع التغييرات
         db.session.commit()
+        outstanding_codes.discard(activation_code)
+        invalidate_dashboard_stats(reseller_id)
+        
+        # إشعار الجهاز المنتظر حتى يسجل الدخول فوراً
+        publish_activation(device_uid, {
+            'device_id': device_uid,
+            'username': final_username,
+            'activated_at': datetime.utcnow().isoformat()
+        })
         
         # تسجيل العملية
         log_reseller_action(
@@ -1060,7 +1169,7 @@ def activate_code_api():
             action='activate',
             description=f'Activation code {activation_code} was activated for user {final_username}. Points deducted: {points_to_deduct}',
             resource_type='activation_code',
-            resource_id=new_activation_code.id
+            resource_id=subscription_id
         )
         
         return jsonify({
@@ -1075,10 +1184,17 @@ def activate_code_api():
                 'expiration_date': expiration_date.isoformat(),
                 'max_devices': 1,
                 'points_deducted': points_to_deduct,
-                'remaining_points': reseller.points_balance
+                'remaining_points': remaining_points
             }
         }), 201
     
+    except InsufficientPointsError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'❌ Insufficient points. Required: {e.required}, Available: {e.available}'
+        }), 400
+    
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -1087,6 +1203,240 @@ def activate_code_api():
         }), 500
 
 
+@reseller_bp.route('/api/activate-codes/bulk', methods=['POST'])
+def activate_codes_bulk_api():
+    """
+    تفعيل مجموعة أكواد في طلب واحد و transaction واحد
+    
+    البيانات:
+    {
+        "subscriptionDuration": "1year",   (افتراضي لكل الأكواد)
+        "codes": [
+            {"activationCode": "123456", "username": "...", "mediaLink": "...", "subscriptionDuration": "lifetime"},
+            ...
+        ]
+    }
+    
+    - التحقق من كل الأكواد بـ Query واحد
+    - توليد أسماء المستخدمين دفعة واحدة
+    - إدخال المستخدمين والاشتراكات والأجهزة في flush واحد
+    - خصم النقاط مرة واحدة
+    - يعيد نتيجة لكل كود (الأكواد تقبل بالترتيب حتى نفاد النقاط)
+    """
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    reseller_id = session['reseller_id']
+    reseller = Reseller.query.get(reseller_id)
+    if not reseller:
+        return jsonify({'success': False, 'message': 'Reseller not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    entries = data.get('codes')
+    default_duration = (data.get('subscriptionDuration') or '').strip()
+    
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'success': False, 'message': 'A non-empty list of codes is required'}), 400
+    
+    if len(entries) > BULK_ACTIVATION_MAX_CODES:
+        return jsonify({
+            'success': False,
+            'message': f'Too many codes. Maximum per request: {BULK_ACTIVATION_MAX_CODES}'
+        }), 400
+    
+    # ============================================================================
+    # 1️⃣ التحقق من صيغة الطلبات (بدون قاعدة البيانات)
+    # ============================================================================
+    
+    results = []
+    pending = []  # (index, code, duration, username, media_link)
+    seen_codes = set()
+    
+    for index, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {'activationCode': entry}
+        if not isinstance(entry, dict):
+            entry = {}
+        
+        code = str(entry.get('activationCode') or '').strip()
+        duration = (entry.get('subscriptionDuration') or default_duration).strip()
+        results.append({'activation_code': code, 'success': False})
+        
+        if not code:
+            results[index]['message'] = 'Activation code is required'
+        elif duration not in SUBSCRIPTION_PLANS:
+            results[index]['message'] = 'Invalid subscription duration. Must be "1year" or "lifetime"'
+        elif code in seen_codes:
+            results[index]['message'] = 'Duplicate activation code in request'
+        elif not outstanding_codes.might_exist(code):
+            results[index]['message'] = '❌ Activation code not found'
+        else:
+            seen_codes.add(code)
+            pending.append((
+                index, code, duration,
+                (entry.get('username') or '').strip() or None,
+                (entry.get('mediaLink') or '').strip() or None
+            ))
+    
+    # ============================================================================
+    # 2️⃣ التحقق من الأكواد والأجهزة (Query واحد لكل جدول)
+    # ============================================================================
+    
+    codes = [item[1] for item in pending]
+    device_codes = {}
+    existing_subscriptions = set()
+    existing_devices = set()
+    
+    if codes:
+        for row in DeviceActivationCode.query.filter(
+            DeviceActivationCode.activation_code.in_(codes)
+        ).order_by(DeviceActivationCode.is_used.desc(), DeviceActivationCode.created_at):
+            # الترتيب يجعل الكود غير المستخدم الأحدث هو الأخير (يطغى على القديم)
+            device_codes[row.activation_code] = row
+        
+        existing_subscriptions = {
+            row.code for row in db.session.query(ActivationCode.code).filter(ActivationCode.code.in_(codes))
+        }
+        device_uids = [row.device_id for row in device_codes.values()]
+        if device_uids:
+            existing_devices = {
+                row.device_uid for row in db.session.query(Device.device_uid).filter(Device.device_uid.in_(device_uids))
+            }
+    
+    accepted = []
+    points_available = reseller.points_balance or 0
+    points_total = 0
+    
+    for index, code, duration, username, media_link in pending:
+        device_activation_code = device_codes.get(code)
+        error_message = check_device_activation_code(device_activation_code)
+        points = SUBSCRIPTION_PLANS[duration]['points']
+        
+        if error_message:
+            results[index]['message'] = error_message
+        elif code in existing_subscriptions:
+            results[index]['message'] = '❌ Activation code has already been used'
+        elif device_activation_code.device_id in existing_devices:
+            results[index]['message'] = '❌ Device is already registered'
+        elif points_total + points > points_available:
+            results[index]['message'] = f'❌ Insufficient points. Required: {points}, Available: {points_available - points_total}'
+        else:
+            existing_devices.add(device_activation_code.device_id)
+            points_total += points
+            accepted.append((index, device_activation_code, duration, username, media_link))
+    
+    if not accepted:
+        return jsonify({
+            'success': False,
+            'message': 'No activation codes were activated',
+            'data': {
+                'activated': 0,
+                'failed': len(results),
+                'points_deducted': 0,
+                'remaining_points': reseller.points_balance,
+                'results': results
+            }
+        }), 400
+    
+    # ============================================================================
+    # 3️⃣ الإنشاء والخصم في transaction واحد
+    # ============================================================================
+    
+    usernames = allocate_usernames([item[3] for item in accepted])
+    now = datetime.utcnow()
+    notices = []
+    audit_entries = []
+    
+    try:
+        new_objects = []
+        created = []
+        for (index, device_activation_code, duration, _, media_link), username in zip(accepted, usernames):
+            new_user, new_activation_code, new_device = build_activation(
+                reseller_id, device_activation_code, username, duration, media_link
+            )
+            new_objects.extend([new_user, new_activation_code, new_device])
+            created.append((index, duration, new_user, new_activation_code, new_device))
+        
+        db.session.add_all(new_objects)
+        
+        # flush واحد لكل الصفوف، ثم تجهيز النتائج قبل الـ commit
+        # (حتى لا يعاد تحميل كل كائن بـ Query منفصل بعده)
+        db.session.flush()
+        
+        # خصم النقاط مرة واحدة (UPDATE مشروط: يفشل كل الطلب إن صرف طلب آخر الرصيد في نفس اللحظة)
+        remaining_points = debit_points(
+            reseller_id, points_total, 'bulk_activation',
+            description=f'Bulk activation of {len(created)} codes'
+        )
+        record_activations(reseller_id, [duration for _, duration, _, _, _ in created])
+        
+        for index, duration, new_user, new_activation_code, new_device in created:
+            code = new_activation_code.code
+            points = SUBSCRIPTION_PLANS[duration]['points']
+            
+            notices.append((code, new_device.device_uid, {
+                'device_id': new_device.device_uid,
+                'username': new_user.username,
+                'activated_at': now.isoformat()
+            }))
+            
+            audit_entries.append({
+                'action': 'activate',
+                'description': f'Activation code {code} was activated for user {new_user.username} (bulk). Points deducted: {points}',
+                'resource_type': 'activation_code',
+                'resource_id': new_activation_code.id
+            })
+            
+            results[index].update({
+                'success': True,
+                'message': '✅ Activated',
+                'user_id': new_user.id,
+                'username': new_user.username,
+                'device_uid': new_device.device_uid,
+                'subscription_duration': duration,
+                'expiration_date': new_activation_code.expiration_date.isoformat(),
+                'points_deducted': points
+            })
+        
+        db.session.commit()
+    except InsufficientPointsError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'❌ Insufficient points. Required: {e.required}, Available: {e.available}'
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ خطأ في التفعيل الجماعي: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error processing activation codes: {str(e)}'
+        }), 500
+    
+    # ============================================================================
+    # 4️⃣ ما بعد الحفظ: الإشعارات والسجل
+    # ============================================================================
+    
+    invalidate_dashboard_stats(reseller_id)
+    for code, device_uid, notice in notices:
+        outstanding_codes.discard(code)
+        publish_activation(device_uid, notice)
+    
+    log_actions('reseller', reseller_id, audit_entries)
+    
+    return jsonify({
+        'success': True,
+        'message': f'✅ {len(notices)} of {len(results)} activation codes processed successfully',
+        'data': {
+            'activated': len(notices),
+            'failed': len(results) - len(notices),
+            'points_deducted': points_total,
+            'remaining_points': remaining_points,
+            'results': results
+        }
+    }), 201
+
+
 # ============================================================================
 # 📊 API لجلب بيانات التحليلات
 # ============================================================================
@@ -1100,54 +1450,38 @@ def get_analytics():
     reseller_id = session['reseller_id']
     period = request.args.get('period', 'daily')  # daily, weekly, monthly, yearly
     
+    if period not in ANALYTICS_PERIODS:
+        return jsonify({'success': False, 'message': 'Invalid period'}), 400
+    
     now = datetime.now(timezone.utc)
     
+    # اليوم ضمن المفتاح لأن الفترات تتحرك مع التاريخ حتى بدون تغيير البيانات
+    cache_key = ('analytics', reseller_id, get_data_version(reseller_id), period, now.date().isoformat())
+    
     try:
-        if period == 'daily':
-            # آخر 7 أيام
-            data = get_daily_analytics(reseller_id, now)
-        elif period == 'weekly':
-            # آخر 4 أسابيع
-            data = get_weekly_analytics(reseller_id, now)
-        elif period == 'monthly':
-            # آخر 6 أشهر
-            data = get_monthly_analytics(reseller_id, now)
-        elif period == 'yearly':
-            # آخر 5 سنوات
-            data = get_yearly_analytics(reseller_id, now)
-        else:
-            return jsonify({'success': False, 'message': 'Invalid period'}), 400
-        
-        return jsonify({'success': True, 'data': data}), 200
+        return conditional_json_response(
+            analytics_memo, cache_key, ANALYTICS_HTTP_MAX_AGE,
+            lambda: {'success': True, 'data': ANALYTICS_PERIODS[period](reseller_id, now)}
+        )
     
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
-def get_daily_analytics(reseller_id, now):
-    """حساب بيانات آخر 7 أيام"""
-    labels = []
-    activations_data = []
+def build_period_analytics(reseller_id, buckets):
+    """
+    عدد التفعيلات لكل فترة من reseller_daily_stats بـ Query واحد
+
+    buckets: قائمة (label, start_day, end_day) بالترتيب الزمني
+    """
+    daily_counts = get_daily_counts(
+        reseller_id,
+        min(start for _, start, _ in buckets),
+        max(end for _, _, end in buckets)
+    )
     
-    days_names = ['الأحد', 'الاثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت']
-    
-    for i in range(6, -1, -1):  # من 6 أيام ماضية إلى اليوم
-        date = now - timedelta(days=i)
-        day_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-        
-        # عدد التفعيلات في هذا اليوم
-        activations = ActivationCode.query.filter(
-            ActivationCode.reseller_id == reseller_id,
-            ActivationCode.created_at >= day_start,
-            ActivationCode.created_at < day_end
-        ).count()
-        
-        # اسم اليوم بالعربية
-        day_name = days_names[date.weekday()]
-        
-        labels.append(day_name)
-        activations_data.append(activations)
+    labels = [label for label, _, _ in buckets]
+    activations_data = [sum_range(daily_counts, start, end) for _, start, end in buckets]
     
     # حساب النسبة المئوية للنمو
     if activations_data[-2] > 0:
@@ -1164,61 +1498,44 @@ def get_daily_analytics(reseller_id, now):
     }
 
 
+def get_daily_analytics(reseller_id, now):
+    """حساب بيانات آخر 7 أيام"""
+    days_names = ['الأحد', 'الاثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت']
+    today = now.date()
+    
+    buckets = []
+    for i in range(6, -1, -1):  # من 6 أيام ماضية إلى اليوم
+        day = today - timedelta(days=i)
+        # اسم اليوم بالعربية
+        buckets.append((days_names[day.weekday()], day, day + timedelta(days=1)))
+    
+    return build_period_analytics(reseller_id, buckets)
+
+
 def get_weekly_analytics(reseller_id, now):
     """حساب بيانات آخر 4 أسابيع"""
-    labels = []
-    activations_data = []
+    today = now.date()
     
+    buckets = []
     for i in range(3, -1, -1):  # من 3 أسابيع ماضية إلى الأسبوع الحالي
-        week_start = (now - timedelta(weeks=i)).replace(hour=0, minute=0, second=0, microsecond=0)
+        week_start = today - timedelta(weeks=i)
         # ابدأ من بداية الأسبوع (الأحد)
         week_start = week_start - timedelta(days=week_start.weekday() + 1)
-        week_end = week_start + timedelta(days=7)
-        
-        # عدد التفعيلات في هذا الأسبوع
-        activations = ActivationCode.query.filter(
-            ActivationCode.reseller_id == reseller_id,
-            ActivationCode.created_at >= week_start,
-            ActivationCode.created_at < week_end
-        ).count()
-        
-        # اسم الأسبوع
-        label = f'الأسبوع {i + 1}'
-        
-        labels.append(label)
-        activations_data.append(activations)
+        buckets.append((f'الأسبوع {i + 1}', week_start, week_start + timedelta(days=7)))
     
-    # حساب النسبة المئوية للنمو
-    if activations_data[-2] > 0:
-        trend = ((activations_data[-1] - activations_data[-2]) / activations_data[-2]) * 100
-    elif activations_data[-1] > 0:
-        trend = 100
-    else:
-        trend = 0
-    
-    return {
-        'labels': labels,
-        'activations': activations_data,
-        'trend': round(trend, 1)
-    }
+    return build_period_analytics(reseller_id, buckets)
 
 
 def get_monthly_analytics(reseller_id, now):
     """حساب بيانات آخر 6 أشهر"""
-    labels = []
-    activations_data = []
-    
     months_names = ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو', 
                     'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر']
+    today = now.date()
     
+    buckets = []
     for i in range(5, -1, -1):  # من 5 أشهر ماضية إلى الشهر الحالي
-        if i == 0:
-            # الشهر الحالي
-            month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        else:
-            # الأشهر الماضية
-            month_date = now - timedelta(days=30*i)
-            month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        # الشهر الحالي أو الأشهر الماضية
+        month_start = (today - timedelta(days=30*i)).replace(day=1)
         
         # حساب بداية الشهر التالي
         if month_start.month == 12:
@@ -1226,73 +1543,132 @@ def get_monthly_analytics(reseller_id, now):
         else:
             month_end = month_start.replace(month=month_start.month + 1)
         
-        # عدد التفعيلات في هذا الشهر
-        activations = ActivationCode.query.filter(
-            ActivationCode.reseller_id == reseller_id,
-            ActivationCode.created_at >= month_start,
-            ActivationCode.created_at < month_end
-        ).count()
-        
-        # اسم الشهر
-        month_name = months_names[month_start.month - 1]
-        
-        labels.append(month_name)
-        activations_data.append(activations)
+        buckets.append((months_names[month_start.month - 1], month_start, month_end))
     
-    # حساب النسبة المئوية للنمو
-    if activations_data[-2] > 0:
-        trend = ((activations_data[-1] - activations_data[-2]) / activations_data[-2]) * 100
-    elif activations_data[-1] > 0:
-        trend = 100
-    else:
-        trend = 0
-    
-    return {
-        'labels': labels,
-        'activations': activations_data,
-        'trend': round(trend, 1)
-    }
+    return build_period_analytics(reseller_id, buckets)
 
 
 def get_yearly_analytics(reseller_id, now):
     """حساب بيانات آخر 5 سنوات"""
-    labels = []
-    activations_data = []
-    
+    buckets = []
     for i in range(4, -1, -1):  # من 4 سنوات ماضية إلى السنة الحالية
         year = now.year - i
-        year_start = now.replace(year=year, month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        year_end = year_start.replace(year=year + 1)
+        buckets.append((str(year), date(year, 1, 1), date(year + 1, 1, 1)))
+    
+    return build_period_analytics(reseller_id, buckets)
+
+
+# الفترات المدعومة في /api/analytics
+ANALYTICS_PERIODS = {
+    'daily': get_daily_analytics,      # آخر 7 أيام
+    'weekly': get_weekly_analytics,    # آخر 4 أسابيع
+    'monthly': get_monthly_analytics,  # آخر 6 أشهر
+    'yearly': get_yearly_analytics     # آخر 5 سنوات
+}
+
+
+def _parse_analytics_date(value, default):
+    """تاريخ من query string (ISO) أو القيمة الافتراضية"""
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@reseller_bp.route('/api/analytics/range', methods=['GET'])
+def get_range_analytics():
+    """
+    التفعيلات أو الانتهاءات لأي فترة ودقة
+
+    Query: start, end (ISO)، granularity (hour/day/week/month/year)،
+    metric (activations/expirations)
+    """
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    reseller_id = session['reseller_id']
+    granularity = request.args.get('granularity', 'day')
+    metric = request.args.get('metric', 'activations')
+    now = datetime.utcnow()
+    
+    try:
+        end = _parse_analytics_date(request.args.get('end'), now)
+        start = _parse_analytics_date(request.args.get('start'), end - timedelta(days=30))
         
-        # عدد التفعيلات في هذه السنة
-        activations = ActivationCode.query.filter(
-            ActivationCode.reseller_id == reseller_id,
-            ActivationCode.created_at >= year_start,
-            ActivationCode.created_at < year_end
-        ).count()
+        if metric == 'activations':
+            data = analytics_helper.activations_by_range(reseller_id, start, end, granularity)
+        elif metric == 'expirations':
+            data = analytics_helper.expirations_by_range(reseller_id, start, end, granularity)
+        else:
+            return jsonify({'success': False, 'message': 'Invalid metric'}), 400
         
-        labels.append(str(year))
-        activations_data.append(activations)
+        return jsonify({'success': True, 'data': data}), 200
     
-    # حساب النسبة المئوية للنمو
-    if activations_data[-2] > 0:
-        trend = ((activations_data[-1] - activations_data[-2]) / activations_data[-2]) * 100
-    elif activations_data[-1] > 0:
-        trend = 100
-    else:
-        trend = 0
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@reseller_bp.route('/api/analytics/expiry-forecast', methods=['GET'])
+def get_expiry_forecast():
+    """الاشتراكات التي ستنتهي في كل فترة خلال horizon_days القادمة (افتراضياً أسبوعياً لسنة)"""
+    if 'reseller_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
-    return {
-        'labels': labels,
-        'activations': activations_data,
-        'trend': round(trend, 1)
-    }
+    reseller_id = session['reseller_id']
+    granularity = request.args.get('granularity', 'week')
+    
+    try:
+        horizon_days = int(request.args.get('horizon_days', 365))
+        if horizon_days <= 0:
+            return jsonify({'success': False, 'message': 'horizon_days must be positive'}), 400
+        
+        data = analytics_helper.expiry_forecast(reseller_id, horizon_days, granularity)
+        return jsonify({'success': True, 'data': data}), 200
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 
 # ============================================================================
 # 📊 API لجلب نسبة الاشتراكات الYearlyة والمدى الحياة
 # ============================================================================
 
+def compute_subscription_types(reseller_id):
+    """
+    نسبة الاشتراكات الYearlyة والمدى الحياة (Query واحد)
+    
+    من الأكواد الموجودة حالياً وليس من التجميع اليومي، حتى لا تحسب اشتراكات
+    المستخدمين المحذوفين (التجميع اليومي سجل تاريخي للتفعيلات)
+    """
+    row = db.session.query(
+        func.coalesce(func.sum(case((ActivationCode.is_lifetime == False, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((ActivationCode.is_lifetime == True, 1), else_=0)), 0)
+    ).filter(ActivationCode.reseller_id == reseller_id).one()
+    yearly_subs, lifetime_subs = int(row[0]), int(row[1])
+    total = yearly_subs + lifetime_subs
+    
+    if total == 0:
+        yearly_percent = 0
+        lifetime_percent = 0
+    else:
+        yearly_percent = (yearly_subs / total) * 100
+        lifetime_percent = (lifetime_subs / total) * 100
+    
+    return {
+        'yearly': yearly_subs,
+        'lifetime': lifetime_subs,
+        'total': total,
+        'yearly_percent': round(yearly_percent, 1),
+        'lifetime_percent': round(lifetime_percent, 1)
+    }
+
+
 @reseller_bp.route('/api/subscription-types', methods=['GET'])
 def get_subscription_types():
     """جلب نسبة الاشتراكات الYearlyة والمدى الحياة"""
@@ -1302,37 +1678,11 @@ def get_subscription_types():
     reseller_id = session['reseller_id']
     
     try:
-        # عدد الاشتراكات الYearlyة
-        yearly_subs = ActivationCode.query.filter(
-            ActivationCode.reseller_id == reseller_id,
-            ActivationCode.is_lifetime == False
-        ).count()
-        
-        # عدد الاشتراكات المدى الحياة
-        lifetime_subs = ActivationCode.query.filter(
-            ActivationCode.reseller_id == reseller_id,
-            ActivationCode.is_lifetime == True
-        ).count()
-        
-        total = yearly_subs + lifetime_subs
-        
-        if total == 0:
-            yearly_percent = 0
-            lifetime_percent = 0
-        else:
-            yearly_percent = (yearly_subs / total) * 100
-            lifetime_percent = (lifetime_subs / total) * 100
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'yearly': yearly_subs,
-                'lifetime': lifetime_subs,
-                'total': total,
-                'yearly_percent': round(yearly_percent, 1),
-                'lifetime_percent': round(lifetime_percent, 1)
-            }
-        }), 200
+        cache_key = ('subscription_types', reseller_id, get_data_version(reseller_id))
+        return conditional_json_response(
+            analytics_memo, cache_key, ANALYTICS_HTTP_MAX_AGE,
+            lambda: {'success': True, 'data': compute_subscription_types(reseller_id)}
+        )
     
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -1481,13 +1831,32 @@ def get_tickets():
     reseller_id = session['reseller_id']
     
     try:
-        from models import SupportTicket
+        from models import TicketMessage
+        
+        message_count = db.session.query(func.count(TicketMessage.id)).filter(
+            TicketMessage.ticket_id == SupportTicket.id
+        ).correlate(SupportTicket).scalar_subquery()
+        
+        query = db.session.query(
+            SupportTicket.id,
+            SupportTicket.ticket_number,
+            SupportTicket.subject,
+            SupportTicket.description,
+            SupportTicket.priority,
+            SupportTicket.status,
+            SupportTicket.created_at,
+            SupportTicket.updated_at,
+            SupportTicket.resolved_at,
+            message_count.label('message_count')
+        ).filter(SupportTicket.reseller_id == reseller_id)
         
-        tickets = SupportTicket.query.filter_by(reseller_id=reseller_id)\
-            .order_by(SupportTicket.created_at.desc()).all()
+        try:
+            page = tickets_paginator.paginate(query, request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         tickets_data = []
-        for ticket in tickets:
+        for ticket in page['items']:
             tickets_data.append({
                 'id': ticket.id,
                 'ticket_number': ticket.ticket_number,
@@ -1498,13 +1867,14 @@ def get_tickets():
                 'created_at': ticket.created_at.isoformat() if ticket.created_at else None,
                 'updated_at': ticket.updated_at.isoformat() if ticket.updated_at else None,
                 'resolved_at': ticket.resolved_at.isoformat() if ticket.resolved_at else None,
-                'message_count': len(ticket.messages) if ticket.messages else 0
+                'message_count': ticket.message_count
             })
         
         return jsonify({
             'success': True,
             'data': tickets_data,
-            'count': len(tickets_data)
+            'count': len(tickets_data),
+            'next_cursor': page['next_cursor']
         }), 200
     
     except Exception as e:
@@ -1764,6 +2134,8 @@ def get_device_detail(device_id):
             assigned_user_id=user.id
         ).order_by(ActivationCode.created_at.desc()).first()
         
+        last_login_at, last_ip = get_device_last_seen(device)
+        
         return jsonify({
             'success': True,
             'data': {
@@ -1772,8 +2144,8 @@ def get_device_detail(device_id):
                 'user_id': user.id,
                 'username': user.username,
                 'device_type': device.device_type or 'Unknown',
-                'last_login': device.last_login_at.isoformat() if device.last_login_at else None,
-                'last_ip': device.last_ip or 'N/A',
+                'last_login': last_login_at.isoformat() if last_login_at else None,
+                'last_ip': last_ip or 'N/A',
                 'is_active': device.is_active,
                 'is_deleted': device.is_deleted,
                 'first_login': device.first_login_at.isoformat() if device.first_login_at else None,
@@ -1800,29 +2172,38 @@ def get_reseller_playlists():
     try:
         reseller_id = session['reseller_id']
         
-        # جلب جميع المستخدمين والأجهزة التابعة للموزع
-        users = User.query.filter_by(reseller_id=reseller_id).all()
-        
-        # جمع البلايليسترات الموصى بها
-        reseller_playlists = []
-        for user in users:
-            devices = Device.query.filter_by(user_id=user.id).all()
-            for device in devices:
-                if device.media_link:
-                    reseller_playlists.append({
-                        'user_id': user.id,
-                        'username': user.username,
-                        'device_id': device.id,
-                        'device_uid': device.device_uid,
-                        'device_name': device.device_name,
-                        'media_link': device.media_link,
-                        'device_type': device.device_type
-                    })
+        # الأجهزة التي لها رابط مع مستخدميها في Query واحد
+        query = db.session.query(
+            Device.id, Device.device_uid, Device.device_name, Device.media_link, Device.device_type,
+            User.id.label('user_id'), User.username
+        ).join(User, User.id == Device.user_id).filter(
+            User.reseller_id == reseller_id,
+            Device.media_link.isnot(None),
+            Device.media_link != ''
+        ).order_by(Device.id)
+        
+        total = query.count()
+        
+        # Pagination اختياري (بدون page يعيد الكل كما كان)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', RESELLER_PAGE_SIZE, type=int), RESELLER_PAGE_MAX_SIZE)
+        if page:
+            query = query.limit(per_page).offset((max(page, 1) - 1) * per_page)
+        
+        reseller_playlists = [{
+            'user_id': row.user_id,
+            'username': row.username,
+            'device_id': row.id,
+            'device_uid': row.device_uid,
+            'device_name': row.device_name,
+            'media_link': row.media_link,
+            'device_type': row.device_type
+        } for row in query.all()]
         
         return jsonify({
             'success': True,
             'data': reseller_playlists,
-            'total': len(reseller_playlists)
+            'total': total
         }), 200
     
     except Exception as e:
@@ -9,6 +9,13 @@ import string
 import random
 import secrets
 from audit_helper import log_user_action
+from activity_helper import record_device_activity, get_device_last_seen
+from activation_code_helper import outstanding_codes
+from subscription_helper import is_subscription_active, STATUS_SUSPENDED
+from device_notify_helper import wait_for_activation
+from analytics_helper import invalidate_timeline
+from reseller_stats_helper import bump_data_version
+from config import ACTIVATION_WAIT_TIMEOUT, ACTIVATION_WAIT_MAX_TIMEOUT
 from performance_helper import (
     SessionCache, get_device_with_user, get_device_with_activation,
     get_activation_for_user, monitor_performance, serialize_device
@@ -156,8 +163,10 @@ def register_device():
                 'expires_in_seconds': int((existing_activation.expires_at - now).total_seconds())
             }), 200
         
-        # 3️⃣ إذا انتهت صلاحية الكود أو لم يكن موجوداً - توليد كود جديد
+        # 3️⃣ إذا انتهت صلاحية الكود أو لم يكن موجوداً - توليد كود جديد (غير مكرر مع كود معلق)
         activation_code = generate_activation_code()
+        while outstanding_codes.contains(activation_code):
+            activation_code = generate_activation_code()
         expires_at = now + timedelta(minutes=10)
         
         # 4️⃣ حفظ البيانات في جدول device_activation_codes
@@ -171,6 +180,7 @@ def register_device():
         
         db.session.add(device_activation)
         db.session.commit()
+        outstanding_codes.add(activation_code, expires_at)
         
         print(f"✨ تم إنشاء كود تفعيل جديد للجهاز {device_id}")
         
@@ -240,11 +250,7 @@ def login():
     session['device_id'] = device.id
     session['device_uid'] = device.device_uid
 
-    from datetime import datetime
-    now = datetime.utcnow()
-    device.last_login_at = now
-    device.last_ip = request.remote_addr
-    db.session.commit()
+    record_device_activity(device, request.remote_addr)
     
     # تسجيل عملية الدخول
     if device.user_id:
@@ -358,7 +364,7 @@ def player():
         # التحقق من الاشتراك
         activation = get_activation_for_user(device.user_id)
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             template = get_template_path('player.html')
             return render_template(template, error='Subscription expired')
         
@@ -483,15 +489,7 @@ def get_subscription_info():
         activation_code = ActivationCode.query.filter_by(assigned_user_id=user.id).first()
         
         # حساب حالة الاشتراك
-        is_active = False
-        if activation_code:
-            if activation_code.is_lifetime:
-                is_active = True
-            elif activation_code.expiration_date:
-                # الحصول على التاريخ الحالي
-                current_time = datetime.now(timezone.utc) if activation_code.expiration_date.tzinfo else datetime.utcnow()
-                # التاريخ الحالي يجب أن يكون قبل تاريخ الانتهاء
-                is_active = safe_datetime_compare(current_time, activation_code.expiration_date)
+        is_active = is_subscription_active(activation_code)
         
         subscription_data = {
             'status': 'active' if is_active else 'inactive',
@@ -918,6 +916,54 @@ def my_list():
 
 
 
+# ============================================================================
+# 🟢 انتظار التفعيل (Long-Poll) بدل تكرار register / login
+# ============================================================================
+
+@users_bp.route('/api/device/wait-activation', methods=['GET'])
+def wait_device_activation():
+    """
+    ينتظر حتى يفعل الموزع الجهاز أو ينتهي الوقت
+    
+    - الانتظار من الذاكرة فقط (إشعار activate_code_api)
+    - عند انتهاء الوقت: Query واحد للتأكد (في حال التفعيل من عملية أخرى)
+    - الجهاز يستدعي /api/device/login فور استلام activated = true
+    
+    Query params: device_id (مطلوب), timeout (ثواني)
+    """
+    device_id = request.args.get('device_id', '').strip()
+    if not device_id:
+        return jsonify({
+            'success': False,
+            'message': 'Device ID is required'
+        }), 400
+    
+    timeout = request.args.get('timeout', ACTIVATION_WAIT_TIMEOUT, type=int)
+    timeout = min(max(timeout, 1), ACTIVATION_WAIT_MAX_TIMEOUT)
+    
+    notice = wait_for_activation(device_id, timeout)
+    if notice is not None:
+        return jsonify({
+            'success': True,
+            'activated': True,
+            'data': notice
+        }), 200
+    
+    try:
+        activated = db.session.query(DeviceActivationCode.id).filter_by(
+            device_id=device_id,
+            is_used=True
+        ).first() is not None
+    except Exception as e:
+        print(f"❌ خطأ في فحص تفعيل الجهاز: {str(e)}")
+        activated = False
+    
+    return jsonify({
+        'success': True,
+        'activated': activated
+    }), 200
+
+
 # ============================================================================
 # 🟢 المرحلة 9: الجهاز يبدأ العمل - Device Login
 # ============================================================================
@@ -1016,7 +1062,7 @@ def device_login():
         
         now = datetime.utcnow()
         
-        if activation_code.expiration_date and activation_code.expiration_date < now:
+        if not is_subscription_active(activation_code, now):
             return jsonify({
                 'success': False,
                 'message': 'Subscription has expired'
@@ -1050,10 +1096,8 @@ def device_login():
         # يمكن استخدام JWT أو توليد token بسيط
         session_token = secrets.token_urlsafe(32)
         
-        # تحديث آخر تسجيل دخول للجهاز
-        device.last_login_at = now
-        device.last_ip = request.remote_addr
-        db.session.commit()
+        # تحديث آخر تسجيل دخول للجهاز (يُكتب دفعة واحدة في الخلفية)
+        record_device_activity(device, request.remote_addr, now)
         
         # ============================================================================
         # 8️⃣ إرجاع البيانات (مع البلايليسترات المفعلة فقط)
@@ -1164,7 +1208,7 @@ def get_stream_token():
             print(f'❌ No activation code for user {device.user_id}')
             return jsonify({'success': False, 'message': 'No active subscription'}), 403
             
-        if activation.expiration_date and safe_datetime_compare(activation.expiration_date, now):
+        if not is_subscription_active(activation):
             print(f'❌ Subscription expired for user {device.user_id}: {activation.expiration_date}')
             return jsonify({'success': False, 'message': 'Subscription expired'}), 403
         
@@ -1247,7 +1291,7 @@ def stream_playlist():
         # التحقق من صلاحية الاشتراك
         activation = ActivationCode.query.filter_by(assigned_user_id=device.user_id).first()
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             print(f'❌ Subscription not active for user {device.user_id}')
             return jsonify({'success': False, 'message': 'Subscription expired'}), 403
         
@@ -1422,7 +1466,7 @@ def iptv_player():
         activation_code = ActivationCode.query.get(device.activation_code_id)
         now = datetime.now(timezone.utc)
         
-        if not activation_code or (activation_code.expiration_date and safe_datetime_compare(activation_code.expiration_date, now)):
+        if not is_subscription_active(activation_code):
             print(f"⚠️ اشتراك منتهي: {device_uid}")
             return jsonify({
                 'error': 'اشتراكك منتهي الصلاحية'
@@ -1502,7 +1546,7 @@ def stream_play():
         activation = ActivationCode.query.filter_by(assigned_user_id=device.user_id).first()
         now = datetime.now(timezone.utc)
         
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             print(f"⚠️ محاولة تشغيل مع اشتراك منتهي: {device_uid}")
             return jsonify({
                 'success': False,
@@ -1510,10 +1554,8 @@ def stream_play():
                 'error_code': 'SUBSCRIPTION_INVALID'
             }), 403
         
-        # 📝 تحديث نشاط الجهاز
-        device.last_login_at = now
-        device.last_ip = request.remote_addr
-        db.session.commit()
+        # 📝 تحديث نشاط الجهاز (يُكتب دفعة واحدة في الخلفية)
+        record_device_activity(device, request.remote_addr)
         
         # 📝 تسجيل النشاط
         log_user_action(
@@ -1598,24 +1640,23 @@ def stream_live():
         # ✅ التحقق من الاشتراك
         activation = ActivationCode.query.filter_by(assigned_user_id=device.user_id).first()
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             return jsonify({'success': False, 'error': 'Subscription expired'}), 403
         
         # 📡 الرابط بدون جلب
         stream_url = play_data.get('stream_url')
         content_name = play_data.get('content_name', 'Stream')
         
-        # ✅ تسجيل المشاهدة
-        device.last_login_at = now
-        device.last_ip = request.remote_addr
-        db.session.commit()
+        # ✅ تسجيل المشاهدة (يُكتب دفعة واحدة في الخلفية)
+        record_device_activity(device, request.remote_addr)
         
         # 📊 تسجيل في audit
         log_user_action(
             device.user_id,
             'view_stream',
             f'Viewed: {content_name}',
-            request.remote_addr
+            resource_type='device',
+            resource_id=device.id
         )
         
         print(f"✅ تصريح البث: {content_name} → {stream_url}")
@@ -1653,7 +1694,7 @@ def live_tv_page():
         # التحقق من الاشتراك
         activation = get_activation_for_user(device.user_id)
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             template = get_template_path('live-tv.html')
             return render_template(template, error='Subscription expired')
         
@@ -1683,7 +1724,7 @@ def movies_page():
         # التحقق من الاشتراك
         activation = get_activation_for_user(device.user_id)
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             template = get_template_path('movies.html')
             return render_template(template, error='Subscription expired')
         
@@ -1715,7 +1756,7 @@ def series_details_page():
         # التحقق من الاشتراك
         activation = get_activation_for_user(device.user_id)
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             template = get_template_path('series-details.html')
             return render_template(template, error='Subscription expired')
         
@@ -1745,7 +1786,7 @@ def series_page():
         # التحقق من الاشتراك
         activation = get_activation_for_user(device.user_id)
         now = datetime.now(timezone.utc)
-        if not activation or (activation.expiration_date and safe_datetime_compare(activation.expiration_date, now)):
+        if not is_subscription_active(activation):
             template = get_template_path('series.html')
             return render_template(template, error='Subscription expired')
         
@@ -1894,7 +1935,10 @@ def disable_subscription():
         
         # إيقاف الاشتراك (تعيين تاريخ انتهاء في الماضي)
         activation.expiration_date = datetime.utcnow()
+        activation.status = STATUS_SUSPENDED
         db.session.commit()
+        invalidate_timeline(activation.reseller_id)
+        bump_data_version(activation.reseller_id)
         
         # إيقاف جميع أجهزة المستخدم
         if user_id:
@@ -1945,13 +1989,15 @@ def get_device_status():
         
         subscription_status = 'unknown'
         if activation:
-            if activation.expiration_date > datetime.utcnow():
+            if is_subscription_active(activation):
                 subscription_status = 'active'
             else:
                 subscription_status = 'expired'
         else:
             subscription_status = 'none'
         
+        last_login_at, last_ip = get_device_last_seen(device)
+        
         return jsonify({
             'success': True,
             'device': {
@@ -1959,8 +2005,8 @@ def get_device_status():
                 'device_name': device.device_name,
                 'is_active': device.is_active,
                 'disabled_reason': device.disabled_reason,
-                'last_login_at': device.last_login_at.isoformat() if device.last_login_at else None,
-                'last_ip': device.last_ip,
+                'last_login_at': last_login_at.isoformat() if last_login_at else None,
+                'last_ip': last_ip,
                 'created_at': device.created_at.isoformat() if device.created_at else None
             },
             'subscription': {
@@ -0,0 +1,208 @@
+"""
+إحصائيات السجلات الأمنية المحدثة تدريجياً
+
+المشكلة:
+- عدد محاولات الدخول الفاشلة وأعلى عناوين IP كانت تحسب من كل جدول audit_log
+  عند كل فتح لصفحة السجلات الأمنية
+
+الحل:
+- جدول security_counters: عداد لكل (action أو IP، ساعة)
+- يتم تحديثه مع كل دفعة سجلات تكتب (UPSERT في نفس الـ transaction)
+- النوافذ (ساعة، يوم، أسبوع) = مجموع عدد ثابت من الساعات (حتى 168 ساعة) مهما كبر السجل
+- الساعات الأقدم من أكبر نافذة تحذف دورياً
+- أمر rebuild لإعادة بناء العدادات من السجلات المخزنة
+
+ملاحظة: النافذة = الـ bucket الحالي + مدة النافذة كاملة قبله
+- 24h و 7d بدقة الساعة (تغطي حتى ساعة إضافية)
+- 1h من عدادات بدقة 5 دقائق (kind + '_5m') فتغطي 60 إلى 65 دقيقة
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, or_, and_
+from models import db, SecurityCounter
+from performance_helper import upsert_increment
+import background_tasks
+
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7)
+}
+
+HOUR_BUCKET = timedelta(hours=1)
+FINE_BUCKET = timedelta(minutes=5)
+FINE_SUFFIX = '_5m'
+# النوافذ التي تقرأ من عدادات الـ 5 دقائق
+FINE_WINDOWS = {'1h'}
+
+# نحتفظ بساعة إضافية حتى تبقى نافذة 7d كاملة عند بداية كل ساعة
+RETENTION = WINDOWS['7d'] + HOUR_BUCKET
+FINE_RETENTION = WINDOWS['1h'] + FINE_BUCKET
+
+
+def bucket_start(dt, size=HOUR_BUCKET):
+    """بداية الـ bucket (ساعة أو 5 دقائق) الذي يقع فيه الوقت"""
+    if size == HOUR_BUCKET:
+        return dt.replace(minute=0, second=0, microsecond=0)
+    step = int(size.total_seconds() // 60)
+    return dt.replace(minute=dt.minute - dt.minute % step, second=0, microsecond=0)
+
+
+def _window_kind(kind, window):
+    return kind + FINE_SUFFIX if window in FINE_WINDOWS else kind
+
+
+def _window_start(window, now=None):
+    """بداية أول bucket في النافذة (الحالي غير مكتمل فنضيف مدة النافذة كاملة قبله)"""
+    now = now or datetime.utcnow()
+    size = FINE_BUCKET if window in FINE_WINDOWS else HOUR_BUCKET
+    return bucket_start(now, size) - WINDOWS[window]
+
+
+def _aggregate(rows, fine_cutoff=None):
+    """تجميع السجلات إلى عدادات (kind, key, bucket_start) -> count بالساعة وبالـ 5 دقائق"""
+    counts = {}
+    for row in rows:
+        created_at = row['created_at']
+        buckets = [('', bucket_start(created_at))]
+        if fine_cutoff is None or created_at >= fine_cutoff:
+            buckets.append((FINE_SUFFIX, bucket_start(created_at, FINE_BUCKET)))
+        for kind, value in (('action', row.get('action')), ('ip', row.get('ip_address'))):
+            if not value:
+                continue
+            for suffix, bucket in buckets:
+                key = (kind + suffix, str(value)[:100], bucket)
+                counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def _upsert_counts(connection, counts):
+    return upsert_increment(
+        connection,
+        SecurityCounter.__table__,
+        [{'kind': kind, 'key': key, 'bucket_start': bucket, 'count': count}
+         for (kind, key, bucket), count in counts.items()],
+        key_columns=['kind', 'key', 'bucket_start'],
+        increment_columns=['count']
+    )
+
+
+def record_rows(connection, rows):
+    """
+    تحديث العدادات لدفعة سجلات (تستدعى من audit_store.insert_rows بنفس الاتصال)
+
+    rows: سجلات بصيغة log_action مع created_at
+    """
+    now = datetime.utcnow()
+    cutoff = bucket_start(now) - RETENTION
+    counts = _aggregate(
+        (row for row in rows if row['created_at'] >= cutoff),
+        fine_cutoff=bucket_start(now, FINE_BUCKET) - FINE_RETENTION
+    )
+    return _upsert_counts(connection, counts)
+
+
+# ============================================================================
+# القراءة
+# ============================================================================
+
+def get_count(kind, key, window='24h'):
+    """عدد أحداث مفتاح واحد في نافذة (مثلاً action=FAILED_LOGIN)"""
+    return db.session.execute(
+        select(func.coalesce(func.sum(SecurityCounter.count), 0)).where(
+            SecurityCounter.kind == _window_kind(kind, window),
+            SecurityCounter.key == key,
+            SecurityCounter.bucket_start >= _window_start(window)
+        )
+    ).scalar()
+
+
+def get_action_counts(action):
+    """عدد أحداث action في كل النوافذ: {'1h': n, '24h': n, '7d': n}"""
+    return {window: get_count('action', action, window) for window in WINDOWS}
+
+
+def get_top(kind, window='7d', limit=3):
+    """أعلى المفاتيح تكراراً في نافذة: [(key, count), ...]"""
+    total = func.sum(SecurityCounter.count)
+    rows = db.session.execute(
+        select(SecurityCounter.key, total.label('total')).where(
+            SecurityCounter.kind == _window_kind(kind, window),
+            SecurityCounter.bucket_start >= _window_start(window)
+        ).group_by(SecurityCounter.key).order_by(total.desc()).limit(limit)
+    )
+    return [(row.key, int(row.total)) for row in rows]
+
+
+# ============================================================================
+# الصيانة
+# ============================================================================
+
+def prune_counters():
+    """حذف الساعات التي خرجت من كل النوافذ (والـ 5 دقائق التي خرجت من نافذة 1h)"""
+    now = datetime.utcnow()
+    cutoff = bucket_start(now) - RETENTION
+    fine_cutoff = bucket_start(now, FINE_BUCKET) - FINE_RETENTION
+    with db.engine.begin() as connection:
+        result = connection.execute(
+            SecurityCounter.__table__.delete().where(or_(
+                SecurityCounter.bucket_start < cutoff,
+                and_(SecurityCounter.kind.like(f'%{FINE_SUFFIX}'), SecurityCounter.bucket_start < fine_cutoff)
+            ))
+        )
+    return result.rowcount
+
+
+def rebuild_counters(batch_size=5000):
+    """
+    إعادة بناء العدادات من السجلات المخزنة في الجداول الشهرية
+
+    الأحداث التي تكتب أثناء إعادة البناء قد تحسب مرتين، لذلك يفضل تشغيله في وقت هادئ
+    """
+    import audit_store
+
+    now = datetime.utcnow()
+    start = bucket_start(now) - RETENTION
+    fine_cutoff = bucket_start(now, FINE_BUCKET) - FINE_RETENTION
+    counts = {}
+
+    for partition in audit_store.partitions_for_range(start, None):
+        table = audit_store.partition_table(partition.month_key)
+        with db.engine.connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(
+                select(table.c.created_at, table.c.action_id, table.c.ip_address).where(
+                    table.c.created_at >= start
+                )
+            )
+            for row in result:
+                for key, count in _aggregate([{
+                    'created_at': row.created_at,
+                    'action': audit_store.decode('action', row.action_id),
+                    'ip_address': row.ip_address
+                }], fine_cutoff=fine_cutoff).items():
+                    counts[key] = counts.get(key, 0) + count
+
+    with db.engine.begin() as connection:
+        connection.execute(SecurityCounter.__table__.delete())
+        _upsert_counts(connection, counts)
+
+    return len(counts)
+
+
+background_tasks.register_periodic('security_counters_prune', 3600, prune_counters)
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+
+    with app.app_context():
+        db.create_all()
+        if command == 'rebuild':
+            print(f"✅ تمت إعادة بناء {rebuild_counters()} عداد")
+        elif command == 'prune':
+            print(f"✅ تم حذف {prune_counters()} عداد قديم")
+        else:
+            print("الاستخدام: python security_stats.py [rebuild|prune]")
@@ -1,7 +1,8 @@
 let allUsers = [];
 const usersFromFlask = window.usersData || [];
 
-async function processUsers() {
+function processUsers() {
+    // عدد الأجهزة والحالة يأتيان من الصفحة مباشرة (بدون طلب لكل مستخدم)
     allUsers = usersFromFlask.map(user => ({
         id: user.id,
         username: user.username,
@@ -9,26 +10,11 @@ async function processUsers() {
         created_at: user.created_at,
         activation_code: user.activation_code,
         expiration_date: user.expiration_date,
-        status: 'Inactive'
+        devices: user.devices,
+        is_active: user.is_active,
+        status: user.is_active ? 'Active' : 'Inactive'
     }));
     
-    for (let user of allUsers) {
-        try {
-            const response = await fetch(`/reseller/api/users/${user.id}`);
-            const result = await response.json();
-            
-            if (result.success) {
-                const data = result.data;
-                user.devices = data.devices ? `${data.devices.length} / 1` : '0 / 1';
-                user.is_active = data.is_active;
-                user.status = data.is_active ? 'Active' : 'Inactive';
-            }
-        } catch (error) {
-            console.warn(`Failed to fetch details for user ${user.id}:`, error);
-            user.devices = '0 / 1';
-        }
-    }
-    
     renderUsers();
 }
 
@@ -353,16 +339,15 @@ function showNotification(message, type = 'info') {
 document.addEventListener('DOMContentLoaded', function() {
     processUsers();
     
+    // البحث على الخادم (Enter) لأن الصفحة تعرض جزءاً من المستخدمين فقط
     const searchInput = document.querySelector('.users-search');
     if (searchInput) {
-        searchInput.addEventListener('input', function(e) {
-            const searchTerm = e.target.value.toLowerCase();
-            document.querySelectorAll('tbody tr').forEach(row => {
-                const email = row.querySelector('.user-email-cell').textContent.toLowerCase();
-                const id = row.querySelector('.user-id-cell').textContent.toLowerCase();
-                const matches = email.includes(searchTerm) || id.includes(searchTerm);
-                row.style.display = matches ? 'table-row' : 'none';
-            });
+        searchInput.addEventListener('keydown', function(e) {
+            if (e.key !== 'Enter') return;
+            const params = new URLSearchParams(window.location.search);
+            params.set('q', e.target.value.trim());
+            params.delete('page');
+            window.location.search = params.toString();
         });
     }
 });
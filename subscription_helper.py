@@ -0,0 +1,114 @@
+"""
+حالة الاشتراك المخزنة (activation_codes.status)
+
+المشكلة:
+- حالة الاشتراك (نشط / منتهي) كانت تحسب في Python بمقارنة expiration_date في كل مكان
+- لوحة تحكم الموزع كانت تحمل كل أكواد الموزع لعد المنتهي منها
+
+الحل:
+- عمود status مفهرس: pending, active, expired, suspended
+- يحدث عند التفعيل / الإيقاف / إعادة التفعيل
+- مهمة دورية تنقل الاشتراكات المنتهية إلى expired بـ UPDATE واحد
+- العد والفلترة أصبحا SQL على فهرس (reseller_id, status)
+"""
+
+from datetime import datetime, timezone
+from sqlalchemy import update, case
+from models import db, ActivationCode
+from config import SUBSCRIPTION_SWEEP_INTERVAL
+from performance_helper import ensure_columns
+import background_tasks
+
+STATUS_PENDING = 'pending'
+STATUS_ACTIVE = 'active'
+STATUS_EXPIRED = 'expired'
+STATUS_SUSPENDED = 'suspended'
+
+# مدة الاشتراك وخصم النقاط لكل نوع
+SUBSCRIPTION_PLANS = {
+    '1year': {'duration_months': 12, 'points': 1, 'days': 365, 'is_lifetime': False},
+    # 120 شهر لمدى الحياة (10 سنوات)، وتاريخ الانتهاء بعد 100 سنة
+    'lifetime': {'duration_months': 120, 'points': 2, 'days': 365 * 100, 'is_lifetime': True}
+}
+
+# النص المعروض في صفحات الموزع والتصدير
+STATUS_LABELS = {
+    STATUS_PENDING: 'Not Activated',
+    STATUS_ACTIVE: 'Active',
+    STATUS_EXPIRED: 'Expired',
+    STATUS_SUSPENDED: 'Suspended'
+}
+
+
+def _utc_naive(dt):
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def is_subscription_active(activation_code, now=None):
+    """
+    هل الاشتراك صالح الآن
+
+    status يكفي في الغالب، ومقارنة التاريخ تغطي الفترة بين انتهاء الاشتراك
+    ومرور المهمة الدورية التالية
+    """
+    if not activation_code or activation_code.status != STATUS_ACTIVE:
+        return False
+    expiration_date = _utc_naive(activation_code.expiration_date)
+    return expiration_date is None or expiration_date > (now or datetime.utcnow())
+
+
+def status_label(activation_code):
+    """النص المعروض لحالة الاشتراك"""
+    if activation_code.status == STATUS_ACTIVE and not is_subscription_active(activation_code):
+        return STATUS_LABELS[STATUS_EXPIRED]
+    return STATUS_LABELS.get(activation_code.status, activation_code.status)
+
+
+def sweep_expired_subscriptions():
+    """
+    نقل الاشتراكات المنتهية إلى expired (UPDATE واحد على فهرس status, expiration_date)
+
+    وأيضاً تصحيح الصفوف المفعلة التي ما زالت pending (صفوف أقدم من عمود status)
+    """
+    now = datetime.utcnow()
+    table = ActivationCode.__table__
+
+    with db.engine.begin() as connection:
+        backfilled = connection.execute(
+            update(table).where(
+                table.c.status == STATUS_PENDING,
+                table.c.activated_at.isnot(None)
+            ).values(status=case(
+                (table.c.expiration_date < now, STATUS_EXPIRED),
+                else_=STATUS_ACTIVE
+            ))
+        ).rowcount
+
+        expired = connection.execute(
+            update(table).where(
+                table.c.status == STATUS_ACTIVE,
+                table.c.expiration_date < now
+            ).values(status=STATUS_EXPIRED, updated_at=now)
+        ).rowcount
+
+    if backfilled:
+        print(f"🔄 تم تحديد حالة {backfilled} اشتراك قديم")
+    if expired:
+        print(f"⌛ انتهت صلاحية {expired} اشتراك")
+    return expired
+
+
+def ensure_subscription_status():
+    """
+    إضافة عمود status لقاعدة قديمة وتحديد حالة الصفوف الموجودة فوراً
+
+    العمود يضاف بقيمة pending لكل الصفوف، فبدون التحديد هنا تظهر كل الاشتراكات
+    المفعلة منتهية حتى أول مرور للمهمة الدورية (أو دائماً إذا كانت المهام معطلة)
+    """
+    ensure_columns(ActivationCode, 'status')
+    return sweep_expired_subscriptions()
+
+
+background_tasks.register_periodic('subscription_expiry_sweep', SUBSCRIPTION_SWEEP_INTERVAL, sweep_expired_subscriptions)
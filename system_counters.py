@@ -0,0 +1,435 @@
+"""
+عدادات لوحة المسؤول المحدثة مع كل تغيير (system_counters)
+
+المشكلة:
+- dashboard() كان يعمل count() على resellers و users و devices و SUM على reseller_topups
+  عند كل فتح للصفحة (قراءة كاملة للجداول في PostgreSQL مع ملايين الصفوف)
+
+الحل:
+- جدول system_counters: صف لكل عداد
+  (resellers, users, active_devices, revenue_cents:YYYY-MM بالسنت حتى يبقى العداد صحيحاً)
+- أحداث الـ ORM (after_insert / after_delete / after_update) تجمع التغييرات لكل flush
+  ثم UPSERT واحد في نفس الـ transaction (الـ rollback يلغي الزيادة أيضاً)
+- مهمة مطابقة دورية تصحح أي فرق (تغييرات بـ SQL مباشر لا تمر على الـ ORM)
+- بعد أي commit غيّر العدادات: إرسال القيم الجديدة عبر Socket.IO للغرفة admin_dashboard
+- نفس الأحداث تحدث reseller_metrics لكل موزع (المستخدمون، الأجهزة النشطة، الشحنات، آخر شحن)
+  لقائمة الموزعين عند المسؤول (ترتيب بأي مقياس بدون تجميع الجداول مع كل صفحة)
+
+ملاحظة: الإيرادات الشهرية حسب created_at بتوقيت UTC
+"""
+
+import threading
+from datetime import datetime
+from sqlalchemy import event, select, func, update, inspect, or_
+from sqlalchemy.orm import object_session
+from flask import current_app
+from models import db, SystemCounter, ResellerMetrics, Reseller, User, Device, ResellerTopUp
+from performance_helper import upsert_increment
+import background_tasks
+from config import SYSTEM_COUNTERS_RECONCILE_INTERVAL, SYSTEM_COUNTERS_PUSH_INTERVAL
+
+RESELLERS = 'resellers'
+USERS = 'users'
+ACTIVE_DEVICES = 'active_devices'
+
+DASHBOARD_ROOM = 'admin_dashboard'
+
+_PENDING_KEY = 'system_counter_deltas'
+_CHANGED_KEY = 'system_counters_changed'
+_RESELLER_PENDING_KEY = 'reseller_metric_deltas'
+_LAST_TOPUP_KEY = 'reseller_last_topups'
+_DELETED_RESELLERS_KEY = 'deleted_reseller_ids'
+
+_METRIC_COLUMNS = ['user_count', 'active_devices', 'topup_count']
+
+_changed = threading.Event()  # تغيرت العدادات منذ آخر إرسال عبر Socket.IO
+
+
+def revenue_counter(dt):
+    """اسم عداد إيرادات الشهر (بالسنت)"""
+    return f"revenue_cents:{dt.strftime('%Y-%m')}"
+
+
+def _cents(amount):
+    return int(round((amount or 0) * 100))
+
+
+def _month_start(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(dt):
+    return dt.replace(year=dt.year + 1, month=1) if dt.month == 12 else dt.replace(month=dt.month + 1)
+
+
+def _previous_month(dt):
+    return dt.replace(year=dt.year - 1, month=12) if dt.month == 1 else dt.replace(month=dt.month - 1)
+
+
+# ============================================================================
+# التحديث مع الـ ORM
+# ============================================================================
+
+def _add_delta(target, name, delta):
+    if not delta:
+        return
+    session = object_session(target)
+    if session is None:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    pending[name] = pending.get(name, 0) + delta
+
+
+def _add_reseller_delta(target, reseller_id, column, delta):
+    """تغيير مقياس موزع (delta = 0 ينشئ صف المقاييس فقط)"""
+    session = object_session(target)
+    if session is None or reseller_id is None:
+        return
+    pending = session.info.setdefault(_RESELLER_PENDING_KEY, {})
+    metrics = pending.setdefault(reseller_id, dict.fromkeys(_METRIC_COLUMNS, 0))
+    metrics[column] += delta
+
+
+def _device_reseller_id(connection, target):
+    return connection.execute(select(User.reseller_id).where(User.id == target.user_id)).scalar()
+
+
+def _committed_value(target, attribute):
+    """القيمة قبل التعديل الحالي (القيمة المخزنة في القاعدة)"""
+    history = inspect(target).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(target, attribute)
+
+
+def _device_counted(is_active, is_deleted):
+    """الجهاز النشط: is_active وغير محذوف (is_active الفارغ = القيمة الافتراضية True)"""
+    return is_active is not False and not is_deleted
+
+
+@event.listens_for(Reseller, 'after_insert')
+def _reseller_inserted(mapper, connection, target):
+    _add_delta(target, RESELLERS, 1)
+    _add_reseller_delta(target, target.id, 'user_count', 0)
+
+
+@event.listens_for(Reseller, 'before_delete')
+def _reseller_deleting(mapper, connection, target):
+    # صف المقاييس يحذف قبل الموزع (Foreign Key) ولا يعاد إنشاؤه من تغييرات نفس الـ flush
+    connection.execute(ResellerMetrics.__table__.delete().where(ResellerMetrics.reseller_id == target.id))
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_DELETED_RESELLERS_KEY, set()).add(target.id)
+
+
+@event.listens_for(Reseller, 'after_delete')
+def _reseller_deleted(mapper, connection, target):
+    _add_delta(target, RESELLERS, -1)
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    _add_delta(target, USERS, 1)
+    _add_reseller_delta(target, target.reseller_id, 'user_count', 1)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _add_delta(target, USERS, -1)
+    _add_reseller_delta(target, _committed_value(target, 'reseller_id'), 'user_count', -1)
+
+
+@event.listens_for(Device, 'after_insert')
+def _device_inserted(mapper, connection, target):
+    if _device_counted(target.is_active, target.is_deleted):
+        _add_delta(target, ACTIVE_DEVICES, 1)
+        _add_reseller_delta(target, _device_reseller_id(connection, target), 'active_devices', 1)
+
+
+@event.listens_for(Device, 'after_update')
+def _device_updated(mapper, connection, target):
+    before = _device_counted(_committed_value(target, 'is_active'), _committed_value(target, 'is_deleted'))
+    after = _device_counted(target.is_active, target.is_deleted)
+    delta = int(after) - int(before)
+    if delta:
+        _add_delta(target, ACTIVE_DEVICES, delta)
+        _add_reseller_delta(target, _device_reseller_id(connection, target), 'active_devices', delta)
+
+
+@event.listens_for(Device, 'after_delete')
+def _device_deleted(mapper, connection, target):
+    if _device_counted(_committed_value(target, 'is_active'), _committed_value(target, 'is_deleted')):
+        _add_delta(target, ACTIVE_DEVICES, -1)
+        _add_reseller_delta(target, _device_reseller_id(connection, target), 'active_devices', -1)
+
+
+@event.listens_for(ResellerTopUp, 'after_insert')
+def _topup_inserted(mapper, connection, target):
+    created_at = target.created_at or datetime.utcnow()
+    _add_delta(target, revenue_counter(created_at), _cents(target.amount_usd))
+    _add_reseller_delta(target, target.reseller_id, 'topup_count', 1)
+
+    session = object_session(target)
+    if session is not None:
+        last_topups = session.info.setdefault(_LAST_TOPUP_KEY, {})
+        current = last_topups.get(target.reseller_id)
+        if current is None or current[0] <= created_at:
+            last_topups[target.reseller_id] = (created_at, target.amount_usd)
+
+
+@event.listens_for(ResellerTopUp, 'after_delete')
+def _topup_deleted(mapper, connection, target):
+    _add_delta(target, revenue_counter(target.created_at or datetime.utcnow()), -_cents(target.amount_usd))
+
+
+def _write_reseller_metrics(session):
+    """UPSERT واحد لمقاييس الموزعين المتغيرة + آخر شحن (الموزعون المحذوفون في الـ flush يتجاهلون)"""
+    pending = session.info.pop(_RESELLER_PENDING_KEY, None) or {}
+    last_topups = session.info.pop(_LAST_TOPUP_KEY, None) or {}
+    deleted = session.info.pop(_DELETED_RESELLERS_KEY, None) or set()
+
+    rows = [dict(metrics, reseller_id=reseller_id)
+            for reseller_id, metrics in pending.items() if reseller_id not in deleted]
+    if not rows:
+        return
+    connection = session.connection()
+    upsert_increment(connection, ResellerMetrics.__table__, rows,
+                     key_columns=['reseller_id'], increment_columns=_METRIC_COLUMNS)
+
+    for reseller_id, (created_at, amount) in last_topups.items():
+        if reseller_id in deleted:
+            continue
+        connection.execute(
+            ResellerMetrics.__table__.update().where(
+                ResellerMetrics.reseller_id == reseller_id,
+                or_(ResellerMetrics.last_topup_at.is_(None), ResellerMetrics.last_topup_at <= created_at)
+            ).values(last_topup_at=created_at, last_topup_amount=amount)
+        )
+
+
+@event.listens_for(db.session, 'after_flush')
+def _write_deltas(session, flush_context):
+    """UPSERT واحد لكل تغييرات الـ flush (داخل نفس الـ transaction)"""
+    _write_reseller_metrics(session)
+
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    rows = [{'name': name, 'value': delta} for name, delta in pending.items() if delta]
+    if rows:
+        upsert_increment(session.connection(), SystemCounter.__table__, rows,
+                         key_columns=['name'], increment_columns=['value'])
+        session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _mark_changed(session):
+    if session.info.pop(_CHANGED_KEY, False):
+        _changed.set()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    for key in (_PENDING_KEY, _CHANGED_KEY, _RESELLER_PENDING_KEY, _LAST_TOPUP_KEY, _DELETED_RESELLERS_KEY):
+        session.info.pop(key, None)
+
+
+# ============================================================================
+# القراءة
+# ============================================================================
+
+def get_counters(now=None):
+    """عدادات اللوحة في Query واحد (الإيرادات بالدولار للشهر الحالي)"""
+    now = now or datetime.utcnow()
+    revenue_name = revenue_counter(now)
+    values = dict(db.session.execute(
+        select(SystemCounter.name, SystemCounter.value).where(
+            SystemCounter.name.in_([RESELLERS, USERS, ACTIVE_DEVICES, revenue_name])
+        )
+    ).all())
+
+    return {
+        'total_resellers': int(values.get(RESELLERS, 0)),
+        'total_users': int(values.get(USERS, 0)),
+        'active_devices': int(values.get(ACTIVE_DEVICES, 0)),
+        'monthly_revenue': round(values.get(revenue_name, 0) / 100.0, 2)
+    }
+
+
+# ============================================================================
+# المطابقة
+# ============================================================================
+
+def _actual_counts(now):
+    """القيم الصحيحة من الجداول (نفس الـ queries القديمة للوحة) - للمطابقة فقط"""
+    month_start = _month_start(now)
+    actual = {
+        RESELLERS: db.session.execute(select(func.count(Reseller.id))).scalar() or 0,
+        USERS: db.session.execute(select(func.count(User.id))).scalar() or 0,
+        ACTIVE_DEVICES: db.session.execute(
+            select(func.count(Device.id)).where(
+                func.coalesce(Device.is_active, True) == True,
+                func.coalesce(Device.is_deleted, False) == False
+            )
+        ).scalar() or 0
+    }
+
+    # الشهر الحالي والسابق (الشهور الأقدم لا تظهر في اللوحة)
+    for start in (_previous_month(month_start), month_start):
+        total = db.session.execute(
+            select(func.coalesce(func.sum(ResellerTopUp.amount_usd), 0)).where(
+                ResellerTopUp.created_at >= start,
+                ResellerTopUp.created_at < _next_month(start)
+            )
+        ).scalar()
+        actual[revenue_counter(start)] = _cents(total)
+    return actual
+
+
+def reconcile_counters(now=None):
+    """
+    مقارنة العدادات بالجداول وتصحيح أي فرق (الجداول هي المرجع)
+
+    التغييرات التي تحدث أثناء المطابقة قد تسبب فرقاً صغيراً يصحح في المرة التالية
+    يعيد قائمة الفروقات
+    """
+    now = now or datetime.utcnow()
+    actual = _actual_counts(now)
+    stored = dict(db.session.execute(
+        select(SystemCounter.name, SystemCounter.value).where(SystemCounter.name.in_(list(actual)))
+    ).all())
+
+    mismatches = [{
+        'name': name,
+        'stored': int(stored.get(name, 0)),
+        'actual': int(value)
+    } for name, value in actual.items() if stored.get(name) != value]
+
+    for mismatch in mismatches:
+        if mismatch['name'] in stored:
+            print(f"⚠️ عداد غير مطابق {mismatch['name']}: {mismatch['stored']} (المخزن) ≠ {mismatch['actual']}")
+            db.session.execute(
+                update(SystemCounter).where(SystemCounter.name == mismatch['name']).values(
+                    value=mismatch['actual']
+                ).execution_options(synchronize_session=False)
+            )
+        else:
+            db.session.add(SystemCounter(name=mismatch['name'], value=mismatch['actual']))
+
+    if mismatches:
+        db.session.commit()
+        _changed.set()
+    return mismatches
+
+
+def _actual_reseller_metrics():
+    """المقاييس الصحيحة لكل موزع من الجداول (Query مجمع لكل مقياس) - للمطابقة فقط"""
+    actual = {
+        reseller_id: {'user_count': 0, 'active_devices': 0, 'topup_count': 0,
+                      'last_topup_at': None, 'last_topup_amount': None}
+        for reseller_id in db.session.execute(select(Reseller.id)).scalars()
+    }
+
+    for reseller_id, count in db.session.execute(
+        select(User.reseller_id, func.count(User.id)).group_by(User.reseller_id)
+    ):
+        if reseller_id in actual:
+            actual[reseller_id]['user_count'] = count
+
+    for reseller_id, count in db.session.execute(
+        select(User.reseller_id, func.count(Device.id)).join(User, User.id == Device.user_id).where(
+            func.coalesce(Device.is_active, True) == True,
+            func.coalesce(Device.is_deleted, False) == False
+        ).group_by(User.reseller_id)
+    ):
+        if reseller_id in actual:
+            actual[reseller_id]['active_devices'] = count
+
+    row_number = func.row_number().over(
+        partition_by=ResellerTopUp.reseller_id,
+        order_by=(ResellerTopUp.created_at.desc(), ResellerTopUp.id.desc())
+    ).label('row_number')
+    count = func.count(ResellerTopUp.id).over(partition_by=ResellerTopUp.reseller_id).label('topups')
+    ranked = select(
+        ResellerTopUp.reseller_id, ResellerTopUp.created_at, ResellerTopUp.amount_usd, count, row_number
+    ).subquery()
+    for reseller_id, created_at, amount, topups, _ in db.session.execute(
+        select(ranked).where(ranked.c.row_number == 1)
+    ):
+        if reseller_id in actual:
+            actual[reseller_id].update(topup_count=topups, last_topup_at=created_at, last_topup_amount=amount)
+
+    return actual
+
+
+def reconcile_reseller_metrics():
+    """مقارنة reseller_metrics بالجداول وتصحيح أي فرق - يعيد عدد الموزعين المصححين"""
+    actual = _actual_reseller_metrics()
+    stored = {metrics.reseller_id: metrics for metrics in ResellerMetrics.query.all()}
+
+    fixed = 0
+    for reseller_id, values in actual.items():
+        metrics = stored.get(reseller_id)
+        if metrics is None:
+            db.session.add(ResellerMetrics(reseller_id=reseller_id, **values))
+            fixed += 1
+        elif any(getattr(metrics, key) != value for key, value in values.items()):
+            print(f"⚠️ مقاييس غير مطابقة للموزع {reseller_id}")
+            for key, value in values.items():
+                setattr(metrics, key, value)
+            fixed += 1
+
+    if fixed:
+        db.session.commit()
+    return fixed
+
+
+def ensure_system_counters():
+    """بناء العدادات ومقاييس الموزعين عند أول تشغيل بعد إضافة الجداول"""
+    built = 0
+    if not db.session.execute(select(SystemCounter.name).limit(1)).first():
+        built = len(reconcile_counters())
+        print(f"📊 تم بناء عدادات لوحة المسؤول: {built} عداد")
+    if not db.session.execute(select(ResellerMetrics.reseller_id).limit(1)).first():
+        metrics = reconcile_reseller_metrics()
+        print(f"📊 تم بناء مقاييس الموزعين: {metrics} موزع")
+        built += metrics
+    return built
+
+
+# ============================================================================
+# Socket.IO
+# ============================================================================
+
+def push_counters():
+    """إرسال العدادات لصفحات اللوحة المفتوحة إذا تغيرت منذ آخر إرسال"""
+    if not _changed.is_set():
+        return False
+    _changed.clear()
+
+    socketio = current_app.extensions.get('socketio')
+    if socketio is None:
+        return False
+    try:
+        socketio.emit('system_counters', get_counters(), to=DASHBOARD_ROOM)
+    except Exception as e:
+        print(f"⚠️ تعذر إرسال عدادات اللوحة عبر Socket.IO: {str(e)}")
+        return False
+    return True
+
+
+background_tasks.register_periodic('system_counters_reconcile', SYSTEM_COUNTERS_RECONCILE_INTERVAL, reconcile_counters)
+background_tasks.register_periodic('reseller_metrics_reconcile', SYSTEM_COUNTERS_RECONCILE_INTERVAL, reconcile_reseller_metrics)
+background_tasks.register_periodic('system_counters_push', SYSTEM_COUNTERS_PUSH_INTERVAL, push_counters)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        db.create_all()
+        mismatches = reconcile_counters()
+        fixed = reconcile_reseller_metrics()
+        print(f"✅ المطابقة انتهت: {len(mismatches)} فرق في العدادات، {fixed} موزع مصحح")
@@ -0,0 +1,123 @@
+"""
+إعدادات الاختبارات المشتركة
+
+- تطبيق Flask مستقل (بدون app.py) بقاعدة SQLite في الذاكرة أو في ملف مؤقت
+- المهام الدورية معطلة حتى لا تعمل threads خلفية أثناء الاختبارات
+- عداد Queries عبر before_cursor_execute
+"""
+
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+os.environ.setdefault('BACKGROUND_TASKS_ENABLED', 'False')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from flask_wtf.csrf import CSRFProtect  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from models import db, Reseller  # noqa: E402
+from activation_code_helper import outstanding_codes  # noqa: E402
+from audit_helper import audit_pipeline  # noqa: E402
+import audit_store  # noqa: E402
+import device_notify_helper  # noqa: E402
+
+
+def create_test_app(database_uri):
+    """نفس إعدادات app.py مع قاعدة بيانات الاختبار والـ blueprints فقط"""
+    from routes.admin import admin_bp
+    from routes.reseller import reseller_bp, dashboard_stats_cache
+    from routes.users import users_bp
+
+    app = Flask('servo_tests', root_path=ROOT)
+    app.config.update(
+        SECRET_KEY='test-secret-key',
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        WTF_CSRF_ENABLED=False
+    )
+    db.init_app(app)
+    CSRFProtect(app)  # csrf_token() في القوالب
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(reseller_bp, url_prefix='/reseller')
+    app.register_blueprint(users_bp)
+
+    # الحالة المشتركة في ذاكرة العملية تبدأ فارغة لكل اختبار
+    outstanding_codes._codes = {}
+    outstanding_codes._loaded = False
+    dashboard_stats_cache._data.clear()
+    with device_notify_helper._lock:
+        device_notify_helper._notices.clear()
+    # جداول الأشهر والقاموس تنشأ من جديد في كل قاعدة اختبار
+    audit_store._ensured_partitions.clear()
+    audit_store._dictionary.clear()
+    audit_store._dictionary_values.clear()
+    audit_store._dictionary_loaded = False
+    audit_pipeline._retry = []
+    audit_pipeline._retry_rows = 0
+    while not audit_pipeline._queue.empty():
+        audit_pipeline._queue.get_nowait()
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def app():
+    """تطبيق بقاعدة في الذاكرة (اختبارات بدون threads)"""
+    app = create_test_app('sqlite://')
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    """تطبيق بقاعدة في ملف (اختبارات متزامنة: اتصال لكل thread)"""
+    app = create_test_app(f"sqlite:///{tmp_path / 'test.db'}")
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def create_reseller(name='reseller', points=100):
+    reseller = Reseller(name=name, email=f'{name}@example.com', password_hash='x', points_balance=points)
+    db.session.add(reseller)
+    db.session.commit()
+    return reseller.id
+
+
+def login_reseller(client, reseller_id):
+    with client.session_transaction() as flask_session:
+        flask_session['reseller_id'] = reseller_id
+
+
+class QueryCounter:
+    """عدد الـ Queries المنفذة على engine (من كل الـ threads)"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
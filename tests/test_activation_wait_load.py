@@ -0,0 +1,84 @@
+"""
+اختبار حمل: شاشات التفعيل المنتظرة (تكرار device/login مقابل wait-activation)
+
+نفس عدد الأجهزة ونفس المدة:
+- الطريقة القديمة: كل جهاز يستدعي /api/device/login كل POLL_INTERVAL
+- الطريقة الجديدة: طلب long-poll واحد لكل جهاز، ونصف الأجهزة تفعل أثناء الانتظار
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+
+from models import db, DeviceActivationCode
+from device_notify_helper import publish_activation
+from conftest import count_queries
+
+DEVICES = 20
+WINDOW = 1.0  # ثواني (= timeout الـ long-poll)
+POLL_INTERVAL = 0.1
+
+
+def _create_waiting_devices(app):
+    with app.app_context():
+        db.session.add_all([DeviceActivationCode(
+            activation_code=f'{100000 + index}',
+            device_id=f'tv-{index}',
+            expires_at=datetime.utcnow() + timedelta(minutes=10)
+        ) for index in range(DEVICES)])
+        db.session.commit()
+    return [f'tv-{index}' for index in range(DEVICES)]
+
+
+def _run_devices(device_ids, target):
+    results = {}
+    threads = [threading.Thread(target=target, args=(device_id, results)) for device_id in device_ids]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_long_poll_replaces_polling_queries(file_app):
+    device_ids = _create_waiting_devices(file_app)
+    with file_app.app_context():
+        engine = db.engine
+
+    def poll_login(device_id, results):
+        client = file_app.test_client()
+        deadline = time.monotonic() + WINDOW
+        polls = 0
+        while time.monotonic() < deadline:
+            client.post('/api/device/login', json={'device_id': device_id})
+            polls += 1
+            time.sleep(POLL_INTERVAL)
+        results[device_id] = polls
+
+    with count_queries(engine) as polling:
+        threads, polls = _run_devices(device_ids, poll_login)
+        for thread in threads:
+            thread.join()
+
+    def wait_activation(device_id, results):
+        response = file_app.test_client().get(
+            f'/api/device/wait-activation?device_id={device_id}&timeout={int(WINDOW)}'
+        )
+        results[device_id] = response.get_json()['activated']
+
+    activated_ids = device_ids[:DEVICES // 2]
+    with count_queries(engine) as long_poll:
+        threads, activated = _run_devices(device_ids, wait_activation)
+        time.sleep(0.2)
+        with file_app.app_context():
+            for device_id in activated_ids:
+                publish_activation(device_id, {'device_id': device_id})
+        for thread in threads:
+            thread.join()
+
+    print(f"\npolling: {sum(polls.values())} requests / {polling.count} queries | "
+          f"long-poll: {DEVICES} requests / {long_poll.count} queries")
+
+    assert all(activated[device_id] for device_id in activated_ids)
+    assert not any(activated[device_id] for device_id in device_ids[DEVICES // 2:])
+    # الأجهزة المفعلة لا تلمس القاعدة، والباقي Query واحد عند انتهاء الانتظار
+    assert long_poll.count <= DEVICES - len(activated_ids)
+    assert polling.count >= sum(polls.values()) >= DEVICES * 5
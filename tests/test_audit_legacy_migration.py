@@ -0,0 +1,32 @@
+"""
+نقل سجلات audit_log القديمة إلى الجداول الشهرية (ensure_schema عند أول طلب)
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from models import db, AuditLog
+import audit_store
+
+
+def test_legacy_rows_move_to_monthly_tables_once(app):
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.add_all([AuditLog(
+            actor_type='reseller', actor_id=1, action='login' if index % 2 else f'Suspended user u{index}',
+            description=f'legacy {index}', ip_address='10.0.0.1', created_at=now - timedelta(days=index * 20)
+        ) for index in range(7)])
+        db.session.commit()
+
+        assert audit_store.migrate_legacy_rows(batch_size=3) == 7
+        assert db.session.query(func.count(AuditLog.id)).scalar() == 0
+        # تكرار الاستدعاء (عملية أخرى أو إعادة تشغيل) لا ينقل شيئاً
+        assert audit_store.migrate_legacy_rows(batch_size=3) == 0
+
+        records, cursor = audit_store.search_logs(limit=50)
+        assert cursor is None
+        assert sorted(record.description for record in records if record.action == 'login') == \
+            ['legacy 1', 'legacy 3', 'legacy 5']
+        # النص الحر القديم في action يحفظ كـ other مع النص في description
+        assert {record.action for record in records} == {'login', 'other'}
+        assert len(records) == 7
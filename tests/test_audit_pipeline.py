@@ -0,0 +1,61 @@
+"""
+طابور سجلات التدقيق أثناء انقطاع القاعدة: الذاكرة محدودة والطابور لا يتوقف عن التفريغ
+"""
+
+import threading
+
+from audit_helper import AuditPipeline
+
+
+class FlakyPipeline(AuditPipeline):
+    """_insert يفشل ما دامت القاعدة معطلة ويحفظ السجلات المكتوبة"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.database_down = True
+        self.rows = []
+
+    def _insert(self, rows):
+        if self.database_down:
+            raise ConnectionError('database is down')
+        self.rows.extend(rows)
+
+
+def _row(action, index):
+    return {'action': action, 'actor_type': 'user', 'actor_id': index}
+
+
+def test_outage_keeps_retry_buffer_bounded():
+    pipeline = FlakyPipeline(maxsize=100, batch_size=10, max_retries=1000, max_retry_rows=200)
+
+    def produce(offset):
+        for index in range(500):
+            pipeline.submit(_row('update_playlist', offset + index))
+            pipeline.submit(_row('PLAYER_OPENED', offset + index))
+            if index % 7 == 0:
+                pipeline.submit(_row('login', offset + index))  # كتابة متزامنة
+
+    for round_number in range(3):
+        threads = [threading.Thread(target=produce, args=(thread * 10000 + round_number * 1000,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pipeline.flush()
+
+        stats = pipeline.stats()
+        # الطابور يفرغ إلى قائمة الإعادة حتى أثناء الانقطاع
+        assert stats['queued'] == 0
+        assert stats['pending_retry'] <= 200
+        assert sum(len(batch) for batch, _ in pipeline._retry) == stats['pending_retry']
+
+    assert pipeline.stats()['dropped'] > 0
+    # أحداث المشاهدة تحذف قبل غيرها
+    kept_actions = {row['action'] for batch, _ in pipeline._retry for row in batch}
+    assert 'PLAYER_OPENED' not in kept_actions
+
+    pending = pipeline.stats()['pending_retry']
+    pipeline.database_down = False
+    assert pipeline.flush() == pending
+    assert pipeline.stats()['pending_retry'] == 0
+    assert len(pipeline.rows) == pending
@@ -0,0 +1,80 @@
+"""
+إحصائيات لوحة تحكم الموزع: Query واحد مهما كان عدد الأكواد + كاش
+
+DASHBOARD_BENCH_SIZES يغير الأحجام المقاسة، وقياس الزمن حتى مليون كود في
+benchmarks/dashboard_stats_latency.py
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+from models import db, ActivationCode
+from routes.reseller import get_dashboard_stats, invalidate_dashboard_stats
+from subscription_helper import STATUS_ACTIVE, STATUS_EXPIRED, STATUS_SUSPENDED
+from conftest import create_reseller, count_queries
+
+SIZES = [int(size) for size in os.getenv('DASHBOARD_BENCH_SIZES', '100,20000').split(',')]
+
+
+def _insert_codes(reseller_id, count):
+    """ثلث الأكواد اليوم، ثلث أمس (منتهية)، والباقي قبل شهر (كل خامس كود منها موقوف)"""
+    now = datetime.utcnow()
+    ages = [timedelta(0), timedelta(days=1), timedelta(days=30)]
+    statuses = {0: STATUS_ACTIVE, 1: STATUS_EXPIRED, 2: STATUS_ACTIVE}
+    rows = []
+    for index in range(count):
+        created_at = now - ages[index % 3]
+        status = statuses[index % 3]
+        if index % 3 == 2 and index % 5 == 0:
+            status = STATUS_SUSPENDED
+        rows.append({
+            'code': f'{reseller_id}-{index}',
+            'reseller_id': reseller_id,
+            'duration_months': 12,
+            'activated_at': created_at,
+            'expiration_date': created_at + timedelta(days=365),
+            'status': status,
+            'created_at': created_at
+        })
+        if len(rows) == 10000:
+            db.session.execute(insert(ActivationCode), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(ActivationCode), rows)
+    db.session.commit()
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_dashboard_stats_single_query(app, size):
+    with app.app_context():
+        reseller_id = create_reseller(name=f'reseller{size}')
+        _insert_codes(reseller_id, size)
+
+        with count_queries(db.engine) as cold:
+            started = time.perf_counter()
+            stats = get_dashboard_stats(reseller_id)
+            cold_ms = (time.perf_counter() - started) * 1000
+
+        with count_queries(db.engine) as cached:
+            started = time.perf_counter()
+            assert get_dashboard_stats(reseller_id) == stats
+            cached_ms = (time.perf_counter() - started) * 1000
+
+        invalidate_dashboard_stats(reseller_id)
+        with count_queries(db.engine) as invalidated:
+            get_dashboard_stats(reseller_id)
+
+        print(f"\n{size} codes: {cold.count} query {cold_ms:.1f}ms | cached {cached.count} queries {cached_ms:.3f}ms")
+
+        assert cold.count == 1
+        assert cached.count == 0
+        assert invalidated.count == 1
+        assert stats['total_activations'] == size
+        assert stats['today_activations'] == len(range(0, size, 3))
+        suspended = len([index for index in range(2, size, 3) if index % 5 == 0])
+        assert stats['expired_subscriptions'] == len(range(1, size, 3))
+        assert stats['suspended_subscriptions'] == suspended
+        assert stats['active_subscriptions'] == size - stats['expired_subscriptions'] - suspended
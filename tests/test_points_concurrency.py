@@ -0,0 +1,69 @@
+"""
+اختبار ضغط: تفعيلات متزامنة لنفس الموزع (خصم النقاط الذري)
+
+كل الطلبات تبدأ معاً وعدد الأكواد أكبر من الرصيد:
+- الرصيد لا يصبح سالباً
+- عدد التفعيلات الناجحة = النقاط المخصومة (بدون صرف نفس النقطة مرتين)
+- مجموع حركات points_ledger = الرصيد المخزن
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from models import db, Reseller, ActivationCode, DeviceActivationCode, PointsLedger
+from points_helper import reconcile_balances
+from conftest import create_reseller, login_reseller
+
+BALANCE = 10
+REQUESTS = 30
+
+
+def test_concurrent_activations_never_overspend(file_app):
+    with file_app.app_context():
+        reseller_id = create_reseller(points=BALANCE)
+        db.session.add_all([DeviceActivationCode(
+            activation_code=f'{200000 + index}',
+            device_id=f'tv-{index}',
+            expires_at=datetime.utcnow() + timedelta(minutes=10)
+        ) for index in range(REQUESTS)])
+        db.session.commit()
+
+    barrier = threading.Barrier(REQUESTS)
+    statuses = []
+
+    def activate(index):
+        client = file_app.test_client()
+        login_reseller(client, reseller_id)
+        barrier.wait()
+        response = client.post('/reseller/api/activate-code', json={
+            'activationCode': f'{200000 + index}',
+            'subscriptionDuration': '1year'
+        })
+        statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=activate, args=(index,)) for index in range(REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with file_app.app_context():
+        balance = db.session.get(Reseller, reseller_id).points_balance
+        activations = db.session.query(func.count(ActivationCode.id)).filter_by(reseller_id=reseller_id).scalar()
+        ledger_debits = db.session.query(func.count(PointsLedger.id)).filter(
+            PointsLedger.reseller_id == reseller_id, PointsLedger.delta < 0
+        ).scalar()
+        mismatches = reconcile_balances()
+
+    succeeded = statuses.count(201)
+    print(f"\n{REQUESTS} concurrent activations in {elapsed:.2f}s "
+          f"({REQUESTS / elapsed:.0f} req/s): {succeeded} succeeded, balance {BALANCE} -> {balance}")
+
+    assert balance >= 0
+    assert succeeded <= BALANCE
+    assert BALANCE - balance == succeeded == activations == ledger_debits
+    assert mismatches == []
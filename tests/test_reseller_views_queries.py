@@ -0,0 +1,67 @@
+"""
+صفحات مستخدمي وأجهزة الموزع: عدد الـ Queries ثابت مهما كان عدد المستخدمين (بدون N+1)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from models import db, User, Device, ActivationCode
+from subscription_helper import STATUS_ACTIVE
+from conftest import create_reseller, login_reseller, count_queries
+
+SMALL, LARGE = 3, 30
+
+
+def _seed_users(reseller_id, count):
+    """مستخدمون لكل منهم جهازان وكودان"""
+    now = datetime.utcnow()
+    user_ids = []
+    for index in range(count):
+        user = User(username=f'user-{reseller_id}-{index}', reseller_id=reseller_id)
+        db.session.add(user)
+        for number in range(2):
+            db.session.add(Device(
+                user=user, device_uid=f'tv-{reseller_id}-{index}-{number}',
+                device_type='tv', media_link='http://example.com/list.m3u'
+            ))
+            db.session.add(ActivationCode(
+                code=f'code-{reseller_id}-{index}-{number}', reseller_id=reseller_id, assigned_user=user,
+                duration_months=12, activated_at=now, status=STATUS_ACTIVE,
+                expiration_date=now + timedelta(days=365), created_at=now - timedelta(days=number)
+            ))
+        db.session.flush()
+        user_ids.append(user.id)
+    db.session.commit()
+    return user_ids
+
+
+def _count_page_queries(app, reseller_id, url):
+    client = app.test_client()
+    login_reseller(client, reseller_id)
+    with app.app_context():
+        engine = db.engine
+    with count_queries(engine) as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter.count
+
+
+@pytest.mark.parametrize('url', [
+    '/reseller/users?per_page=100',
+    '/reseller/DeviceActivation?per_page=100',
+    '/reseller/api/reseller-playlists',
+    '/reseller/api/users/{user_id}'
+])
+def test_reseller_views_query_count_is_flat(app, url):
+    with app.app_context():
+        small_reseller = create_reseller(name='small')
+        large_reseller = create_reseller(name='large')
+        small_user = _seed_users(small_reseller, SMALL)[0]
+        large_user = _seed_users(large_reseller, LARGE)[0]
+
+    small = _count_page_queries(app, small_reseller, url.format(user_id=small_user))
+    large = _count_page_queries(app, large_reseller, url.format(user_id=large_user))
+
+    print(f"\n{url}: {small} queries for {SMALL} users, {large} queries for {LARGE} users")
+    assert large == small
+    assert small <= 5
@@ -0,0 +1,29 @@
+"""
+نوافذ السجلات الأمنية: "آخر ساعة" لا تشمل أحداث الساعة السابقة كاملة
+"""
+
+from datetime import datetime, timedelta
+
+import security_stats
+from models import db
+
+
+def test_last_hour_uses_five_minute_buckets(app):
+    now = datetime.utcnow()
+    ages = [timedelta(minutes=2), timedelta(minutes=50), timedelta(minutes=70), timedelta(minutes=110)]
+    with app.app_context():
+        with db.engine.begin() as connection:
+            security_stats.record_rows(connection, [
+                {'created_at': now - age, 'action': 'FAILED_LOGIN', 'ip_address': '10.0.0.1'} for age in ages
+            ])
+
+        counts = security_stats.get_action_counts('FAILED_LOGIN')
+        top_last_hour = security_stats.get_top('ip', window='1h')
+
+        assert counts['1h'] == 2
+        assert counts['24h'] == counts['7d'] == 4
+        assert top_last_hour == [('10.0.0.1', 2)]
+
+        # التنظيف لا يحذف buckets ما زالت داخل النوافذ
+        security_stats.prune_counters()
+        assert security_stats.get_action_counts('FAILED_LOGIN') == counts
@@ -0,0 +1,56 @@
+"""
+ترقية قاعدة قديمة (activation_codes بدون عمود status)
+
+الاشتراكات المفعلة تبقى نشطة مباشرة بعد الترقية، بدون انتظار المهمة الدورية
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, Column, insert
+from models import db, ActivationCode
+from performance_helper import ensure_indexes
+from subscription_helper import (
+    ensure_subscription_status, is_subscription_active, STATUS_ACTIVE, STATUS_EXPIRED, STATUS_PENDING
+)
+from conftest import create_reseller
+
+
+def _create_legacy_table():
+    """جدول activation_codes كما كان قبل إضافة status"""
+    ActivationCode.__table__.drop(db.engine)
+    legacy = Table('activation_codes', MetaData(), *[
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in ActivationCode.__table__.columns if column.name != 'status'
+    ])
+    legacy.create(db.engine)
+    return legacy
+
+
+def test_upgrade_keeps_activated_subscriptions_active(app):
+    now = datetime.utcnow()
+    with app.app_context():
+        reseller_id = create_reseller()
+        legacy = _create_legacy_table()
+        with db.engine.begin() as connection:
+            connection.execute(insert(legacy).values(
+                reseller_id=reseller_id, duration_months=12, max_devices=1
+            ), [
+                {'code': 'active', 'activated_at': now - timedelta(days=10),
+                 'expiration_date': now + timedelta(days=355)},
+                {'code': 'expired', 'activated_at': now - timedelta(days=400),
+                 'expiration_date': now - timedelta(days=35)},
+                {'code': 'unused', 'activated_at': None, 'expiration_date': None}
+            ])
+
+        ensure_subscription_status()
+        ensure_indexes(ActivationCode)
+
+        codes = {code.code: code for code in ActivationCode.query.all()}
+        assert codes['active'].status == STATUS_ACTIVE
+        assert is_subscription_active(codes['active'])
+        assert codes['expired'].status == STATUS_EXPIRED
+        assert codes['unused'].status == STATUS_PENDING
+
+        # مرة ثانية لا تغير شيئاً
+        ensure_subscription_status()
+        assert ActivationCode.query.filter_by(status=STATUS_ACTIVE).count() == 1
@@ -5,10 +5,11 @@
 أو: gunicorn wsgi:app للإنتاج
 """
 
-from app import app, db, socketio
+from app import app, db, socketio, ensure_schema
 
 # إذا كنت تريد تشغيل التطبيق من هنا
+# (مع gunicorn يتم تحديث المخطط مع أول طلب في كل عملية - ensure_schema)
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        ensure_schema()
     socketio.run(app, debug=True)